@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class AiDjangoAppConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'ai_app'
+
+    def ready(self):
+        from ai_app import signals  # noqa: F401
@@ -0,0 +1,142 @@
+import tempfile
+import time
+
+from django.core.management.base import BaseCommand
+import numpy as np
+
+from ai_app.services.ann_index import (
+    HISTORY_INDEX,
+    PASSAGES_INDEX,
+    IVFIndex,
+    get_ann_index,
+    get_ann_settings,
+)
+from ai_app.services.vector_store import QuantizedVectors, top_k
+
+
+def synthetic_vectors(count, dim, clusters, rng):
+    """Unit vectors scattered around random cluster centres, roughly the
+    shape of sentence embeddings"""
+    centres = rng.standard_normal((clusters, dim)).astype(np.float32)
+    vectors = centres[rng.integers(clusters, size=count)]
+    vectors += 0.6 * rng.standard_normal((count, dim)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def timed(search, queries):
+    results, latencies = [], []
+    for query in queries:
+        started_at = time.perf_counter()
+        results.append(search(query)[0])
+        latencies.append(time.perf_counter() - started_at)
+    return results, np.asarray(latencies) * 1000
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare recall@k and query latency of 8-bit scans and an IVF index "
+        "against exact float search"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--index",
+            choices=[PASSAGES_INDEX, HISTORY_INDEX],
+            help="Benchmark a built index, querying with perturbed copies of its "
+            "own vectors",
+        )
+        parser.add_argument(
+            "--synthetic",
+            type=int,
+            default=100_000,
+            help="Otherwise build a throwaway index over this many random vectors",
+        )
+        parser.add_argument("--dim", type=int, default=384)
+        parser.add_argument("--queries", type=int, default=200)
+        parser.add_argument("--k", type=int, default=10)
+        parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 4, 8, 16, 32])
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = np.random.default_rng(options["seed"])
+        conf = get_ann_settings()
+        with tempfile.TemporaryDirectory() as path:
+            if options["index"]:
+                index = get_ann_index(options["index"])
+                if index is None:
+                    self.stderr.write(f"No {options['index']} index has been built")
+                    return
+                _, vectors = index.all_vectors()
+            else:
+                vectors = synthetic_vectors(
+                    options["synthetic"],
+                    options["dim"],
+                    max(1, options["synthetic"] // 500),
+                    rng,
+                )
+                started_at = time.perf_counter()
+                index = IVFIndex.build(
+                    path,
+                    vectors,
+                    np.arange(len(vectors)),
+                    conf["NPROBE"],
+                    conf["LISTS_PER_SQRT"],
+                    options["seed"],
+                )
+                self.stdout.write(
+                    f"Built {len(index.centroids)} lists over {len(vectors)} "
+                    f"vectors in {time.perf_counter() - started_at:.1f}s"
+                )
+            if not len(vectors):
+                self.stderr.write("The index is empty")
+                return
+
+            sample = vectors[rng.integers(len(vectors), size=options["queries"])]
+            queries = sample + 0.3 * rng.standard_normal(sample.shape).astype(
+                np.float32
+            ) / np.sqrt(sample.shape[1])
+            queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+            self.run(index, queries, options["k"], options["nprobe"])
+
+    def run(self, index, queries, k, nprobes):
+        ids, vectors = index.all_vectors()
+        quantized = QuantizedVectors.quantize(vectors)
+        self.stdout.write(
+            f"float32 vectors {vectors.nbytes / 2**20:.1f} MiB, "
+            f"8-bit codes {quantized.nbytes / 2**20:.1f} MiB"
+        )
+
+        exact, latencies = timed(lambda q: index.exact_search(q, k), queries)
+        self.stdout.write(
+            f"{'search':<16}{'recall@' + str(k):>10}{'mean ms':>10}{'p95 ms':>10}"
+        )
+        self.report("exact", 1.0, latencies)
+
+        def recall(results):
+            return np.mean(
+                [
+                    len(np.intersect1d(r, e)) / max(len(e), 1)
+                    for r, e in zip(results, exact)
+                ]
+            )
+
+        searches = [
+            ("int8 scan", lambda q: (ids[top_k(quantized.scores(q), k)],)),
+            ("int8 + re-rank", lambda q: (ids[quantized.search(q, k)[0]],)),
+        ]
+        for nprobe in nprobes:
+            searches.append(
+                (
+                    f"ivf nprobe={nprobe}",
+                    lambda q, nprobe=nprobe: index.search(q, k, nprobe=nprobe),
+                )
+            )
+        for name, search in searches:
+            results, latencies = timed(search, queries)
+            self.report(name, recall(results), latencies)
+
+    def report(self, name, recall, latencies):
+        self.stdout.write(
+            f"{name:<16}{recall:>10.3f}{latencies.mean():>10.3f}"
+            f"{np.percentile(latencies, 95):>10.3f}"
+        )
@@ -0,0 +1,79 @@
+import time
+
+from django.core.management.base import BaseCommand
+import numpy as np
+
+from ai_app.models.history import History
+from ai_app.services.ann_index import HISTORY_INDEX, PASSAGES_INDEX, build_ann_index
+from ai_app.services.corpus_store import CorpusStore, get_corpus_store_settings
+from ai_app.services.embeddings import embed_texts, embeddings_available
+
+BATCH_SIZE = 256
+
+
+class Command(BaseCommand):
+    help = (
+        "Build the IVF nearest-neighbour indexes over corpus passage embeddings "
+        "and history prompts, folding in rows inserted since the last build"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--index",
+            choices=[PASSAGES_INDEX, HISTORY_INDEX, "all"],
+            default="all",
+        )
+
+    def handle(self, *args, **options):
+        if options["index"] in (PASSAGES_INDEX, "all"):
+            self.build_passages()
+        if options["index"] in (HISTORY_INDEX, "all"):
+            self.build_history()
+
+    def report(self, name, index, started_at):
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Indexed {len(index)} {name} vectors in {len(index.centroids)} "
+                f"lists in {time.perf_counter() - started_at:.1f}s"
+            )
+        )
+
+    def build_passages(self):
+        store = CorpusStore.open(get_corpus_store_settings()["PATH"])
+        if store is None or store.embeddings is None:
+            self.stdout.write(
+                self.style.WARNING(
+                    "No corpus embeddings, run `python manage.py build_corpus_store` "
+                    "with the embedding model available first"
+                )
+            )
+            return
+        started_at = time.perf_counter()
+        try:
+            index = build_ann_index(
+                PASSAGES_INDEX, np.arange(len(store)), store.embeddings
+            )
+        finally:
+            store.close()
+        self.report(PASSAGES_INDEX, index, started_at)
+
+    def build_history(self):
+        if not embeddings_available():
+            self.stdout.write(
+                self.style.WARNING("Embedding model unavailable, skipping history")
+            )
+            return
+        started_at = time.perf_counter()
+        ids, vectors = [], []
+        rows = History.objects.order_by("pk").values_list("pk", "prompt")
+        for start in range(0, rows.count(), BATCH_SIZE):
+            batch = list(rows[start : start + BATCH_SIZE])
+            ids.extend(pk for pk, _ in batch)
+            vectors.append(embed_texts([prompt for _, prompt in batch]))
+        dim = vectors[0].shape[1] if vectors else len(embed_texts([""])[0])
+        index = build_ann_index(
+            HISTORY_INDEX,
+            np.asarray(ids, dtype=np.int64),
+            np.concatenate(vectors) if vectors else np.empty((0, dim)),
+        )
+        self.report(HISTORY_INDEX, index, started_at)
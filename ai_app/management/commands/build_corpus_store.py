@@ -0,0 +1,45 @@
+import time
+
+from django.core.management.base import BaseCommand
+from ai_app.services.corpus_store import get_corpus_store_builder
+from ai_app.services.embeddings import embeddings_available
+
+
+class Command(BaseCommand):
+    help = (
+        "Chunk and embed datasets/spiritual_texts into the memory-mapped corpus store"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--force",
+            action="store_true",
+            help="Re-process every file, even if its content hasn't changed",
+        )
+        parser.add_argument(
+            "--no-embeddings",
+            action="store_true",
+            help="Only store the chunk text",
+        )
+
+    def handle(self, *args, **options):
+        builder = get_corpus_store_builder()
+        embed = not options["no_embeddings"]
+        if embed and not embeddings_available():
+            self.stdout.write(
+                self.style.WARNING(
+                    "Embedding model unavailable, storing chunk text only"
+                )
+            )
+
+        started_at = time.perf_counter()
+        stats = builder.build(embed=embed, force=options["force"])
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Stored {stats['chunks']} chunks in {builder.path} "
+                f"({stats['processed']} files processed, {stats['reused']} unchanged, "
+                f"{stats['embedded']} embedded, {stats['removed']} removed"
+                f"{', BM25 index rebuilt' if stats['indexed'] else ''}) "
+                f"in {time.perf_counter() - started_at:.1f}s"
+            )
+        )
@@ -34,6 +34,7 @@ class Command(BaseCommand):
                 - Draw from mystics like Meister Eckhart, Julian of Norwich, and John of the Cross
                 """,
                 "collaboration_triggers": "divine union, contemplation, trinity, incarnation, mystical theology, theosis",
+                "source_texts": "Hildegard Writings, augustine city of god and christian doctrine",
                 "collaborators": [
                     "Quantum Philosopher",
                     "Void Explorer",
@@ -53,6 +54,7 @@ class Command(BaseCommand):
                 - Question the nature of time, causality, and free will
                 """,
                 "collaboration_triggers": "quantum mechanics, reality, consciousness, observation, causality, parallel universes",
+                "source_texts": "Machine_Super_Intelligence, Hidden Nature - The Startling Insights of Viktor Schauberger - by Alick Bartholomew, Knowledge of the Higher Worlds - by Rudolf Steiner",
                 "collaborators": ["Void Explorer", "Alchemist"],
             },
             {
@@ -69,6 +71,7 @@ class Command(BaseCommand):
                 - Bridge material and spiritual principles
                 """,
                 "collaboration_triggers": "transformation, evolution, transmutation, mystical science, consciousness evolution",
+                "source_texts": "Kybalion, Collected Fruits of Occult Teaching by A.P.Sinnett (1920), book of illumination kaballah text",
                 "collaborators": [
                     "Existential Navigator",
                     "Quantum Philosopher",
@@ -89,6 +92,7 @@ class Command(BaseCommand):
                 - Navigate the tension between individual purpose and cosmic insignificance
                 """,
                 "collaboration_triggers": "existence, meaning, authenticity, freedom, identity, purpose, absurdity",
+                "source_texts": "dhammapada, way_of_virtue, lob",
                 "collaborators": [
                     "Void Explorer",
                     "Quantum Philosopher",
@@ -109,6 +113,7 @@ class Command(BaseCommand):
                 - Bridge emptiness with infinite possibility
                 """,
                 "collaboration_triggers": "void, emptiness, potential, nothingness, space, between",
+                "source_texts": "maha-yana_manual, buddhidm in its connexion with brahmanism, Kaivalya_Upanishad",
                 "collaborators": [
                     "Quantum Philosopher",
                     "Alchemist",
@@ -128,6 +133,7 @@ class Command(BaseCommand):
                 - Reveal the eternal nature of now
                 """,
                 "collaboration_triggers": "time, memory, temporal patterns, eternal now, cycles",
+                "source_texts": "7 Tablets of Creation, 7 Tablets of Creation vol 2, Popol Vuh, The Chaldean Account of Genesis - by George Smith, Aryan Sun Myths - Charles Morris (1889)",
                 "collaborators": [
                     "Quantum Philosopher",
                     "Void Explorer",
@@ -147,6 +153,7 @@ class Command(BaseCommand):
                 - Reveal the transformative power of spiritual discipline
                 """,
                 "collaboration_triggers": "silence, asceticism, contemplation, spiritual practice, monasticism, inner transformation",
+                "source_texts": "augustine city of god and christian doctrine, Secret Teachings of the Society of Jesus",
                 "collaborators": [
                     "Christian Mystic",
                     "Void Explorer",
@@ -167,6 +174,7 @@ class Command(BaseCommand):
                 - Bridge earthly and divine love through mystical insight
                 """,
                 "collaboration_triggers": "divine love, spiritual poetry, heart wisdom, ecstasy, spiritual stations",
+                "source_texts": "kitab i ilqan book of certitude, The Kitab I Aqdas, epistle to the son of the wolf",
                 "collaborators": ["Christian Mystic", "Alchemist"],
             },
             {
@@ -183,6 +191,7 @@ class Command(BaseCommand):
                 - Bridge individual and universal consciousness
                 """,
                 "collaboration_triggers": "consciousness, non-duality, self-inquiry, awareness, ultimate reality",
+                "source_texts": "Advaita_Vedanta, Bhagavad Gita, Kaivalya_Upanishad, Vedanta-sutras_with_the_commentary_by_Ramanuja_(Thibaut)_v1, yoga sutras patanjali",
                 "collaborators": [
                     "Void Explorer",
                     "Quantum Philosopher",
@@ -198,6 +207,7 @@ class Command(BaseCommand):
                 description=role_def["description"],
                 prompt_template=role_def["prompt_template"],
                 collaboration_triggers=role_def["collaboration_triggers"],
+                source_texts=role_def["source_texts"],
             )
             created_roles[role.name] = {
                 "instance": role,
@@ -0,0 +1,69 @@
+import time
+
+from asgiref.sync import iscoroutinefunction
+from django.utils.decorators import sync_and_async_middleware
+
+from ai_app.services.metrics import http_latency, http_requests
+
+
+def _labels(request):
+    match = getattr(request, "resolver_match", None)
+    view = match.url_name if match and match.url_name else "unmatched"
+    return {"view": view, "method": request.method}
+
+
+def _observe(request, response, started_at):
+    labels = _labels(request)
+    http_requests.inc(status=str(response.status_code), **labels)
+    http_latency.observe(time.perf_counter() - started_at, **labels)
+
+
+def _timed_stream(request, response, started_at):
+    """Re-wrap a streaming body so the request is timed until its last chunk"""
+    content = response.streaming_content
+    if response.is_async:
+
+        async def stream():
+            try:
+                async for chunk in content:
+                    yield chunk
+            finally:
+                _observe(request, response, started_at)
+
+    else:
+
+        def stream():
+            try:
+                yield from content
+            finally:
+                _observe(request, response, started_at)
+
+    response.streaming_content = stream()
+    return response
+
+
+@sync_and_async_middleware
+def metrics_middleware(get_response):
+    """Count requests and time them per view, including streamed bodies"""
+
+    def finish(request, response, started_at):
+        if getattr(response, "streaming", False):
+            return _timed_stream(request, response, started_at)
+        _observe(request, response, started_at)
+        return response
+
+    if iscoroutinefunction(get_response):
+
+        async def middleware(request):
+            started_at = time.perf_counter()
+            response = await get_response(request)
+            return finish(request, response, started_at)
+
+    else:
+
+        def middleware(request):
+            started_at = time.perf_counter()
+            response = get_response(request)
+            return finish(request, response, started_at)
+
+    return middleware
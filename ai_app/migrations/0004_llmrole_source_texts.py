@@ -0,0 +1,21 @@
+# Generated by Django 5.1.2 on 2026-10-18 09:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("ai_app", "0003_llmrole_collaboration_triggers_llmrole_collaborators"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="llmrole",
+            name="source_texts",
+            field=models.TextField(
+                blank=True,
+                help_text="Comma-separated names of texts in datasets/spiritual_texts to draw passages from; empty searches every text",
+            ),
+        ),
+    ]
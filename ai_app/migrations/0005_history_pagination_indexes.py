@@ -0,0 +1,31 @@
+# Generated by Django 5.1.2 on 2026-10-18 09:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("ai_app", "0004_llmrole_source_texts"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="history",
+            index=models.Index(
+                fields=["-created_at", "-id"], name="history_created_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="history",
+            index=models.Index(
+                fields=["role", "-created_at", "-id"], name="history_role_created_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="history",
+            index=models.Index(
+                fields=["user", "-created_at", "-id"], name="history_user_created_idx"
+            ),
+        ),
+    ]
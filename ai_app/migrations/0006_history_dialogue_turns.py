@@ -0,0 +1,34 @@
+# Generated by Django 5.1.2 on 2026-10-18 09:22
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("ai_app", "0005_history_pagination_indexes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="history",
+            name="dialogue_id",
+            field=models.UUIDField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="history",
+            name="turn",
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name="history",
+            name="role",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.CASCADE,
+                to="ai_app.llmrole",
+            ),
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 5.1.2 on 2026-10-18 09:48
+
+from django.db import migrations, models
+
+
+# The roles initialize_llm_roles creates without a max_tokens of their own
+INITIAL_ROLES = [
+    "Christian Mystic",
+    "Quantum Philosopher",
+    "Alchemist",
+    "Existential Navigator",
+    "Void Explorer",
+    "Time Weaver",
+    "Desert Father",
+    "Sufi Mystic",
+    "Vedantic Sage",
+]
+
+
+def raise_default_max_tokens(apps, schema_editor):
+    # Roles are now generated with their own max_tokens; 150 tokens cut off
+    # the ~150-word answers the prompts ask for. Only the initial roles are
+    # updated: another role on 150 may have been set to it on purpose
+    LLMRole = apps.get_model("ai_app", "LLMRole")
+    LLMRole.objects.filter(name__in=INITIAL_ROLES, max_tokens=150).update(
+        max_tokens=300
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("ai_app", "0006_history_dialogue_turns"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="llmrole",
+            name="max_tokens",
+            field=models.IntegerField(default=300),
+        ),
+        migrations.RunPython(raise_default_max_tokens, migrations.RunPython.noop),
+    ]
@@ -6,10 +6,27 @@ from ai_app.models.user import User
 
 class History(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
-    role = models.ForeignKey(LLMRole, on_delete=models.CASCADE)
+    # Null for turns no role wrote, like a dialogue's synthesis
+    role = models.ForeignKey(LLMRole, on_delete=models.CASCADE, null=True, blank=True)
     prompt = models.TextField()
     response = models.TextField()
     created_at = models.DateTimeField(auto_now_add=True)
+    # Turns of one full or streamed dialogue share a dialogue_id
+    dialogue_id = models.UUIDField(null=True, blank=True, db_index=True)
+    turn = models.PositiveIntegerField(null=True, blank=True)
+
+    class Meta:
+        # Keyset pagination in the history API walks (created_at, id)
+        # backwards, optionally within one role or user
+        indexes = [
+            models.Index(fields=["-created_at", "-id"], name="history_created_idx"),
+            models.Index(
+                fields=["role", "-created_at", "-id"], name="history_role_created_idx"
+            ),
+            models.Index(
+                fields=["user", "-created_at", "-id"], name="history_user_created_idx"
+            ),
+        ]
 
     def __str__(self):
-        return f"{self.user.username} - {self.role.name}"
+        return f"{self.user.username} - {self.role.name if self.role else 'Synthesis'}"
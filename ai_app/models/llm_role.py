@@ -6,7 +6,7 @@ class LLMRole(models.Model):
     description = models.TextField()
     prompt_template = models.TextField()
     model_name = models.CharField(max_length=100, default="gpt-3.5-turbo")
-    max_tokens = models.IntegerField(default=150)
+    max_tokens = models.IntegerField(default=300)
     temperature = models.FloatField(default=0.7)
     collaborators = models.ManyToManyField(
         "self",
@@ -19,6 +19,11 @@ class LLMRole(models.Model):
         blank=True,
         help_text="Keywords or patterns that suggest collaboration with this role",
     )
+    source_texts = models.TextField(
+        blank=True,
+        help_text="Comma-separated names of texts in datasets/spiritual_texts to "
+        "draw passages from; empty searches every text",
+    )
 
     def __str__(self):
         return self.name
@@ -0,0 +1,343 @@
+from concurrent.futures import ThreadPoolExecutor
+import json
+import logging
+import os
+import threading
+
+from django.conf import settings
+import numpy as np
+from sklearn.cluster import MiniBatchKMeans
+
+from ai_app.services.embeddings import embed_texts, embeddings_available
+from ai_app.services.vector_store import (
+    RERANK_FACTOR,
+    QuantizedVectors,
+    replace_npy,
+    top_k,
+)
+
+logger = logging.getLogger("ai_app")
+
+DEFAULT_ANN_SETTINGS = {
+    "ENABLED": True,
+    "PATH": os.path.join(settings.BASE_DIR, ".cache", "ann"),
+    "NPROBE": 8,
+    # Inverted lists per sqrt(vectors); 4 * sqrt(n) is the usual IVF default
+    "LISTS_PER_SQRT": 4,
+}
+
+PASSAGES_INDEX = "passages"
+HISTORY_INDEX = "history"
+
+META_FILE = "meta.json"
+CENTROIDS_FILE = "centroids.npy"
+LIST_OFFSETS_FILE = "list_offsets.npy"
+VECTORS_FILE = "vectors.npy"
+IDS_FILE = "ids.npy"
+DELTA_FILE = "delta.log"
+
+TRAINING_POINTS_PER_LIST = 32
+
+
+def get_ann_settings():
+    return {**DEFAULT_ANN_SETTINGS, **getattr(settings, "ANN_INDEX", {})}
+
+
+class IVFIndex:
+    """Inverted-file index for cosine search over unit vectors.
+
+    k-means centroids split the vectors into inverted lists, stored
+    contiguously in list order so a query scans the nprobe closest lists as
+    a few slices of memory-mapped 8-bit codes (see vector_store) and
+    re-ranks the best candidates with the float vectors. Inserts and
+    deletes are appended to delta.log as (id, vector) records, which every
+    process tails and scans exactly, until the next build folds them into
+    the lists.
+    """
+
+    def __init__(self, path, nprobe):
+        self.path = path
+        self.nprobe = nprobe
+        self._lock = threading.Lock()
+        self._load()
+
+    @classmethod
+    def build(cls, path, vectors, ids, nprobe, lists_per_sqrt=4, seed=0):
+        """Train and write a new index at path, replacing any existing one"""
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        ids = np.asarray(ids, dtype=np.int64)
+        os.makedirs(path, exist_ok=True)
+
+        count, dim = vectors.shape
+        nlist = min(count, max(1, int(lists_per_sqrt * np.sqrt(count))))
+        if count:
+            # A few dozen points per list place the centroids about as well as
+            # the whole set, and random initialisation skips k-means++, which
+            # dominates training time with a thousand lists or more
+            rng = np.random.default_rng(seed)
+            sample = vectors[
+                np.sort(rng.permutation(count)[: TRAINING_POINTS_PER_LIST * nlist])
+            ]
+            kmeans = MiniBatchKMeans(
+                n_clusters=nlist,
+                init="random",
+                batch_size=4096,
+                n_init=1,
+                max_iter=20,
+                random_state=seed,
+            ).fit(sample)
+            centroids = kmeans.cluster_centers_.astype(np.float32)
+            centroids /= np.maximum(
+                np.linalg.norm(centroids, axis=1, keepdims=True), 1e-12
+            )
+            assignments = np.argmax(vectors @ centroids.T, axis=1)
+        else:
+            centroids = np.zeros((0, dim), dtype=np.float32)
+            assignments = np.zeros(0, dtype=np.int64)
+
+        order = np.argsort(assignments, kind="stable")
+        list_offsets = np.zeros(len(centroids) + 1, dtype=np.int64)
+        np.cumsum(
+            np.bincount(assignments, minlength=len(centroids)), out=list_offsets[1:]
+        )
+
+        meta_path = os.path.join(path, META_FILE)
+        generation = 0
+        if os.path.exists(meta_path):
+            with open(meta_path) as f:
+                generation = json.load(f)["generation"] + 1
+
+        vectors = vectors[order]
+        for name, array in (
+            (CENTROIDS_FILE, centroids),
+            (LIST_OFFSETS_FILE, list_offsets),
+            (VECTORS_FILE, vectors),
+            (IDS_FILE, ids[order]),
+        ):
+            replace_npy(os.path.join(path, name), array)
+        QuantizedVectors.quantize(vectors).save(os.path.join(path, VECTORS_FILE))
+        open(os.path.join(path, DELTA_FILE + ".tmp"), "wb").close()
+        os.replace(
+            os.path.join(path, DELTA_FILE + ".tmp"), os.path.join(path, DELTA_FILE)
+        )
+
+        tmp = meta_path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump({"generation": generation, "dim": dim, "count": count}, f)
+        os.replace(tmp, meta_path)
+        return cls(path, nprobe)
+
+    @classmethod
+    def open(cls, path, nprobe):
+        """The index at path, or None if it hasn't been built"""
+        if not os.path.exists(os.path.join(path, META_FILE)):
+            return None
+        return cls(path, nprobe)
+
+    def _load(self):
+        with open(os.path.join(self.path, META_FILE)) as f:
+            meta = json.load(f)
+        self.generation = meta["generation"]
+        self.dim = meta["dim"]
+
+        def load(name):
+            return np.load(os.path.join(self.path, name), mmap_mode="r")
+
+        self.centroids = np.array(load(CENTROIDS_FILE))
+        self.list_offsets = np.array(load(LIST_OFFSETS_FILE))
+        self.quantized = QuantizedVectors.open(os.path.join(self.path, VECTORS_FILE))
+        self.vectors = self.quantized.vectors
+        self.ids = load(IDS_FILE)
+        self.deleted = set()
+        self.delta_ids = np.empty(0, dtype=np.int64)
+        self.delta_vectors = np.empty((0, self.dim), dtype=np.float32)
+        self._delta_position = 0
+
+    @property
+    def record_dtype(self):
+        return np.dtype([("id", "<i8"), ("vector", "<f4", (self.dim,))])
+
+    def _refresh(self):
+        """Pick up a rebuild or delta records written by other processes"""
+        with open(os.path.join(self.path, META_FILE)) as f:
+            generation = json.load(f)["generation"]
+        if generation != self.generation:
+            self._load()
+
+        delta_path = os.path.join(self.path, DELTA_FILE)
+        size = os.path.getsize(delta_path)
+        complete = size - size % self.record_dtype.itemsize
+        if complete <= self._delta_position:
+            return
+        with open(delta_path, "rb") as f:
+            f.seek(self._delta_position)
+            records = np.frombuffer(
+                f.read(complete - self._delta_position), dtype=self.record_dtype
+            )
+        self._delta_position = complete
+
+        # A negative id -(id + 1) is a tombstone for id
+        tombstones = records["id"] < 0
+        self.deleted.update((-records["id"][tombstones] - 1).tolist())
+        inserts = records[~tombstones]
+        self.delta_ids = np.concatenate([self.delta_ids, inserts["id"]])
+        self.delta_vectors = np.concatenate([self.delta_vectors, inserts["vector"]])
+
+    def _append(self, ids, vectors):
+        records = np.empty(len(ids), dtype=self.record_dtype)
+        records["id"] = ids
+        records["vector"] = vectors
+        with self._lock:
+            with open(os.path.join(self.path, DELTA_FILE), "ab") as f:
+                f.write(records.tobytes())
+
+    def add(self, ids, vectors):
+        self._append(
+            np.asarray(ids, dtype=np.int64), np.asarray(vectors, dtype=np.float32)
+        )
+
+    def remove(self, ids):
+        ids = np.asarray(ids, dtype=np.int64)
+        self._append(-ids - 1, np.zeros((len(ids), self.dim), dtype=np.float32))
+
+    def __len__(self):
+        with self._lock:
+            self._refresh()
+            return len(self.ids) + len(self.delta_ids) - len(self.deleted)
+
+    def _finish(self, ids, scores, k):
+        if self.deleted:
+            keep = ~np.isin(ids, list(self.deleted))
+            ids, scores = ids[keep], scores[keep]
+        top = top_k(scores, k)
+        return ids[top], scores[top]
+
+    def search(self, query, k, nprobe=None):
+        """(ids, cosine scores) of the approximate top k, best first"""
+        query = np.asarray(query, dtype=np.float32)
+        with self._lock:
+            self._refresh()
+            nprobe = min(nprobe or self.nprobe, len(self.centroids))
+            lists = top_k(self.centroids @ query, nprobe)
+            rows = np.concatenate(
+                [np.empty(0, dtype=np.int64)]
+                + [
+                    np.arange(self.list_offsets[i], self.list_offsets[i + 1])
+                    for i in lists
+                ]
+            )
+            approximate = self.quantized.row_scores(query, rows)
+            rows = rows[top_k(approximate, k * RERANK_FACTOR)]
+            rows, scores = self.quantized.rerank(query, rows, len(rows))
+            return self._finish(
+                np.concatenate([self.ids[rows], self.delta_ids]),
+                np.concatenate([scores, self.delta_vectors @ query]),
+                k,
+            )
+
+    def exact_search(self, query, k):
+        """Brute-force top k over every vector, for benchmarks"""
+        query = np.asarray(query, dtype=np.float32)
+        with self._lock:
+            self._refresh()
+            ids = np.concatenate([self.ids, self.delta_ids])
+            scores = np.concatenate([self.vectors @ query, self.delta_vectors @ query])
+            return self._finish(ids, scores, k)
+
+    def all_vectors(self):
+        """(ids, vectors) of every live entry, for rebuilding"""
+        with self._lock:
+            self._refresh()
+            ids = np.concatenate([self.ids, self.delta_ids])
+            vectors = np.concatenate([self.vectors, self.delta_vectors])
+            if self.deleted:
+                keep = ~np.isin(ids, list(self.deleted))
+                ids, vectors = ids[keep], vectors[keep]
+            return ids, vectors
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_ann_index(name):
+    """The named index (PASSAGES_INDEX or HISTORY_INDEX), or None when it
+    hasn't been built or ANN search is disabled"""
+    conf = get_ann_settings()
+    if not conf["ENABLED"]:
+        return None
+    if _indexes.get(name) is None:
+        with _indexes_lock:
+            if _indexes.get(name) is None:
+                try:
+                    _indexes[name] = IVFIndex.open(
+                        os.path.join(conf["PATH"], name), conf["NPROBE"]
+                    )
+                except Exception as e:
+                    logger.warning(f"Could not open ANN index {name}: {e}")
+    return _indexes.get(name)
+
+
+def build_ann_index(name, ids, vectors):
+    conf = get_ann_settings()
+    index = IVFIndex.build(
+        os.path.join(conf["PATH"], name),
+        vectors,
+        ids,
+        conf["NPROBE"],
+        conf["LISTS_PER_SQRT"],
+    )
+    with _indexes_lock:
+        _indexes[name] = index
+    return index
+
+
+# History prompts are embedded off the request path, one at a time
+_history_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ann-history")
+
+
+def _index_history_prompt(history_id, prompt):
+    try:
+        if not embeddings_available():
+            return
+        vector = embed_texts([prompt])[0]
+        index = get_ann_index(HISTORY_INDEX)
+        if index is None:
+            index = build_ann_index(
+                HISTORY_INDEX, np.empty(0), np.empty((0, len(vector)))
+            )
+        index.add([history_id], [vector])
+    except Exception as e:
+        logger.error(f"Could not index history prompt {history_id}: {e}")
+
+
+def _remove_history_prompt(history_id):
+    try:
+        index = get_ann_index(HISTORY_INDEX)
+        if index is not None:
+            index.remove([history_id])
+    except Exception as e:
+        logger.error(f"Could not remove history prompt {history_id}: {e}")
+
+
+def index_history_prompt(history_id, prompt):
+    if get_ann_settings()["ENABLED"]:
+        _history_executor.submit(_index_history_prompt, history_id, prompt)
+
+
+def remove_history_prompt(history_id):
+    if get_ann_settings()["ENABLED"]:
+        _history_executor.submit(_remove_history_prompt, history_id)
+
+
+def history_search_available():
+    return get_ann_index(HISTORY_INDEX) is not None and embeddings_available()
+
+
+def similar_history_prompts(prompt, k=5):
+    """(History ids, scores) of the past prompts closest to prompt"""
+    index = get_ann_index(HISTORY_INDEX)
+    if index is None or not embeddings_available():
+        return [], []
+    ids, scores = index.search(embed_texts([prompt])[0], k)
+    return ids.tolist(), scores.tolist()
@@ -0,0 +1,139 @@
+from collections import Counter
+import json
+import os
+import re
+
+import numpy as np
+from sklearn.feature_extraction.text import ENGLISH_STOP_WORDS
+
+TERMS_FILE = "bm25_terms.json"
+OFFSETS_FILE = "bm25_offsets.npy"
+DOC_IDS_FILE = "bm25_doc_ids.npy"
+TERM_FREQS_FILE = "bm25_tfs.npy"
+DOC_LENGTHS_FILE = "bm25_doc_lengths.npy"
+
+TOKEN = re.compile(r"\w+")
+MAX_TERM_FREQ = np.iinfo(np.uint16).max
+
+
+def tokenize(text):
+    return [
+        token
+        for token in TOKEN.findall(text.lower())
+        if len(token) > 1 and token not in ENGLISH_STOP_WORDS
+    ]
+
+
+class BM25Index:
+    """Okapi BM25 over an inverted index stored as flat NumPy arrays.
+
+    The postings of term t are doc_ids[offsets[t]:offsets[t + 1]] (ascending)
+    with their term frequencies in term_freqs, so a saved index opens as a
+    handful of memory maps and a query scores only its own postings.
+    """
+
+    def __init__(
+        self, terms, offsets, doc_ids, term_freqs, doc_lengths, k1=1.5, b=0.75
+    ):
+        self.vocabulary = {term: i for i, term in enumerate(terms)}
+        self.offsets = offsets
+        self.doc_ids = doc_ids
+        self.term_freqs = term_freqs
+        self.doc_lengths = doc_lengths
+        self.doc_count = len(doc_lengths)
+        self.k1 = k1
+
+        doc_freqs = np.diff(offsets).astype(np.float32)
+        self.idf = np.log1p(
+            (self.doc_count - doc_freqs + 0.5) / (doc_freqs + 0.5)
+        ).astype(np.float32)
+        lengths = np.asarray(doc_lengths, dtype=np.float32)
+        average = lengths.mean() if len(lengths) else 1.0
+        self.length_norm = (k1 * (1 - b + b * lengths / max(average, 1.0))).astype(
+            np.float32
+        )
+
+    @classmethod
+    def build(cls, texts):
+        vocabulary, term_ids, doc_ids, term_freqs, doc_lengths = {}, [], [], [], []
+        for doc_id, text in enumerate(texts):
+            tokens = tokenize(text)
+            doc_lengths.append(len(tokens))
+            for term, count in Counter(tokens).items():
+                term_ids.append(vocabulary.setdefault(term, len(vocabulary)))
+                doc_ids.append(doc_id)
+                term_freqs.append(min(count, MAX_TERM_FREQ))
+
+        term_ids = np.asarray(term_ids, dtype=np.int32)
+        # A stable sort keeps each term's postings in ascending doc order
+        order = np.argsort(term_ids, kind="stable")
+        offsets = np.zeros(len(vocabulary) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(term_ids, minlength=len(vocabulary)), out=offsets[1:])
+        return cls(
+            list(vocabulary),
+            offsets,
+            np.asarray(doc_ids, dtype=np.int32)[order],
+            np.asarray(term_freqs, dtype=np.uint16)[order],
+            np.asarray(doc_lengths, dtype=np.int32),
+        )
+
+    def save(self, path):
+        terms = sorted(self.vocabulary, key=self.vocabulary.get)
+        arrays = {
+            OFFSETS_FILE: self.offsets,
+            DOC_IDS_FILE: self.doc_ids,
+            TERM_FREQS_FILE: self.term_freqs,
+            DOC_LENGTHS_FILE: self.doc_lengths,
+        }
+        for name, array in arrays.items():
+            tmp = os.path.join(path, name + ".tmp.npy")
+            np.save(tmp, array)
+            os.replace(tmp, os.path.join(path, name))
+        tmp = os.path.join(path, TERMS_FILE + ".tmp")
+        with open(tmp, "w") as f:
+            json.dump(terms, f)
+        os.replace(tmp, os.path.join(path, TERMS_FILE))
+
+    @classmethod
+    def open(cls, path):
+        """The index saved at path, or None if there isn't one"""
+        if not os.path.exists(os.path.join(path, TERMS_FILE)):
+            return None
+        with open(os.path.join(path, TERMS_FILE)) as f:
+            terms = json.load(f)
+
+        def load(name):
+            return np.load(os.path.join(path, name), mmap_mode="r")
+
+        return cls(
+            terms,
+            load(OFFSETS_FILE),
+            load(DOC_IDS_FILE),
+            load(TERM_FREQS_FILE),
+            load(DOC_LENGTHS_FILE),
+        )
+
+    def scores(self, query_weights):
+        """BM25 score of every document for {term: weight}, or None when no
+        query term is in the index"""
+        docs, contributions = [], []
+        for term, weight in query_weights.items():
+            term_id = self.vocabulary.get(term)
+            if term_id is None:
+                continue
+            start, end = self.offsets[term_id], self.offsets[term_id + 1]
+            postings = self.doc_ids[start:end]
+            tf = self.term_freqs[start:end].astype(np.float32)
+            docs.append(postings)
+            contributions.append(
+                (weight * self.idf[term_id] * (self.k1 + 1))
+                * tf
+                / (tf + self.length_norm[postings])
+            )
+        if not docs:
+            return None
+        return np.bincount(
+            np.concatenate(docs),
+            weights=np.concatenate(contributions),
+            minlength=self.doc_count,
+        )
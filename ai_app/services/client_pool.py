@@ -0,0 +1,144 @@
+import asyncio
+import hashlib
+import logging
+import threading
+import weakref
+
+import httpx
+from django.conf import settings
+from ollama import AsyncClient, Client
+from openai import AsyncOpenAI, OpenAI
+
+logger = logging.getLogger("ai_app")
+
+DEFAULT_POOL_SETTINGS = {
+    "MAX_CONNECTIONS": 100,
+    "MAX_KEEPALIVE_CONNECTIONS": 20,
+    "KEEPALIVE_EXPIRY": 30.0,
+    "CONNECT_TIMEOUT": 5.0,
+    "READ_TIMEOUT": 120.0,
+}
+
+
+def get_pool_settings():
+    return {**DEFAULT_POOL_SETTINGS, **getattr(settings, "LLM_CLIENT_POOL", {})}
+
+
+def key_fingerprint(api_key):
+    """Short hash that tells API keys apart without revealing them"""
+    if not api_key:
+        return ""
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:8]
+
+
+class ClientPool:
+    """Process-wide registry of LLM clients that share keep-alive connections.
+
+    Clients are keyed by (backend, base_url, API key fingerprint): the model is
+    a request parameter, so every model served by one endpoint with one key
+    reuses the same connection pool.
+    Async clients are additionally scoped to the running event loop because
+    httpx async connections cannot cross loops.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._clients = {}
+        self._async_clients = weakref.WeakKeyDictionary()
+        self._stats = {}
+
+    def _limits(self, conf):
+        return httpx.Limits(
+            max_connections=conf["MAX_CONNECTIONS"],
+            max_keepalive_connections=conf["MAX_KEEPALIVE_CONNECTIONS"],
+            keepalive_expiry=conf["KEEPALIVE_EXPIRY"],
+        )
+
+    def _timeout(self, conf):
+        return httpx.Timeout(conf["READ_TIMEOUT"], connect=conf["CONNECT_TIMEOUT"])
+
+    def _record(self, key, created, transport):
+        stats = self._stats.setdefault(
+            key, {"created": 0, "reused": 0, "transports": weakref.WeakSet()}
+        )
+        if created:
+            stats["created"] += 1
+            stats["transports"].add(transport)
+        else:
+            stats["reused"] += 1
+
+    def _build_client(self, backend, base_url, api_key, is_async):
+        conf = get_pool_settings()
+        timeout = self._timeout(conf)
+        transport_class = httpx.AsyncHTTPTransport if is_async else httpx.HTTPTransport
+        transport = transport_class(limits=self._limits(conf))
+
+        if backend == "ollama":
+            client_class = AsyncClient if is_async else Client
+            client = client_class(host=base_url, timeout=timeout, transport=transport)
+        else:
+            http_client_class = httpx.AsyncClient if is_async else httpx.Client
+            client_class = AsyncOpenAI if is_async else OpenAI
+            client = client_class(
+                base_url=base_url,
+                api_key=api_key,
+                http_client=http_client_class(transport=transport, timeout=timeout),
+            )
+
+        logger.info(f"Created pooled {backend} client for {base_url}")
+        return client, transport
+
+    def get_client(self, backend, base_url, api_key=None):
+        key = (backend, base_url, key_fingerprint(api_key))
+        with self._lock:
+            entry = self._clients.get(key)
+            if entry is None:
+                entry = self._build_client(backend, base_url, api_key, is_async=False)
+                self._clients[key] = entry
+                self._record(key, True, entry[1])
+            else:
+                self._record(key, False, entry[1])
+            return entry[0]
+
+    def get_async_client(self, backend, base_url, api_key=None):
+        key = (backend, base_url, key_fingerprint(api_key))
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            loop_clients = self._async_clients.setdefault(loop, {})
+            entry = loop_clients.get(key)
+            if entry is None:
+                entry = self._build_client(backend, base_url, api_key, is_async=True)
+                loop_clients[key] = entry
+                self._record(key, True, entry[1])
+            else:
+                self._record(key, False, entry[1])
+            return entry[0]
+
+    def stats(self):
+        """Per-endpoint client reuse and connection counts"""
+        with self._lock:
+            snapshot = []
+            for (backend, base_url, key), stats in self._stats.items():
+                connections = idle = 0
+                for transport in list(stats["transports"]):
+                    # httpcore exposes the pool's connections; the transport
+                    # attribute holding it is private, so tolerate its absence
+                    pool = getattr(transport, "_pool", None)
+                    for connection in getattr(pool, "connections", []):
+                        connections += 1
+                        idle += int(connection.is_idle())
+                snapshot.append(
+                    {
+                        "backend": backend,
+                        "base_url": base_url,
+                        "key": key,
+                        "clients_created": stats["created"],
+                        "clients_reused": stats["reused"],
+                        "open_connections": connections,
+                        "idle_connections": idle,
+                    }
+                )
+            return snapshot
+
+
+client_pool = ClientPool()
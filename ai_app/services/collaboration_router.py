@@ -0,0 +1,133 @@
+import logging
+import threading
+
+import numpy as np
+from django.conf import settings
+
+from ai_app.services.embeddings import embed_texts, embeddings_available
+
+logger = logging.getLogger("ai_app")
+
+DEFAULT_ROUTER_SETTINGS = {
+    "ENABLED": True,
+    "COLLABORATE_THRESHOLD": 0.5,
+    "SOLO_THRESHOLD": 0.25,
+}
+
+
+def get_router_settings():
+    return {**DEFAULT_ROUTER_SETTINGS, **getattr(settings, "COLLABORATION_ROUTER", {})}
+
+
+class CollaborationRouter:
+    """Decides on collaboration locally by embedding similarity.
+
+    Each collaborator is represented by its description and by every one of
+    its collaboration triggers; its score is the best cosine similarity
+    between the prompt and any of those. A clear match or a clear miss is
+    decided here, anything in between returns None so the caller can ask
+    the LLM instead. The embedding model loads in a background thread, and
+    every prompt goes to the LLM until it is ready.
+    """
+
+    def __init__(self, collaborate_threshold, solo_threshold):
+        self.collaborate_threshold = collaborate_threshold
+        self.solo_threshold = solo_threshold
+        self._profiles = {}
+        self._lock = threading.Lock()
+        self._ready = threading.Event()
+        self._started = False
+
+    @property
+    def ready(self):
+        return self._ready.is_set()
+
+    def start(self):
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        threading.Thread(
+            target=self._load_encoder, name="collaboration-router", daemon=True
+        ).start()
+
+    def _load_encoder(self):
+        if embeddings_available():
+            self._ready.set()
+
+    def _profile(self, collaborator):
+        """(labels, vectors) for a collaborator, embedded once per distinct text"""
+        labels = ["description"]
+        texts = [f"{collaborator.name}: {collaborator.description}"]
+        for trigger in collaborator.collaboration_triggers.split(","):
+            if trigger.strip():
+                labels.append(f'trigger "{trigger.strip()}"')
+                texts.append(trigger.strip())
+
+        key = tuple(texts)
+        with self._lock:
+            profile = self._profiles.get(key)
+        if profile is None:
+            profile = (labels, embed_texts(texts))
+            with self._lock:
+                self._profiles[key] = profile
+        return profile
+
+    def route(self, user_prompt, collaborators):
+        collaborators = list(collaborators)
+        if not collaborators:
+            return {
+                "should_collaborate": False,
+                "chosen_collaborator": None,
+                "reasoning": "No collaborators are available for this role",
+            }
+        if not self.ready:
+            self.start()
+            return None
+
+        prompt_vector = embed_texts([user_prompt])[0]
+        best_score, best_collaborator, best_label = -1.0, None, None
+        for collaborator in collaborators:
+            labels, vectors = self._profile(collaborator)
+            scores = vectors @ prompt_vector
+            index = int(np.argmax(scores))
+            if scores[index] > best_score:
+                best_score = float(scores[index])
+                best_collaborator, best_label = collaborator, labels[index]
+
+        if best_score >= self.collaborate_threshold:
+            return {
+                "should_collaborate": True,
+                "chosen_collaborator": best_collaborator.name,
+                "reasoning": f"The question closely matches {best_collaborator.name}'s {best_label}",
+                "score": round(best_score, 3),
+            }
+        if best_score < self.solo_threshold:
+            return {
+                "should_collaborate": False,
+                "chosen_collaborator": None,
+                "reasoning": "No collaborator's focus is relevant to the question",
+                "score": round(best_score, 3),
+            }
+
+        logger.debug(f"Ambiguous collaboration score {best_score:.3f}, asking the LLM")
+        return None
+
+
+_router = None
+_router_lock = threading.Lock()
+
+
+def get_collaboration_router():
+    """Shared router, or None when local routing is disabled"""
+    global _router
+    conf = get_router_settings()
+    if not conf["ENABLED"]:
+        return None
+    if _router is None:
+        with _router_lock:
+            if _router is None:
+                _router = CollaborationRouter(
+                    conf["COLLABORATE_THRESHOLD"], conf["SOLO_THRESHOLD"]
+                )
+    return _router
@@ -0,0 +1,184 @@
+from collections import OrderedDict
+import hashlib
+import json
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+
+logger = logging.getLogger("ai_app")
+
+DEFAULT_CACHE_SETTINGS = {
+    "BACKEND": "memory",
+    "MAX_ENTRIES": 512,
+    "TTL": 3600,
+    "CACHE_ALIAS": "llm_completions",
+}
+
+
+def get_cache_settings():
+    return {**DEFAULT_CACHE_SETTINGS, **getattr(settings, "LLM_COMPLETION_CACHE", {})}
+
+
+def make_cache_key(backend, model, messages, temperature, max_tokens, top_p):
+    """Stable hash of everything that determines a completion"""
+    payload = json.dumps(
+        {
+            "backend": backend,
+            "model": model,
+            "messages": messages,
+            "temperature": temperature,
+            "max_tokens": max_tokens,
+            "top_p": top_p,
+        },
+        sort_keys=True,
+        ensure_ascii=False,
+    )
+    return "completion:" + hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class MemoryCompletionCache:
+    """In-process LRU cache whose entries also expire after a TTL"""
+
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    async def aget(self, key):
+        return self.get(key)
+
+    async def aset(self, key, value):
+        self.set(key, value)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class DjangoCompletionCache:
+    """Cache stored through Django's cache framework, shared by every worker
+    that points at the same cache location (file, database, redis, ...).
+    Django doesn't report evictions or the number of entries, so it has no
+    such stats."""
+
+    def __init__(self, alias, ttl):
+        self.alias = alias
+        self.ttl = ttl
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def get(self, key):
+        return self.cache.get(key)
+
+    def set(self, key, value):
+        self.cache.set(key, value, timeout=self.ttl)
+
+    async def aget(self, key):
+        return await self.cache.aget(key)
+
+    async def aset(self, key, value):
+        await self.cache.aset(key, value, timeout=self.ttl)
+
+
+class CompletionCache:
+    """Front for the configured backend that keeps hit/miss counters"""
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def _count(self, value):
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return value
+
+    def get(self, key):
+        try:
+            return self._count(self.backend.get(key))
+        except Exception as e:
+            logger.warning(f"Completion cache read failed: {e}")
+            return self._count(None)
+
+    def set(self, key, value):
+        if value is None:
+            return
+        try:
+            self.backend.set(key, value)
+        except Exception as e:
+            logger.warning(f"Completion cache write failed: {e}")
+
+    async def aget(self, key):
+        try:
+            return self._count(await self.backend.aget(key))
+        except Exception as e:
+            logger.warning(f"Completion cache read failed: {e}")
+            return self._count(None)
+
+    async def aset(self, key, value):
+        if value is None:
+            return
+        try:
+            await self.backend.aset(key, value)
+        except Exception as e:
+            logger.warning(f"Completion cache write failed: {e}")
+
+    def stats(self):
+        """Counters of the cache; evictions and entries are None for a
+        backend that can't count them"""
+        sized = hasattr(self.backend, "__len__")
+        return {
+            "backend": type(self.backend).__name__,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": getattr(self.backend, "evictions", None),
+            "entries": len(self.backend) if sized else None,
+        }
+
+
+_completion_cache = None
+_completion_cache_lock = threading.Lock()
+
+
+def get_completion_cache():
+    global _completion_cache
+    if _completion_cache is None:
+        with _completion_cache_lock:
+            if _completion_cache is None:
+                conf = get_cache_settings()
+                if conf["BACKEND"] == "django":
+                    backend = DjangoCompletionCache(conf["CACHE_ALIAS"], conf["TTL"])
+                else:
+                    backend = MemoryCompletionCache(conf["MAX_ENTRIES"], conf["TTL"])
+                _completion_cache = CompletionCache(backend)
+    return _completion_cache
@@ -0,0 +1,426 @@
+import hashlib
+import json
+import logging
+import mmap
+import os
+import re
+import shutil
+import threading
+
+from django.conf import settings
+import numpy as np
+
+from ai_app.services.bm25_index import (
+    DOC_IDS_FILE,
+    DOC_LENGTHS_FILE,
+    TERM_FREQS_FILE,
+    TERMS_FILE,
+    BM25Index,
+)
+from ai_app.services.bm25_index import OFFSETS_FILE as BM25_OFFSETS_FILE
+from ai_app.services.embeddings import (
+    DEFAULT_EMBEDDING_MODEL,
+    embed_texts,
+    embeddings_available,
+)
+from ai_app.services.vector_store import QuantizedVectors
+
+logger = logging.getLogger("ai_app")
+
+DEFAULT_CORPUS_STORE_SETTINGS = {
+    "CORPUS_DIR": os.path.join(settings.BASE_DIR, "datasets", "spiritual_texts"),
+    "PATH": os.path.join(settings.BASE_DIR, ".cache", "corpus"),
+    "PASSAGE_WORDS": 120,
+}
+
+STORE_VERSION = 2
+MANIFEST_FILE = "manifest.json"
+GENERATION_PREFIX = "gen-"
+BM25_FILES = (
+    TERMS_FILE,
+    BM25_OFFSETS_FILE,
+    DOC_IDS_FILE,
+    TERM_FREQS_FILE,
+    DOC_LENGTHS_FILE,
+)
+CHUNKS_FILE = "chunks.bin"
+OFFSETS_FILE = "offsets.npy"
+SOURCES_FILE = "sources.npy"
+EMBEDDINGS_FILE = "embeddings.npy"
+
+PARAGRAPH_BREAK = re.compile(r"\n\s*\n")
+
+
+def get_corpus_store_settings():
+    return {
+        **DEFAULT_CORPUS_STORE_SETTINGS,
+        **getattr(settings, "CORPUS_STORE", {}),
+    }
+
+
+def generation_dir(path, generation):
+    return os.path.join(path, f"{GENERATION_PREFIX}{generation:06d}")
+
+
+def source_name(path):
+    return os.path.splitext(os.path.basename(path))[0]
+
+
+def corpus_files(corpus_dir):
+    return [
+        os.path.join(corpus_dir, filename)
+        for filename in sorted(os.listdir(corpus_dir))
+        if filename.lower().endswith(".txt")
+    ]
+
+
+def split_passages(text, passage_words):
+    """Group paragraphs into passages of roughly passage_words words"""
+    passages, current = [], []
+    for paragraph in PARAGRAPH_BREAK.split(text):
+        words = paragraph.split()
+        while len(words) > passage_words * 2:
+            passages.append(" ".join(words[:passage_words]))
+            words = words[passage_words:]
+        current.extend(words)
+        if len(current) >= passage_words:
+            passages.append(" ".join(current))
+            current = []
+    if current:
+        passages.append(" ".join(current))
+    return passages
+
+
+class CorpusStore:
+    """Read-only, memory-mapped view of a store written by CorpusStoreBuilder.
+
+    Each build writes a new generation directory, and manifest.json names
+    the current one, so a reader never mixes files of two builds. In it,
+    chunks.bin holds every chunk's UTF-8 text back to back, offsets.npy the
+    byte offset of each chunk (plus the end), sources.npy each chunk's source
+    index and embeddings.npy one unit-normalised row per chunk, which
+    searches scan as 8-bit codes (see vector_store). The BM25 index over the
+    chunks lives next to them (see bm25_index). Nothing is read until it is
+    used, so opening a store costs a few page mappings.
+    """
+
+    def __init__(self, root):
+        with open(os.path.join(root, MANIFEST_FILE)) as f:
+            self.manifest = json.load(f)
+        if self.manifest.get("version") != STORE_VERSION:
+            raise ValueError(f"Corpus store at {root} is outdated, rebuild it")
+        self.root = root
+        # The generation's directory, where the BM25 index is too
+        self.path = generation_dir(root, self.manifest["generation"])
+        path = self.path
+        self.sources = [entry["name"] for entry in self.manifest["files"]]
+        self.offsets = np.load(os.path.join(path, OFFSETS_FILE), mmap_mode="r")
+        self.source_ids = np.load(os.path.join(path, SOURCES_FILE), mmap_mode="r")
+
+        embeddings_path = os.path.join(path, EMBEDDINGS_FILE)
+        self.embeddings = (
+            np.load(embeddings_path, mmap_mode="r")
+            if os.path.exists(embeddings_path)
+            else None
+        )
+        self.quantized = (
+            QuantizedVectors.open(embeddings_path)
+            if self.embeddings is not None
+            else None
+        )
+
+        self._file = open(os.path.join(path, CHUNKS_FILE), "rb")
+        size = os.fstat(self._file.fileno()).st_size
+        self._mmap = (
+            mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size else b""
+        )
+        self._buffer = memoryview(self._mmap)
+
+        if len(self.offsets) != self.manifest["chunks"] + 1 or (
+            self.offsets[-1] != size
+        ):
+            self.close()
+            raise ValueError(f"Corpus store at {path} is incomplete, rebuild it")
+
+    @classmethod
+    def open(cls, path):
+        """The store at path, or None if it hasn't been built"""
+        if not os.path.exists(os.path.join(path, MANIFEST_FILE)):
+            return None
+        try:
+            return cls(path)
+        except Exception as e:
+            logger.warning(f"Could not open corpus store at {path}: {e}")
+            return None
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def chunk_bytes(self, i):
+        """Zero-copy view of chunk i's UTF-8 bytes"""
+        return self._buffer[self.offsets[i] : self.offsets[i + 1]]
+
+    def text(self, i):
+        return str(self.chunk_bytes(i), "utf-8")
+
+    def source(self, i):
+        return self.sources[self.source_ids[i]]
+
+    def texts(self):
+        return (self.text(i) for i in range(len(self)))
+
+    def close(self):
+        self._buffer.release()
+        if isinstance(self._mmap, mmap.mmap):
+            self._mmap.close()
+        self._file.close()
+
+
+class InMemoryCorpus:
+    """Chunks the corpus on the fly when no store has been built"""
+
+    def __init__(self, corpus_dir, passage_words):
+        self.sources, self.passages, source_ids = [], [], []
+        for path in corpus_files(corpus_dir):
+            with open(path, encoding="utf-8", errors="ignore") as f:
+                chunks = split_passages(f.read(), passage_words)
+            self.passages.extend(chunks)
+            source_ids.extend([len(self.sources)] * len(chunks))
+            self.sources.append(source_name(path))
+        self.source_ids = np.asarray(source_ids, dtype=np.int32)
+        self.embeddings = None
+        self.quantized = None
+
+    def __len__(self):
+        return len(self.passages)
+
+    def text(self, i):
+        return self.passages[i]
+
+    def source(self, i):
+        return self.sources[self.source_ids[i]]
+
+    def texts(self):
+        return iter(self.passages)
+
+
+class CorpusStoreBuilder:
+    """Writes a CorpusStore, re-chunking and re-embedding only the files
+    whose content hash changed since the last build. The BM25 index depends
+    on corpus-wide statistics, so it is rebuilt whenever any file changed.
+
+    A build writes a new generation directory and then switches the manifest
+    to it; the previous generation is kept for readers that are still
+    opening it, and older ones are removed."""
+
+    def __init__(self, corpus_dir, path, passage_words):
+        self.corpus_dir = corpus_dir
+        self.path = path
+        self.passage_words = passage_words
+
+    def _previous(self, embedding_model):
+        """The last build, if its chunks and embeddings can be reused;
+        embedding_model is None when this build doesn't embed"""
+        previous = CorpusStore.open(self.path)
+        if previous is None:
+            return None
+        manifest = previous.manifest
+        if (
+            manifest.get("passage_words") != self.passage_words
+            or manifest.get("embedding_model") != embedding_model
+        ):
+            previous.close()
+            return None
+        return previous
+
+    def _next_generation(self):
+        try:
+            with open(os.path.join(self.path, MANIFEST_FILE)) as f:
+                return json.load(f)["generation"] + 1
+        except (OSError, ValueError, KeyError, TypeError):
+            return 0
+
+    def build(self, embed=True, force=False):
+        os.makedirs(self.path, exist_ok=True)
+        embed = embed and embeddings_available()
+        embedding_model = (
+            getattr(settings, "EMBEDDING_MODEL", DEFAULT_EMBEDDING_MODEL)
+            if embed
+            else None
+        )
+        generation = self._next_generation()
+        out_dir = generation_dir(self.path, generation)
+        # Left over by a build that didn't finish
+        shutil.rmtree(out_dir, ignore_errors=True)
+        os.makedirs(out_dir)
+        previous = None if force else self._previous(embedding_model)
+        previous_files = (
+            {entry["name"]: entry for entry in previous.manifest["files"]}
+            if previous
+            else {}
+        )
+
+        stats = {"reused": 0, "processed": 0, "embedded": 0, "removed": 0}
+        files, offsets, source_ids, vectors, texts = [], [0], [], [], []
+        try:
+            with open(os.path.join(out_dir, CHUNKS_FILE), "wb") as out:
+                for path in corpus_files(self.corpus_dir):
+                    name = source_name(path)
+                    with open(path, "rb") as f:
+                        data = f.read()
+                    digest = hashlib.sha256(data).hexdigest()
+                    old = previous_files.pop(name, None)
+
+                    file_vectors = None
+                    if old and old["sha256"] == digest:
+                        start = old["first_chunk"]
+                        end = start + old["chunk_count"]
+                        chunks = [
+                            bytes(previous.chunk_bytes(i)) for i in range(start, end)
+                        ]
+                        if old["embedded"] and previous.embeddings is not None:
+                            file_vectors = np.array(previous.embeddings[start:end])
+                        stats["reused"] += 1
+                    else:
+                        text = data.decode("utf-8", errors="ignore")
+                        chunks = [
+                            passage.encode("utf-8")
+                            for passage in split_passages(text, self.passage_words)
+                        ]
+                        stats["processed"] += 1
+
+                    file_texts = [str(chunk, "utf-8") for chunk in chunks]
+                    texts.extend(file_texts)
+                    if file_vectors is None and embed and chunks:
+                        file_vectors = embed_texts(file_texts)
+                        stats["embedded"] += 1
+
+                    files.append(
+                        {
+                            "name": name,
+                            "sha256": digest,
+                            "first_chunk": len(source_ids),
+                            "chunk_count": len(chunks),
+                            "embedded": file_vectors is not None,
+                        }
+                    )
+                    for chunk in chunks:
+                        out.write(chunk)
+                        offsets.append(offsets[-1] + len(chunk))
+                    source_ids.extend([len(files) - 1] * len(chunks))
+                    vectors.append(file_vectors)
+            stats["removed"] = len(previous_files)
+            stats["indexed"] = bool(
+                force
+                or stats["processed"]
+                or stats["removed"]
+                or not self._link_bm25(previous, out_dir)
+            )
+        finally:
+            if previous is not None:
+                previous.close()
+
+        self._write(out_dir, files, offsets, source_ids, vectors)
+        if stats["indexed"]:
+            BM25Index.build(texts).save(out_dir)
+        self._write_manifest(generation, files, len(source_ids), embedding_model)
+        self._remove_old_generations(generation)
+        stats["chunks"] = len(source_ids)
+        return stats
+
+    def _link_bm25(self, previous, out_dir):
+        """Reuse the previous build's BM25 index; False if there isn't one"""
+        if previous is None or not all(
+            os.path.exists(os.path.join(previous.path, name)) for name in BM25_FILES
+        ):
+            return False
+        for name in BM25_FILES:
+            source = os.path.join(previous.path, name)
+            target = os.path.join(out_dir, name)
+            try:
+                os.link(source, target)
+            except OSError:
+                shutil.copyfile(source, target)
+        return True
+
+    def _write(self, out_dir, files, offsets, source_ids, vectors):
+        np.save(os.path.join(out_dir, OFFSETS_FILE), np.asarray(offsets, np.int64))
+        np.save(os.path.join(out_dir, SOURCES_FILE), np.asarray(source_ids, np.int32))
+
+        dims = {v.shape[1] for v in vectors if v is not None}
+        if not dims:
+            return
+        # Rows of files that couldn't be embedded stay zero, so they never
+        # score in a cosine search
+        embeddings_path = os.path.join(out_dir, EMBEDDINGS_FILE)
+        embeddings = np.lib.format.open_memmap(
+            embeddings_path,
+            mode="w+",
+            dtype=np.float32,
+            shape=(len(source_ids), max(dims)),
+        )
+        for entry, file_vectors in zip(files, vectors):
+            if file_vectors is not None:
+                start = entry["first_chunk"]
+                embeddings[start : start + entry["chunk_count"]] = file_vectors
+        embeddings.flush()
+        del embeddings
+        QuantizedVectors.quantize(np.load(embeddings_path, mmap_mode="r")).save(
+            embeddings_path
+        )
+
+    def _write_manifest(self, generation, files, chunk_count, embedding_model):
+        """Switch readers to the generation; the rename is the commit point"""
+        manifest = {
+            "version": STORE_VERSION,
+            "generation": generation,
+            "passage_words": self.passage_words,
+            "embedding_model": (
+                embedding_model if any(entry["embedded"] for entry in files) else None
+            ),
+            "chunks": chunk_count,
+            "files": files,
+        }
+        tmp = os.path.join(self.path, MANIFEST_FILE + ".tmp")
+        with open(tmp, "w") as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(tmp, os.path.join(self.path, MANIFEST_FILE))
+
+    def _remove_old_generations(self, generation):
+        """Remove every generation before the previous one. Open stores keep
+        their memory maps of removed files."""
+        for name in os.listdir(self.path):
+            if not name.startswith(GENERATION_PREFIX):
+                continue
+            try:
+                number = int(name[len(GENERATION_PREFIX) :])
+            except ValueError:
+                continue
+            if number < generation - 1:
+                shutil.rmtree(os.path.join(self.path, name), ignore_errors=True)
+
+
+def get_corpus_store_builder():
+    conf = get_corpus_store_settings()
+    return CorpusStoreBuilder(conf["CORPUS_DIR"], conf["PATH"], conf["PASSAGE_WORDS"])
+
+
+_corpus = None
+_corpus_lock = threading.Lock()
+
+
+def get_corpus():
+    """The built CorpusStore, falling back to chunking the texts in memory"""
+    global _corpus
+    if _corpus is None:
+        with _corpus_lock:
+            if _corpus is None:
+                conf = get_corpus_store_settings()
+                _corpus = CorpusStore.open(conf["PATH"])
+                if _corpus is None:
+                    logger.warning(
+                        "No corpus store built, chunking texts in memory; "
+                        "run `python manage.py build_corpus_store`"
+                    )
+                    _corpus = InMemoryCorpus(conf["CORPUS_DIR"], conf["PASSAGE_WORDS"])
+    return _corpus
@@ -1,13 +1,55 @@
+from concurrent.futures import ThreadPoolExecutor
 from textwrap import dedent
+import asyncio
 import json
 import logging
+import queue
+import threading
 from typing import Dict
 
+from django.conf import settings
+
 from ai_app.models.llm_role import LLMRole
-from ai_app.services.model_rotation import OpenAIService
+from ai_app.services.collaboration_router import get_collaboration_router
+from ai_app.services.metrics import llm_cascade_escalations
+from ai_app.services.prompt_layout import PromptLayout
+from ai_app.services.retrieval import get_passage_retriever, parse_source_texts
+from ai_app.services.role_registry import aget_role_registry, get_role_registry
+from ai_app.services.speaker_stream import SpeakerStreamParser
+from ai_app.services.token_budget import (
+    format_dialogue_context,
+    get_token_budget,
+    get_token_budget_settings,
+    get_token_counter,
+)
+from ai_app.services.speculation import (
+    estimate_tokens,
+    get_speculation_executor,
+    get_speculation_settings,
+    speculation_stats,
+)
+from ai_app.services.model_rotation import AsyncOpenAIService, OpenAIService
 
 logger = logging.getLogger("ai_app")
 
+# Dialogue modes: "sequential" roles each see the dialogue so far, "panel"
+# roles answer the prompt concurrently and only the synthesis sees them all
+SEQUENTIAL_MODE = "sequential"
+PANEL_MODE = "panel"
+DIALOGUE_MODES = (SEQUENTIAL_MODE, PANEL_MODE)
+
+# The decision a speculative solo completion is generated for
+SOLO_DECISION = {"should_collaborate": False}
+
+# "role" metric labels for completions that aren't spoken by a role
+COLLABORATION_DECISION_LABEL = "collaboration_decision"
+SYNTHESIS_LABEL = "synthesis"
+# Speaker name of the synthesis turn in conversations and stream events
+SYNTHESIS_ROLE = "Synthesis"
+# The synthesis isn't spoken by a role, so it has its own generation settings
+SYNTHESIS_MAX_TOKENS = 400
+SYNTHESIS_TEMPERATURE = 0.7
+
 # Prompt Templates
 FIRST_SPEAKER_INSTRUCTIONS = """
 - Present your tradition's core perspective
@@ -20,26 +62,23 @@ RESPONDER_INSTRUCTIONS = """
 - Propose alternative interpretations
 - Push for greater precision in key concepts"""
 
-DEBATE_PROMPT_TEMPLATE = """You are {name}: {description}
-
-You are {position_context}in this debate about: "{user_prompt}"
+# Role prompts are laid out for prefix caching (see prompt_layout): the
+# system prompt is ROLE_PREFIX_TEMPLATE, fixed for a role and mode, and the
+# question, passages, debate position and dialogue so far follow in the user
+# message
+ROLE_PREFIX_TEMPLATE = """You are {name}: {description}
 
-Previous perspectives:
-{dialogue_context}
+{prompt_template}
 
-As we are in debate mode, engage critically with the discussion by:
-{debate_instructions}
+{mode_instructions}
 
-Keep your response focused and under 150 words.
+Keep your response focused and under 150 words."""
 
-Question: {user_prompt}"""
+DEBATE_MODE_INSTRUCTIONS = (
+    """As we are in debate mode, engage critically with the discussion."""
+)
 
-DIALOGUE_PROMPT_TEMPLATE = """You are {name}: {description}
-
-Previous perspectives on "{user_prompt}":
-{dialogue_context}
-
-Your task is to evolve this dialogue by:
+DIALOGUE_MODE_INSTRUCTIONS = """Your task is to evolve this dialogue by:
 1. Deeply engaging with the previous perspectives:
    - Identify key insights or concepts from previous responses
    - Find points of resonance or harmony with your tradition
@@ -58,16 +97,17 @@ Your task is to evolve this dialogue by:
 4. Speaking authentically as {name}:
    - Ground your response in your unique spiritual framework
    - Share specific wisdom from your tradition that illuminates the discussion
-   - Maintain your distinct voice while building on others
+   - Maintain your distinct voice while building on others"""
 
-Keep your response focused and under 150 words.
+DEBATE_POSITION_TEMPLATE = """You are {position_context}in this debate. Engage critically with the discussion by:
+{debate_instructions}"""
 
-Question: {user_prompt}"""
+QUESTION_TEMPLATE = """Question: {user_prompt}"""
 
-SYNTHESIS_PROMPT_TEMPLATE = """You are tasked with synthesizing this multi-perspective dialogue about: "{user_prompt}"
+DIALOGUE_CONTEXT_TEMPLATE = """Previous perspectives:
+{dialogue_context}"""
 
-Complete dialogue:
-{dialogue_context}
+SYNTHESIS_PREFIX = """You are synthesizing a philosophical dialogue.
 
 Please provide:
 1. Key insights from each perspective
@@ -76,12 +116,23 @@ Please provide:
 
 Keep your response concise and under 250 words."""
 
+SYNTHESIS_DIALOGUE_TEMPLATE = """Complete dialogue:
+{dialogue_context}"""
+
+SOURCE_PASSAGES_TEMPLATE = """Passages from your tradition's texts that may inform your answer. Draw on them where relevant rather than quoting them at length:
+
+{passages}"""
+
+
+def get_panel_concurrency():
+    return getattr(settings, "DIALOGUE_PANEL_CONCURRENCY", 8)
+
 
 class DialogueGenerator:
     def __init__(self, openai_service: OpenAIService):
         self.openai_service = openai_service
 
-    def get_collaboration_decision(self, role, user_prompt, collaborators):
+    def build_collaboration_messages(self, role, user_prompt, collaborators):
         collaborator_list = "\n".join(
             [
                 f"- {c.name}: {c.description} (Triggers: {c.collaboration_triggers})"
@@ -89,12 +140,10 @@ class DialogueGenerator:
             ]
         )
 
+        # Everything but the question is fixed for the role
         system_prompt = dedent(
-            f"""You are {role.name}. Your task is to decide if collaboration would be valuable for answering the user's question."""
-        )
+            f"""You are {role.name}. Your task is to decide if collaboration would be valuable for answering the user's question.
 
-        collaboration_context = dedent(
-            f"""User question: "{user_prompt}"
             You have access to the following potential collaborators:
             {collaborator_list}
 
@@ -106,17 +155,88 @@ class DialogueGenerator:
             }}"""
         )
 
+        return (
+            PromptLayout(system_prompt)
+            .add(f'User question: "{user_prompt}"')
+            .messages()
+        )
+
+    def route_collaboration(self, user_prompt, collaborators):
+        """Local embedding decision, or None when the LLM should decide"""
+        router = get_collaboration_router()
+        if router is None:
+            return None
+        try:
+            return router.route(user_prompt, collaborators)
+        except Exception as e:
+            logger.error(f"Collaboration router failed, falling back to LLM: {e}")
+            return None
+
+    def get_collaboration_decision(self, role, user_prompt, collaborators):
+        decision = self.route_collaboration(user_prompt, collaborators)
+        if decision is not None:
+            return decision
+        return self.ask_collaboration_decision(role, user_prompt, collaborators)
+
+    def ask_collaboration_decision(self, role, user_prompt, collaborators):
+        """Have the LLM decide on collaboration"""
         content = self.openai_service.create_completion(
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": collaboration_context},
-            ]
+            messages=self.build_collaboration_messages(
+                role, user_prompt, collaborators
+            ),
+            role_name=COLLABORATION_DECISION_LABEL,
         )
         clean_content = content.replace("```json\n", "").replace("\n```", "").strip()
         return json.loads(clean_content)
 
+    def should_speculate(self, speculative):
+        if speculative is None:
+            return get_speculation_settings()["ENABLED"]
+        return bool(speculative)
+
+    def discard_speculation(self, messages, future):
+        """Drop a speculative solo completion, accounting for its wasted tokens"""
+        speculation_stats.record_miss(
+            sum(estimate_tokens(message["content"]) for message in messages)
+        )
+        if future.cancel():
+            return
+
+        def count_wasted(done):
+            if not done.cancelled() and done.exception() is None:
+                speculation_stats.record_wasted_completion(
+                    estimate_tokens(done.result())
+                )
+
+        future.add_done_callback(count_wasted)
+
+    def retrieve_passages(self, role, user_prompt):
+        """Source passages relevant to the prompt, from the role's own texts"""
+        retriever = get_passage_retriever()
+        if retriever is None:
+            return []
+        try:
+            return retriever.search(
+                user_prompt,
+                role_query=role.collaboration_triggers,
+                source_texts=parse_source_texts(role.source_texts),
+            )
+        except Exception as e:
+            logger.error(f"Passage retrieval failed for {role.name}: {e}")
+            return []
+
+    def source_passages(self, role, user_prompt):
+        """The prompt section of source passages for the prompt, or "" """
+        passages = self.retrieve_passages(role, user_prompt)
+        if not passages:
+            return ""
+        formatted = "\n\n".join(f"[{p.source}] {p.text}" for p in passages)
+        return SOURCE_PASSAGES_TEMPLATE.format(passages=formatted)
+
     def create_system_prompt(self, role, collab_decision):
-        """Helper function to create system prompt based on collaboration decision"""
+        """System prompt for answering as the role, alone or hosting the
+        collaborator the decision chose; it only depends on the role and the
+        collaborator, so it can be prefix cached"""
         json_instruction = """
         IMPORTANT: Your response must be valid JSON. Always wrap your response in square brackets,
         use double quotes for strings, and ensure proper JSON formatting.
@@ -124,8 +244,8 @@ class DialogueGenerator:
 
         if collab_decision.get("should_collaborate"):
             try:
-                collaborator = LLMRole.objects.get(
-                    name=collab_decision["chosen_collaborator"]
+                collaborator = get_role_registry().get(
+                    collab_decision["chosen_collaborator"]
                 )
                 return dedent(
                     f"""
@@ -134,8 +254,6 @@ class DialogueGenerator:
                     Primary Perspective ({role.name}): {role.description}
                     Collaborative Perspective ({collaborator.name}): {collaborator.description}
 
-                    Reason for collaboration: {collab_decision["reasoning"]}
-
                     {json_instruction}
                     Format your response exactly like this:
                     [
@@ -167,131 +285,266 @@ class DialogueGenerator:
         """
         )
 
-    def generate_role_response(
+    def role_prefix(self, role, should_debate=False):
+        mode_instructions = (
+            DEBATE_MODE_INSTRUCTIONS
+            if should_debate
+            else DIALOGUE_MODE_INSTRUCTIONS.format(name=role.name)
+        )
+        return ROLE_PREFIX_TEMPLATE.format(
+            name=role.name,
+            description=role.description,
+            prompt_template=dedent(role.prompt_template).strip(),
+            mode_instructions=mode_instructions,
+        )
+
+    def build_role_messages(
         self, role, user_prompt, dialogue_context="", should_debate=False
     ):
-        is_first = not bool(dialogue_context.strip())
-        position_context = (
-            "the first speaker " if is_first else "responding to previous perspectives "
+        layout = PromptLayout(self.role_prefix(role, should_debate)).add(
+            QUESTION_TEMPLATE.format(user_prompt=user_prompt),
+            self.source_passages(role, user_prompt),
         )
-        debate_instructions = (
-            FIRST_SPEAKER_INSTRUCTIONS if is_first else RESPONDER_INSTRUCTIONS
+        is_first = not bool(dialogue_context.strip())
+        if should_debate:
+            layout.add(
+                DEBATE_POSITION_TEMPLATE.format(
+                    position_context=(
+                        "the first speaker "
+                        if is_first
+                        else "responding to previous perspectives "
+                    ),
+                    debate_instructions=(
+                        FIRST_SPEAKER_INSTRUCTIONS
+                        if is_first
+                        else RESPONDER_INSTRUCTIONS
+                    ).strip(),
+                )
+            )
+        # The growing dialogue goes last, so that each turn's prompt extends
+        # the previous one
+        if not is_first:
+            layout.add(
+                DIALOGUE_CONTEXT_TEMPLATE.format(dialogue_context=dialogue_context)
+            )
+        return layout.messages()
+
+    def generate_role_response(
+        self, role, user_prompt, dialogue_context="", should_debate=False
+    ):
+        return self.openai_service.create_completion(
+            messages=self.build_role_messages(
+                role, user_prompt, dialogue_context, should_debate
+            ),
+            temperature=role.temperature,
+            max_tokens=role.max_tokens,
+            role_name=role.name,
+            model=role.model_name,
         )
 
-        template = DEBATE_PROMPT_TEMPLATE if should_debate else DIALOGUE_PROMPT_TEMPLATE
-        role_prompt = template.format(
-            name=role.name,
-            description=role.description,
-            user_prompt=user_prompt,
-            dialogue_context=dialogue_context,
-            position_context=position_context,
-            debate_instructions=debate_instructions,
+    def stream_role_response(
+        self, role, user_prompt, dialogue_context="", should_debate=False
+    ):
+        """Yield the role's response token chunk by token chunk"""
+        yield from self.openai_service.create_streaming_completion(
+            messages=self.build_role_messages(
+                role, user_prompt, dialogue_context, should_debate
+            ),
+            temperature=role.temperature,
+            max_tokens=role.max_tokens,
+            role_name=role.name,
+            model=role.model_name,
         )
 
-        return self.openai_service.create_completion(
-            messages=[
-                {"role": "system", "content": role.prompt_template},
-                {"role": "user", "content": role_prompt},
-            ],
-            temperature=0.7,
-            max_tokens=200,
+    def build_synthesis_messages(self, user_prompt, dialogue_context):
+        return (
+            PromptLayout(SYNTHESIS_PREFIX)
+            .add(
+                QUESTION_TEMPLATE.format(user_prompt=user_prompt),
+                SYNTHESIS_DIALOGUE_TEMPLATE.format(dialogue_context=dialogue_context),
+            )
+            .messages()
         )
 
-    def generate_synthesis(self, user_prompt, dialogue_context):
-        synthesis_prompt = SYNTHESIS_PROMPT_TEMPLATE.format(
-            user_prompt=user_prompt, dialogue_context=dialogue_context
+    def fit_role_context(self, role, user_prompt, conversation, should_debate=False):
+        """The dialogue so far, compacted to fit the role prompt's token budget"""
+        if not conversation:
+            return ""
+        overhead = get_token_counter().count_messages(
+            self.build_role_messages(role, user_prompt, "...", should_debate)
+        )
+        conf = get_token_budget_settings()
+        # A prompt that already fills the budget still gets some of the
+        # dialogue, or the role would think it speaks first
+        budget = max(conf["ROLE_PROMPT_TOKENS"] - overhead, conf["MIN_CONTEXT_TOKENS"])
+        return get_token_budget().fit(conversation, budget, user_prompt)
+
+    def fit_synthesis_context(self, user_prompt, conversation):
+        overhead = get_token_counter().count_messages(
+            self.build_synthesis_messages(user_prompt, "")
         )
+        conf = get_token_budget_settings()
+        budget = max(
+            conf["SYNTHESIS_PROMPT_TOKENS"] - overhead, conf["MIN_CONTEXT_TOKENS"]
+        )
+        return get_token_budget().fit(conversation, budget, user_prompt)
 
+    def generate_synthesis(self, user_prompt, dialogue_context):
         return self.openai_service.create_completion(
-            messages=[
-                {
-                    "role": "system",
-                    "content": "You are synthesizing a philosophical dialogue.",
-                },
-                {"role": "user", "content": synthesis_prompt},
-            ],
-            temperature=0.7,
-            max_tokens=400,
+            messages=self.build_synthesis_messages(user_prompt, dialogue_context),
+            temperature=SYNTHESIS_TEMPERATURE,
+            max_tokens=SYNTHESIS_MAX_TOKENS,
+            role_name=SYNTHESIS_LABEL,
         )
 
-    def process_single_role(self, role_name: str, user_prompt: str) -> Dict:
-        """Handle single role dialogue with optional collaboration"""
-        role = LLMRole.objects.prefetch_related("collaborators").get(name=role_name)
-        collaborators = role.collaborators.all()
-        collab_decision = self.get_collaboration_decision(
-            role, user_prompt, collaborators
+    def stream_synthesis(self, user_prompt, dialogue_context):
+        yield from self.openai_service.create_streaming_completion(
+            messages=self.build_synthesis_messages(user_prompt, dialogue_context),
+            temperature=SYNTHESIS_TEMPERATURE,
+            max_tokens=SYNTHESIS_MAX_TOKENS,
+            role_name=SYNTHESIS_LABEL,
         )
-        system_prompt = self.create_system_prompt(role, collab_decision)
 
-        # Increase max_tokens for collaborative responses
-        max_tokens = 600 if collab_decision.get("should_collaborate") else 300
+    def single_role_result(self, role, parser, collab_decision) -> Dict:
+        """The structured view result of a closed SpeakerStreamParser"""
+        if not parser.parsed:
+            logger.warning(f"Failed to parse JSON response: {parser.content}")
+        elif parser.truncated:
+            logger.info(f"Repaired a truncated response from {role.name}")
+        return {
+            "response_data": parser.speakers,
+            "collab_decision": collab_decision,
+            "role": role,
+            "raw_content": parser.content,
+        }
 
-        content = self.openai_service.create_completion(
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt},
-            ],
-            temperature=0.7,
-            max_tokens=max_tokens,  # Increased token limit
-        )
+    def speaker_stream_events(self, events, started):
+        """stream_dialogue events for SpeakerStreamParser events; started is
+        the set of turns already announced by a thinking event"""
+        for event in events:
+            turn = event.index + 1
+            if turn not in started:
+                started.add(turn)
+                yield {"type": "thinking", "data": {"turn": turn, "role": event.role}}
+            if event.kind == "delta":
+                data = {"turn": turn, "role": event.role, "delta": event.text}
+                yield {"type": "delta", "data": data}
+            else:
+                data = {"turn": turn, "role": event.role, "response": event.text}
+                yield {"type": "response", "data": data}
+
+    def single_role_max_tokens(self, role, collab_decision):
+        # A collaborative answer holds several speakers' turns
+        if collab_decision.get("should_collaborate"):
+            return 2 * role.max_tokens
+        return role.max_tokens
+
+    def cascade_models(self, role):
+        """Models to try a single-role answer on, cheapest first: with
+        LLM_CASCADE on, the cascade's model and then the role's own when the
+        cheap answer can't be parsed"""
+        cheap = self.openai_service.cascade_model(role.model_name)
+        return [role.model_name] if cheap is None else [cheap, role.model_name]
+
+    def acceptable(self, parser):
+        """Whether a cascaded answer is kept rather than escalated: complete,
+        valid JSON"""
+        return parser.parsed and not parser.truncated
+
+    def escalate(self, role, model):
+        llm_cascade_escalations.inc(role=role.name)
+        logger.info(f"Invalid response from {model}, escalating {role.name}")
+
+    def build_single_role_messages(self, role, user_prompt, collab_decision):
+        layout = PromptLayout(self.create_system_prompt(role, collab_decision))
+        layout.add(self.source_passages(role, user_prompt))
+        if collab_decision.get("should_collaborate"):
+            layout.add(f"Reason for collaboration: {collab_decision['reasoning']}")
+        return layout.add(user_prompt).messages()
 
-        try:
-            clean_content = (
-                content.replace("```json\n", "").replace("\n```", "").strip()
-            )
+    def process_single_role(
+        self, role_name: str, user_prompt: str, speculative=None
+    ) -> Dict:
+        """Handle single role dialogue with optional collaboration.
 
+        When the collaboration decision needs an LLM call and speculation is
+        on, the solo completion starts at the same time and is kept if the
+        decision turns out to be "no collaboration".
+        """
+        registry = get_role_registry()
+        role = registry.get(role_name)
+        collaborators = registry.collaborators(role)
+        models = self.cascade_models(role)
+
+        speculative_future = None
+        collab_decision = self.route_collaboration(user_prompt, collaborators)
+        if collab_decision is None:
+            if self.should_speculate(speculative):
+                solo_messages = self.build_single_role_messages(
+                    role, user_prompt, SOLO_DECISION
+                )
+                speculative_future = get_speculation_executor().submit(
+                    self.openai_service.create_completion,
+                    messages=solo_messages,
+                    temperature=role.temperature,
+                    max_tokens=self.single_role_max_tokens(role, SOLO_DECISION),
+                    role_name=role.name,
+                    model=models[0],
+                )
+                speculation_stats.record_launch()
             try:
-                parsed_data = json.loads(clean_content)
-                if not isinstance(parsed_data, list):
-                    parsed_data = [{"role": role.name, "response": clean_content}]
-
-                # Check for and handle incomplete responses
-                for item in parsed_data:
-                    if not isinstance(item, dict):
-                        continue
-                    response_text = item.get("response", "")
-                    if response_text.endswith(("...", ".", ",")):
-                        # Trim incomplete sentences
-                        last_sentence = response_text.rstrip(".,").rsplit(".", 1)[0]
-                        item["response"] = last_sentence + "."
-
-                response_data = parsed_data
-
-            except json.JSONDecodeError:
-                logger.warning(f"Failed to parse JSON response: {clean_content}")
-                response_data = [{"role": role.name, "response": clean_content}]
-
-            return {
-                "response_data": response_data,
-                "collab_decision": collab_decision,
-                "role": role,
-                "raw_content": content,
-            }
-
-        except Exception as e:
-            logger.error(f"Error processing response: {str(e)}, Content: {content}")
-            return {
-                "response_data": [
-                    {"role": role.name, "response": "Error processing response"}
-                ],
-                "collab_decision": collab_decision,
-                "role": role,
-                "raw_content": content,
-            }
-
-    def process_full_dialogue(self, user_prompt: str, should_debate: bool) -> Dict:
-        """Handle multi-role dialogue with synthesis"""
-        roles = list(LLMRole.objects.all())
+                collab_decision = self.ask_collaboration_decision(
+                    role, user_prompt, collaborators
+                )
+            except Exception:
+                if speculative_future is not None:
+                    self.discard_speculation(solo_messages, speculative_future)
+                raise
 
+        if speculative_future is not None:
+            if not collab_decision.get("should_collaborate"):
+                speculation_stats.record_hit()
+                parser = SpeakerStreamParser(role.name)
+                parser.feed(speculative_future.result())
+                parser.close()
+                if self.acceptable(parser) or len(models) == 1:
+                    return self.single_role_result(role, parser, collab_decision)
+                self.escalate(role, models[0])
+                models = models[1:]
+            else:
+                self.discard_speculation(solo_messages, speculative_future)
+
+        messages = self.build_single_role_messages(role, user_prompt, collab_decision)
+        for i, model in enumerate(models):
+            # Parsed as it streams, so speakers are ready when the last token is
+            parser = SpeakerStreamParser(role.name)
+            for chunk in self.openai_service.create_streaming_completion(
+                messages=messages,
+                temperature=role.temperature,
+                max_tokens=self.single_role_max_tokens(role, collab_decision),
+                role_name=role.name,
+                model=model,
+            ):
+                parser.feed(chunk)
+            parser.close()
+            if self.acceptable(parser) or i + 1 == len(models):
+                break
+            self.escalate(role, model)
+
+        return self.single_role_result(role, parser, collab_decision)
+
+    def run_sequential_turns(self, roles, user_prompt, should_debate):
+        """Each role responds to the dialogue accumulated so far"""
         conversation = []
-        dialogue_context = ""
 
         for i, role in enumerate(roles):
             try:
                 role_response = self.generate_role_response(
                     role=role,
                     user_prompt=user_prompt,
-                    dialogue_context=dialogue_context,
+                    dialogue_context=self.fit_role_context(
+                        role, user_prompt, conversation, should_debate
+                    ),
                     should_debate=should_debate,
                 )
 
@@ -299,23 +552,62 @@ class DialogueGenerator:
                     {"turn": i + 1, "role": role.name, "response": role_response}
                 )
 
-                dialogue_context += f"\n\n{role.name}: {role_response}"
-
             except Exception as e:
                 logger.error(f"Error getting response for {role.name}: {str(e)}")
                 continue
 
+        return conversation
+
+    def run_panel_turns(self, roles, user_prompt, should_debate):
+        """Every role answers the prompt independently, on a bounded thread pool"""
+        with ThreadPoolExecutor(max_workers=get_panel_concurrency()) as executor:
+            futures = [
+                executor.submit(
+                    self.generate_role_response,
+                    role=role,
+                    user_prompt=user_prompt,
+                    should_debate=should_debate,
+                )
+                for role in roles
+            ]
+
+        conversation = []
+        for i, (role, future) in enumerate(zip(roles, futures)):
+            try:
+                conversation.append(
+                    {"turn": i + 1, "role": role.name, "response": future.result()}
+                )
+            except Exception as e:
+                logger.error(f"Error getting response for {role.name}: {str(e)}")
+
+        return conversation
+
+    def process_full_dialogue(
+        self, user_prompt: str, should_debate: bool, mode: str = SEQUENTIAL_MODE
+    ) -> Dict:
+        """Handle multi-role dialogue with synthesis"""
+        roles = get_role_registry().roles
+
+        if mode == PANEL_MODE:
+            conversation = self.run_panel_turns(roles, user_prompt, should_debate)
+        else:
+            conversation = self.run_sequential_turns(roles, user_prompt, should_debate)
+        dialogue_context = format_dialogue_context(conversation)
+
         final_response = None
         if conversation:
             try:
                 final_response = self.generate_synthesis(
-                    user_prompt=user_prompt, dialogue_context=dialogue_context
+                    user_prompt=user_prompt,
+                    dialogue_context=self.fit_synthesis_context(
+                        user_prompt, conversation
+                    ),
                 )
 
                 conversation.append(
                     {
                         "turn": len(conversation) + 1,
-                        "role": "Synthesis",
+                        "role": SYNTHESIS_ROLE,
                         "response": final_response,
                     }
                 )
@@ -330,24 +622,30 @@ class DialogueGenerator:
             "dialogue_context": dialogue_context,
         }
 
-    def stream_full_dialogue(self, user_prompt: str, should_debate: bool):
-        """Stream each role's response as it's generated"""
-        roles = list(LLMRole.objects.all())
-
-        dialogue_context = ""
+    def stream_sequential_turns(self, roles, user_prompt, should_debate):
+        conversation = []
 
         for i, role in enumerate(roles):
             try:
                 # First yield a "thinking" message
                 yield {"type": "thinking", "data": {"turn": i + 1, "role": role.name}}
 
-                # Generate and yield the response
-                role_response = self.generate_role_response(
+                # Forward token chunks as they arrive, keeping the full text
+                # for the next role's context
+                role_response = ""
+                for chunk in self.stream_role_response(
                     role=role,
                     user_prompt=user_prompt,
-                    dialogue_context=dialogue_context,
+                    dialogue_context=self.fit_role_context(
+                        role, user_prompt, conversation, should_debate
+                    ),
                     should_debate=should_debate,
-                )
+                ):
+                    role_response += chunk
+                    yield {
+                        "type": "delta",
+                        "data": {"turn": i + 1, "role": role.name, "delta": chunk},
+                    }
 
                 response_data = {
                     "type": "response",
@@ -358,7 +656,7 @@ class DialogueGenerator:
                     },
                 }
 
-                dialogue_context += f"\n\n{role.name}: {role_response}"
+                conversation.append(response_data["data"])
                 yield response_data
 
             except Exception as e:
@@ -366,28 +664,572 @@ class DialogueGenerator:
                 yield {"type": "error", "data": {"role": role.name, "error": str(e)}}
                 continue
 
+    def stream_panel_turns(self, roles, user_prompt, should_debate):
+        """Run every role concurrently and interleave their events as they arrive"""
+        events = queue.Queue()
+        # Set when the consumer stops early, so running roles stop too
+        stopped = threading.Event()
+
+        def run(turn, role):
+            try:
+                events.put(
+                    {"type": "thinking", "data": {"turn": turn, "role": role.name}}
+                )
+                role_response = ""
+                for chunk in self.stream_role_response(
+                    role=role, user_prompt=user_prompt, should_debate=should_debate
+                ):
+                    if stopped.is_set():
+                        return
+                    role_response += chunk
+                    events.put(
+                        {
+                            "type": "delta",
+                            "data": {"turn": turn, "role": role.name, "delta": chunk},
+                        }
+                    )
+                events.put(
+                    {
+                        "type": "response",
+                        "data": {
+                            "turn": turn,
+                            "role": role.name,
+                            "response": role_response,
+                        },
+                    }
+                )
+            except Exception as e:
+                logger.error(f"Error getting response for {role.name}: {str(e)}")
+                events.put(
+                    {"type": "error", "data": {"role": role.name, "error": str(e)}}
+                )
+            finally:
+                events.put(None)
+
+        executor = ThreadPoolExecutor(max_workers=get_panel_concurrency())
+        try:
+            for i, role in enumerate(roles):
+                executor.submit(run, i + 1, role)
+
+            remaining = len(roles)
+            while remaining:
+                event = events.get()
+                if event is None:
+                    remaining -= 1
+                    continue
+                yield event
+        finally:
+            stopped.set()
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def stream_full_dialogue(
+        self, user_prompt: str, should_debate: bool, mode: str = SEQUENTIAL_MODE
+    ):
+        """Stream each role's response as it's generated"""
+        roles = get_role_registry().roles
+
+        turn_events = (
+            self.stream_panel_turns(roles, user_prompt, should_debate)
+            if mode == PANEL_MODE
+            else self.stream_sequential_turns(roles, user_prompt, should_debate)
+        )
+        conversation = []
+        for event in turn_events:
+            if event["type"] == "response":
+                conversation.append(event["data"])
+            yield event
+
+        # Panel turns finish out of order; the synthesis reads them in role order
+        conversation.sort(key=lambda turn: turn["turn"])
+
         # Generate synthesis after all responses
-        if dialogue_context:
+        if conversation:
             try:
                 # Yield thinking message for synthesis
                 yield {
                     "type": "thinking",
-                    "data": {"turn": len(roles) + 1, "role": "Synthesis"},
+                    "data": {"turn": len(roles) + 1, "role": SYNTHESIS_ROLE},
                 }
 
-                final_response = self.generate_synthesis(
-                    user_prompt=user_prompt, dialogue_context=dialogue_context
+                final_response = ""
+                for chunk in self.stream_synthesis(
+                    user_prompt=user_prompt,
+                    dialogue_context=self.fit_synthesis_context(
+                        user_prompt, conversation
+                    ),
+                ):
+                    final_response += chunk
+                    yield {
+                        "type": "delta",
+                        "data": {
+                            "turn": len(roles) + 1,
+                            "role": SYNTHESIS_ROLE,
+                            "delta": chunk,
+                        },
+                    }
+
+                yield {
+                    "type": "synthesis",
+                    "data": {
+                        "turn": len(roles) + 1,
+                        "role": SYNTHESIS_ROLE,
+                        "response": final_response,
+                    },
+                }
+
+            except Exception as e:
+                logger.error(f"Error generating synthesis: {str(e)}")
+                yield {
+                    "type": "error",
+                    "data": {"role": SYNTHESIS_ROLE, "error": str(e)},
+                }
+
+
+class AsyncDialogueGenerator(DialogueGenerator):
+    """DialogueGenerator driven by AsyncOpenAIService; the LLM-facing methods are coroutines"""
+
+    def __init__(self, openai_service: AsyncOpenAIService):
+        self.openai_service = openai_service
+
+    async def get_collaboration_decision(self, role, user_prompt, collaborators):
+        # Embedding is CPU-bound, keep it off the event loop
+        decision = await asyncio.to_thread(
+            self.route_collaboration, user_prompt, collaborators
+        )
+        if decision is not None:
+            return decision
+        return await self.ask_collaboration_decision(role, user_prompt, collaborators)
+
+    async def ask_collaboration_decision(self, role, user_prompt, collaborators):
+        content = await self.openai_service.create_completion(
+            messages=self.build_collaboration_messages(
+                role, user_prompt, collaborators
+            ),
+            role_name=COLLABORATION_DECISION_LABEL,
+        )
+        clean_content = content.replace("```json\n", "").replace("\n```", "").strip()
+        return json.loads(clean_content)
+
+    async def build_role_messages_off_loop(
+        self, role, user_prompt, dialogue_context="", should_debate=False
+    ):
+        # Retrieval embeds the prompt, which is CPU-bound
+        return await asyncio.to_thread(
+            self.build_role_messages,
+            role,
+            user_prompt,
+            dialogue_context,
+            should_debate,
+        )
+
+    async def generate_role_response(
+        self, role, user_prompt, dialogue_context="", should_debate=False
+    ):
+        return await self.openai_service.create_completion(
+            messages=await self.build_role_messages_off_loop(
+                role, user_prompt, dialogue_context, should_debate
+            ),
+            temperature=role.temperature,
+            max_tokens=role.max_tokens,
+            role_name=role.name,
+            model=role.model_name,
+        )
+
+    async def stream_role_response(
+        self, role, user_prompt, dialogue_context="", should_debate=False
+    ):
+        """Yield the role's response token chunk by token chunk"""
+        async for chunk in self.openai_service.create_streaming_completion(
+            messages=await self.build_role_messages_off_loop(
+                role, user_prompt, dialogue_context, should_debate
+            ),
+            temperature=role.temperature,
+            max_tokens=role.max_tokens,
+            role_name=role.name,
+            model=role.model_name,
+        ):
+            yield chunk
+
+    async def generate_synthesis(self, user_prompt, dialogue_context):
+        return await self.openai_service.create_completion(
+            messages=self.build_synthesis_messages(user_prompt, dialogue_context),
+            temperature=SYNTHESIS_TEMPERATURE,
+            max_tokens=SYNTHESIS_MAX_TOKENS,
+            role_name=SYNTHESIS_LABEL,
+        )
+
+    async def stream_synthesis(self, user_prompt, dialogue_context):
+        async for chunk in self.openai_service.create_streaming_completion(
+            messages=self.build_synthesis_messages(user_prompt, dialogue_context),
+            temperature=SYNTHESIS_TEMPERATURE,
+            max_tokens=SYNTHESIS_MAX_TOKENS,
+            role_name=SYNTHESIS_LABEL,
+        ):
+            yield chunk
+
+    def discard_speculative_task(self, messages, task):
+        speculation_stats.record_miss(
+            sum(estimate_tokens(message["content"]) for message in messages)
+        )
+
+        def count_wasted(done):
+            if not done.cancelled() and done.exception() is None:
+                speculation_stats.record_wasted_completion(
+                    estimate_tokens(done.result())
+                )
+
+        task.add_done_callback(count_wasted)
+        # Cancelling closes the connection, so at most the tokens already
+        # generated are lost; a completion that finished first is counted
+        task.cancel()
+
+    async def stream_single_role(
+        self, role_name: str, user_prompt: str, speculative=None
+    ):
+        """Async generator behind process_single_role: a "collaboration"
+        event with the decision, stream_dialogue's "thinking", "delta" and
+        "response" events for each speaker as the completion is parsed, and
+        finally a "result" event with the structured result"""
+        registry = await aget_role_registry()
+        role = registry.get(role_name)
+        collaborators = registry.collaborators(role)
+        models = self.cascade_models(role)
+
+        speculative_task = None
+        collab_decision = await asyncio.to_thread(
+            self.route_collaboration, user_prompt, collaborators
+        )
+        if collab_decision is None:
+            if self.should_speculate(speculative):
+                solo_messages = await asyncio.to_thread(
+                    self.build_single_role_messages, role, user_prompt, SOLO_DECISION
+                )
+                speculative_task = asyncio.create_task(
+                    self.openai_service.create_completion(
+                        messages=solo_messages,
+                        temperature=role.temperature,
+                        max_tokens=self.single_role_max_tokens(role, SOLO_DECISION),
+                        role_name=role.name,
+                        model=models[0],
+                    )
+                )
+                speculation_stats.record_launch()
+            try:
+                collab_decision = await self.ask_collaboration_decision(
+                    role, user_prompt, collaborators
+                )
+            except Exception:
+                if speculative_task is not None:
+                    self.discard_speculative_task(solo_messages, speculative_task)
+                raise
+
+        yield {"type": "collaboration", "data": collab_decision}
+
+        started = set()
+        if speculative_task is not None:
+            if not collab_decision.get("should_collaborate"):
+                speculation_stats.record_hit()
+                parser = SpeakerStreamParser(role.name)
+                events = parser.feed(await speculative_task) + parser.close()
+                if self.acceptable(parser) or len(models) == 1:
+                    for event in self.speaker_stream_events(events, started):
+                        yield event
+                    yield {
+                        "type": "result",
+                        "data": self.single_role_result(role, parser, collab_decision),
+                    }
+                    return
+                self.escalate(role, models[0])
+                models = models[1:]
+            else:
+                self.discard_speculative_task(solo_messages, speculative_task)
+
+        messages = await asyncio.to_thread(
+            self.build_single_role_messages, role, user_prompt, collab_decision
+        )
+
+        for i, model in enumerate(models):
+            parser = SpeakerStreamParser(role.name)
+            # An answer that may still be escalated is held back until it
+            # parses; the last model's streams straight to the caller
+            last = i + 1 == len(models)
+            held = []
+            async for chunk in self.openai_service.create_streaming_completion(
+                messages=messages,
+                temperature=role.temperature,
+                max_tokens=self.single_role_max_tokens(role, collab_decision),
+                role_name=role.name,
+                model=model,
+            ):
+                if not last:
+                    held += parser.feed(chunk)
+                    continue
+                for event in self.speaker_stream_events(parser.feed(chunk), started):
+                    yield event
+            held += parser.close()
+            if self.acceptable(parser) or last:
+                for event in self.speaker_stream_events(held, started):
+                    yield event
+                break
+            self.escalate(role, model)
+
+        yield {
+            "type": "result",
+            "data": self.single_role_result(role, parser, collab_decision),
+        }
+
+    async def process_single_role(
+        self, role_name: str, user_prompt: str, speculative=None
+    ) -> Dict:
+        """Handle single role dialogue with optional (speculative) collaboration"""
+        result = None
+        async for event in self.stream_single_role(
+            role_name, user_prompt, speculative=speculative
+        ):
+            if event["type"] == "result":
+                result = event["data"]
+        return result
+
+    async def run_sequential_turns(self, roles, user_prompt, should_debate):
+        conversation = []
+
+        for i, role in enumerate(roles):
+            try:
+                role_response = await self.generate_role_response(
+                    role=role,
+                    user_prompt=user_prompt,
+                    dialogue_context=await asyncio.to_thread(
+                        self.fit_role_context,
+                        role,
+                        user_prompt,
+                        conversation,
+                        should_debate,
+                    ),
+                    should_debate=should_debate,
+                )
+
+                conversation.append(
+                    {"turn": i + 1, "role": role.name, "response": role_response}
+                )
+
+            except Exception as e:
+                logger.error(f"Error getting response for {role.name}: {str(e)}")
+                continue
+
+        return conversation
+
+    async def run_panel_turns(self, roles, user_prompt, should_debate):
+        semaphore = asyncio.Semaphore(get_panel_concurrency())
+
+        async def run(role):
+            async with semaphore:
+                return await self.generate_role_response(
+                    role=role, user_prompt=user_prompt, should_debate=should_debate
                 )
 
+        results = await asyncio.gather(
+            *(run(role) for role in roles), return_exceptions=True
+        )
+
+        conversation = []
+        for i, (role, result) in enumerate(zip(roles, results)):
+            if isinstance(result, Exception):
+                logger.error(f"Error getting response for {role.name}: {str(result)}")
+                continue
+            conversation.append({"turn": i + 1, "role": role.name, "response": result})
+
+        return conversation
+
+    async def process_full_dialogue(
+        self, user_prompt: str, should_debate: bool, mode: str = SEQUENTIAL_MODE
+    ) -> Dict:
+        """Handle multi-role dialogue with synthesis"""
+        roles = (await aget_role_registry()).roles
+
+        if mode == PANEL_MODE:
+            conversation = await self.run_panel_turns(roles, user_prompt, should_debate)
+        else:
+            conversation = await self.run_sequential_turns(
+                roles, user_prompt, should_debate
+            )
+        dialogue_context = format_dialogue_context(conversation)
+
+        final_response = None
+        if conversation:
+            try:
+                final_response = await self.generate_synthesis(
+                    user_prompt=user_prompt,
+                    dialogue_context=await asyncio.to_thread(
+                        self.fit_synthesis_context, user_prompt, conversation
+                    ),
+                )
+
+                conversation.append(
+                    {
+                        "turn": len(conversation) + 1,
+                        "role": SYNTHESIS_ROLE,
+                        "response": final_response,
+                    }
+                )
+
+            except Exception as e:
+                logger.error(f"Error generating synthesis: {str(e)}")
+                raise
+
+        return {
+            "conversation": conversation,
+            "final_analysis": final_response,
+            "dialogue_context": dialogue_context,
+        }
+
+    async def stream_sequential_turns(self, roles, user_prompt, should_debate):
+        conversation = []
+
+        for i, role in enumerate(roles):
+            try:
+                yield {"type": "thinking", "data": {"turn": i + 1, "role": role.name}}
+
+                role_response = ""
+                async for chunk in self.stream_role_response(
+                    role=role,
+                    user_prompt=user_prompt,
+                    dialogue_context=await asyncio.to_thread(
+                        self.fit_role_context,
+                        role,
+                        user_prompt,
+                        conversation,
+                        should_debate,
+                    ),
+                    should_debate=should_debate,
+                ):
+                    role_response += chunk
+                    yield {
+                        "type": "delta",
+                        "data": {"turn": i + 1, "role": role.name, "delta": chunk},
+                    }
+
+                turn = {"turn": i + 1, "role": role.name, "response": role_response}
+                conversation.append(turn)
+                yield {"type": "response", "data": turn}
+
+            except Exception as e:
+                logger.error(f"Error getting response for {role.name}: {str(e)}")
+                yield {"type": "error", "data": {"role": role.name, "error": str(e)}}
+                continue
+
+    async def stream_panel_turns(self, roles, user_prompt, should_debate):
+        """Run every role concurrently and interleave their events as they arrive"""
+        events = asyncio.Queue()
+        semaphore = asyncio.Semaphore(get_panel_concurrency())
+
+        async def run(turn, role):
+            try:
+                async with semaphore:
+                    await events.put(
+                        {"type": "thinking", "data": {"turn": turn, "role": role.name}}
+                    )
+                    role_response = ""
+                    async for chunk in self.stream_role_response(
+                        role=role, user_prompt=user_prompt, should_debate=should_debate
+                    ):
+                        role_response += chunk
+                        await events.put(
+                            {
+                                "type": "delta",
+                                "data": {
+                                    "turn": turn,
+                                    "role": role.name,
+                                    "delta": chunk,
+                                },
+                            }
+                        )
+                    await events.put(
+                        {
+                            "type": "response",
+                            "data": {
+                                "turn": turn,
+                                "role": role.name,
+                                "response": role_response,
+                            },
+                        }
+                    )
+            except Exception as e:
+                logger.error(f"Error getting response for {role.name}: {str(e)}")
+                await events.put(
+                    {"type": "error", "data": {"role": role.name, "error": str(e)}}
+                )
+            finally:
+                await events.put(None)
+
+        tasks = [asyncio.create_task(run(i + 1, role)) for i, role in enumerate(roles)]
+        try:
+            remaining = len(tasks)
+            while remaining:
+                event = await events.get()
+                if event is None:
+                    remaining -= 1
+                    continue
+                yield event
+        finally:
+            # The client may disconnect mid-stream; don't leave roles running
+            for task in tasks:
+                task.cancel()
+
+    async def stream_full_dialogue(
+        self, user_prompt: str, should_debate: bool, mode: str = SEQUENTIAL_MODE
+    ):
+        """Stream each role's response as it's generated"""
+        roles = (await aget_role_registry()).roles
+
+        turn_events = (
+            self.stream_panel_turns(roles, user_prompt, should_debate)
+            if mode == PANEL_MODE
+            else self.stream_sequential_turns(roles, user_prompt, should_debate)
+        )
+        conversation = []
+        async for event in turn_events:
+            if event["type"] == "response":
+                conversation.append(event["data"])
+            yield event
+
+        conversation.sort(key=lambda turn: turn["turn"])
+
+        if conversation:
+            try:
+                yield {
+                    "type": "thinking",
+                    "data": {"turn": len(roles) + 1, "role": SYNTHESIS_ROLE},
+                }
+
+                final_response = ""
+                async for chunk in self.stream_synthesis(
+                    user_prompt=user_prompt,
+                    dialogue_context=await asyncio.to_thread(
+                        self.fit_synthesis_context, user_prompt, conversation
+                    ),
+                ):
+                    final_response += chunk
+                    yield {
+                        "type": "delta",
+                        "data": {
+                            "turn": len(roles) + 1,
+                            "role": SYNTHESIS_ROLE,
+                            "delta": chunk,
+                        },
+                    }
+
                 yield {
                     "type": "synthesis",
                     "data": {
                         "turn": len(roles) + 1,
-                        "role": "Synthesis",
+                        "role": SYNTHESIS_ROLE,
                         "response": final_response,
                     },
                 }
 
             except Exception as e:
                 logger.error(f"Error generating synthesis: {str(e)}")
-                yield {"type": "error", "data": {"role": "Synthesis", "error": str(e)}}
+                yield {
+                    "type": "error",
+                    "data": {"role": SYNTHESIS_ROLE, "error": str(e)},
+                }
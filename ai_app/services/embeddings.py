@@ -0,0 +1,54 @@
+import logging
+import threading
+
+import numpy as np
+from django.conf import settings
+
+try:
+    from sentence_transformers import SentenceTransformer
+except ImportError:
+    SentenceTransformer = None
+
+logger = logging.getLogger("ai_app")
+
+DEFAULT_EMBEDDING_MODEL = "all-MiniLM-L6-v2"
+
+_encoder = None
+_encoder_failed = False
+_encoder_lock = threading.Lock()
+
+
+def get_encoder():
+    """Process-wide sentence-transformers model, or None if it can't be loaded"""
+    global _encoder, _encoder_failed
+    if _encoder is None and not _encoder_failed:
+        with _encoder_lock:
+            if _encoder is None and not _encoder_failed:
+                if SentenceTransformer is None:
+                    logger.warning("sentence-transformers is not installed")
+                    _encoder_failed = True
+                    return None
+                model_name = getattr(
+                    settings, "EMBEDDING_MODEL", DEFAULT_EMBEDDING_MODEL
+                )
+                try:
+                    _encoder = SentenceTransformer(model_name)
+                except Exception as e:
+                    logger.error(f"Could not load embedding model {model_name}: {e}")
+                    _encoder_failed = True
+    return _encoder
+
+
+def embeddings_available():
+    return get_encoder() is not None
+
+
+def embed_texts(texts):
+    """Unit-normalised float32 embeddings, one row per text"""
+    encoder = get_encoder()
+    if encoder is None:
+        raise RuntimeError("Embedding model is not available")
+    vectors = encoder.encode(
+        list(texts), normalize_embeddings=True, convert_to_numpy=True
+    )
+    return np.asarray(vectors, dtype=np.float32)
@@ -0,0 +1,164 @@
+import base64
+import binascii
+import uuid
+
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from ai_app.models.history import History
+from ai_app.models.llm_role import LLMRole
+from ai_app.models.user import User
+from ai_app.services.ann_index import history_search_available, similar_history_prompts
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+HISTORY_FIELDS = (
+    "id",
+    "prompt",
+    "response",
+    "created_at",
+    "role__name",
+    "user__username",
+    "dialogue_id",
+    "turn",
+)
+
+
+class InvalidHistoryQuery(ValueError):
+    pass
+
+
+class HistorySearchUnavailable(Exception):
+    """The history index or the embedding model isn't available"""
+
+
+def encode_cursor(created_at, pk):
+    value = f"{created_at.isoformat()}|{pk}".encode("utf-8")
+    return base64.urlsafe_b64encode(value).decode("ascii")
+
+
+def decode_cursor(cursor):
+    try:
+        created_at, pk = (
+            base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8").split("|")
+        )
+        return parse_timestamp(created_at, "cursor"), int(pk)
+    except (ValueError, binascii.Error, UnicodeError):
+        raise InvalidHistoryQuery("Invalid cursor")
+
+
+def parse_timestamp(value, name):
+    parsed = parse_datetime(value)
+    if parsed is None:
+        raise InvalidHistoryQuery(f"Invalid {name} '{value}', expected ISO 8601")
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed, timezone.get_current_timezone())
+    return parsed
+
+
+def parse_uuid(value):
+    try:
+        return uuid.UUID(value)
+    except ValueError:
+        raise InvalidHistoryQuery(f"Invalid dialogue id '{value}'")
+
+
+def parse_limit(value):
+    if value is None:
+        return DEFAULT_PAGE_SIZE
+    try:
+        limit = int(value)
+    except ValueError:
+        raise InvalidHistoryQuery(f"Invalid limit '{value}'")
+    if limit < 1:
+        raise InvalidHistoryQuery("limit must be positive")
+    return min(limit, MAX_PAGE_SIZE)
+
+
+class HistoryQuery:
+    """One page of History, newest first, with keyset pagination.
+
+    The cursor is the (created_at, id) of the last row returned, so the next
+    page is a range scan from that key on the (created_at, id) index (or the
+    role/user composite indexes when filtered) instead of an OFFSET that
+    reads and discards every earlier row. Rows are fetched with values(),
+    joining role and user names in the same query.
+
+    With `similar`, the page is instead the rows whose prompts are closest
+    to it in the history ANN index, best first, each with its score; the
+    other filters narrow those down and there is no next page.
+    """
+
+    def __init__(self, params):
+        self.limit = parse_limit(params.get("limit"))
+        self.cursor = decode_cursor(params["cursor"]) if params.get("cursor") else None
+        self.role = params.get("role")
+        self.user = params.get("user")
+        self.dialogue = (
+            parse_uuid(params["dialogue"]) if params.get("dialogue") else None
+        )
+        self.since = (
+            parse_timestamp(params["since"], "since") if params.get("since") else None
+        )
+        self.until = (
+            parse_timestamp(params["until"], "until") if params.get("until") else None
+        )
+        self.similar = params.get("similar")
+        if self.similar and self.cursor:
+            raise InvalidHistoryQuery("cursor can't be combined with similar")
+
+    def queryset(self):
+        queryset = History.objects.order_by("-created_at", "-id")
+        # Role and user are resolved to ids first so the database can range
+        # scan their composite index rather than join on the name
+        if self.role:
+            role_ids = LLMRole.objects.filter(name=self.role).values_list(
+                "pk", flat=True
+            )
+            queryset = queryset.filter(role_id__in=list(role_ids))
+        if self.user and self.user.isdigit():
+            queryset = queryset.filter(user_id=int(self.user))
+        elif self.user:
+            user_ids = User.objects.filter(username=self.user).values_list(
+                "pk", flat=True
+            )
+            queryset = queryset.filter(user_id__in=list(user_ids))
+        if self.dialogue:
+            queryset = queryset.filter(dialogue_id=self.dialogue)
+        if self.since:
+            queryset = queryset.filter(created_at__gte=self.since)
+        if self.until:
+            queryset = queryset.filter(created_at__lt=self.until)
+        if self.cursor:
+            created_at, pk = self.cursor
+            # (created_at, id) < cursor, with the created_at bound spelled
+            # out so it is usable as an index range
+            queryset = queryset.filter(created_at__lte=created_at).filter(
+                Q(created_at__lt=created_at) | Q(id__lt=pk)
+            )
+        return queryset.values(*HISTORY_FIELDS)
+
+    def page(self):
+        """(rows, next cursor or None)"""
+        if self.similar:
+            return self.similar_page(), None
+        rows = list(self.queryset()[: self.limit + 1])
+        if len(rows) <= self.limit:
+            return rows, None
+        rows = rows[: self.limit]
+        return rows, encode_cursor(rows[-1]["created_at"], rows[-1]["id"])
+
+    def similar_page(self):
+        if not history_search_available():
+            raise HistorySearchUnavailable("History similarity search is unavailable")
+        # As many neighbours as a page can hold, so that filters still leave
+        # up to limit rows
+        ids, scores = similar_history_prompts(self.similar, MAX_PAGE_SIZE)
+        rows = {row["id"]: row for row in self.queryset().filter(id__in=ids)}
+        page = []
+        for pk, score in zip(ids, scores):
+            if pk in rows:
+                page.append({**rows[pk], "score": score})
+        return page[: self.limit]
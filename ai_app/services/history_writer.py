@@ -0,0 +1,231 @@
+import atexit
+import json
+import logging
+import os
+import threading
+import time
+
+from django.conf import settings
+from django.db import close_old_connections
+
+from ai_app.models.history import History
+from ai_app.models.user import User
+from ai_app.services.ann_index import index_history_prompt
+from ai_app.services.role_registry import get_role_registry
+
+logger = logging.getLogger("ai_app")
+
+DEFAULT_HISTORY_WRITER_SETTINGS = {
+    "BATCH_SIZE": 100,
+    "FLUSH_INTERVAL": 1.0,
+    "MAX_PENDING": 10000,
+    "SPOOL_PATH": os.path.join(settings.BASE_DIR, ".cache", "history_spool.jsonl"),
+    "USERNAME": "testuser",
+}
+
+
+def get_history_writer_settings():
+    return {
+        **DEFAULT_HISTORY_WRITER_SETTINGS,
+        **getattr(settings, "HISTORY_WRITER", {}),
+    }
+
+
+class HistoryWriter:
+    """Write-behind persistence for History.
+
+    record() only appends to an in-memory batch; a background thread saves
+    batches with one bulk_create once BATCH_SIZE records are waiting or
+    FLUSH_INTERVAL seconds have passed, resolving role names from the role
+    registry and user names in one query per batch. Records that can't be
+    saved (the database is down, the batch is over MAX_PENDING, or the
+    process is exiting and the final flush fails) are appended to a
+    JSON-lines spool, which is replayed before the next batch.
+    """
+
+    def __init__(self, batch_size, flush_interval, max_pending, spool_path, username):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.spool_path = spool_path
+        self.username = username
+        self._pending = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._spool_lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._thread = None
+        self.written = 0
+        self.spooled = 0
+
+    def record(
+        self, prompt, response, role_name=None, dialogue_id=None, turn=None, user=None
+    ):
+        """Queue a History row; role_name None is for rows like a dialogue's
+        synthesis that no role wrote"""
+        entry = {
+            "user": user or self.username,
+            "role": role_name,
+            "prompt": prompt,
+            "response": response,
+            "dialogue_id": str(dialogue_id) if dialogue_id else None,
+            "turn": turn,
+        }
+        with self._lock:
+            if len(self._pending) >= self.max_pending:
+                overflow = True
+            else:
+                overflow = False
+                self._pending.append(entry)
+                if len(self._pending) >= self.batch_size:
+                    self._wakeup.notify()
+        if overflow:
+            logger.warning("History write-behind queue is full, spooling")
+            self._spool([entry])
+        self._start()
+
+    def _start(self):
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="history-writer", daemon=True
+                )
+                self._thread.start()
+                atexit.register(self.close)
+
+    def _run(self):
+        while True:
+            with self._lock:
+                if len(self._pending) < self.batch_size:
+                    self._wakeup.wait(self.flush_interval)
+            self.flush()
+
+    def _take(self):
+        with self._lock:
+            batch, self._pending = self._pending, []
+        return batch
+
+    def flush(self, index=True):
+        """Save the spool and everything queued so far, and index the saved
+        prompts unless index is False; returns the number of records
+        handled"""
+        with self._flush_lock:
+            spooled, claim = self._claim_spool()
+            batch = spooled + self._take()
+            if not batch:
+                return 0
+            close_old_connections()
+            written = 0
+            saved = []
+            try:
+                for start in range(0, len(batch), self.batch_size):
+                    chunk = batch[start : start + self.batch_size]
+                    saved += self._save(chunk)
+                    # Committed, so never spooled again whatever happens next
+                    written += len(chunk)
+            except Exception as e:
+                logger.error(
+                    f"Could not save {len(batch) - written} history records: {e}"
+                )
+                self._spool(batch[written:])
+            finally:
+                close_old_connections()
+            # Only dropped once its records are saved or spooled again
+            if claim:
+                os.remove(claim)
+        if index:
+            self._index(saved)
+        return written
+
+    def _save(self, batch):
+        roles = {role.name: role.id for role in reversed(get_role_registry().roles)}
+        users = dict(
+            User.objects.filter(
+                username__in={entry["user"] for entry in batch}
+            ).values_list("username", "pk")
+        )
+        rows = []
+        for entry in batch:
+            if entry["user"] not in users:
+                logger.warning(f"Dropping history for unknown user {entry['user']}")
+                continue
+            rows.append(
+                History(
+                    user_id=users[entry["user"]],
+                    role_id=roles.get(entry["role"]),
+                    prompt=entry["prompt"],
+                    response=entry["response"],
+                    dialogue_id=entry["dialogue_id"],
+                    turn=entry["turn"],
+                )
+            )
+        created = History.objects.bulk_create(rows)
+        self.written += len(created)
+        return created
+
+    def _index(self, rows):
+        # bulk_create sends no post_save, so index the prompts here
+        for row in rows:
+            if row.pk is None:
+                continue
+            try:
+                index_history_prompt(row.pk, row.prompt)
+            except Exception as e:
+                logger.error(f"Could not index history {row.pk}: {e}")
+
+    def _spool(self, entries):
+        try:
+            os.makedirs(os.path.dirname(self.spool_path), exist_ok=True)
+            with self._spool_lock:
+                with open(self.spool_path, "a", encoding="utf-8") as f:
+                    for entry in entries:
+                        f.write(json.dumps(entry) + "\n")
+                self.spooled += len(entries)
+        except OSError as e:
+            logger.error(f"Could not spool {len(entries)} history records: {e}")
+
+    def _claim_spool(self):
+        """(records, claimed file) from the spool, moved aside so that other
+        workers don't replay it too"""
+        if not os.path.exists(self.spool_path):
+            return [], None
+        claim = f"{self.spool_path}.{os.getpid()}.{time.monotonic_ns()}"
+        try:
+            with self._spool_lock:
+                os.replace(self.spool_path, claim)
+        except FileNotFoundError:
+            return [], None
+        with open(claim, encoding="utf-8") as f:
+            return [json.loads(line) for line in f if line.strip()], claim
+
+    def close(self):
+        # Runs at exit, when the index's executor no longer takes work; the
+        # next build_ann_index picks these rows up
+        self.flush(index=False)
+
+    def stats(self):
+        with self._lock:
+            pending = len(self._pending)
+        return {"pending": pending, "written": self.written, "spooled": self.spooled}
+
+
+_history_writer = None
+_history_writer_lock = threading.Lock()
+
+
+def get_history_writer():
+    global _history_writer
+    if _history_writer is None:
+        with _history_writer_lock:
+            if _history_writer is None:
+                conf = get_history_writer_settings()
+                _history_writer = HistoryWriter(
+                    conf["BATCH_SIZE"],
+                    conf["FLUSH_INTERVAL"],
+                    conf["MAX_PENDING"],
+                    conf["SPOOL_PATH"],
+                    conf["USERNAME"],
+                )
+    return _history_writer
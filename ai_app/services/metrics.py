@@ -0,0 +1,409 @@
+from bisect import bisect_left
+import threading
+import time
+
+from ai_app.services.client_pool import client_pool
+from ai_app.services.completion_cache import get_completion_cache
+from ai_app.services.history_writer import get_history_writer
+from ai_app.services.singleflight import get_singleflight
+from ai_app.services.speculation import speculation_stats
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2, 4, 8, 16, 32, 64)
+FAST_LATENCY_BUCKETS = (0.0005, 0.001, 0.002, 0.005, 0.01, 0.025, 0.05, 0.1)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    pairs = ",".join(
+        '{}="{}"'.format(
+            name,
+            str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", " "),
+        )
+        for name, value in labels
+    )
+    return "{" + pairs + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def collect(self):
+        with self._lock:
+            items = list(self._values.items())
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} counter",
+        ]
+        for key, value in items:
+            labels = _format_labels(zip(self.labelnames, key))
+            lines.append(f"{self.name}{labels} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets) + (float("inf"),)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                series = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            series[0][bisect_left(self.buckets, value)] += 1
+            series[1] += value
+            series[2] += 1
+
+    def collect(self):
+        with self._lock:
+            items = [(key, (list(s[0]), s[1], s[2])) for key, s in self._values.items()]
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} histogram",
+        ]
+        for key, (bucket_counts, total, count) in items:
+            base = list(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, bucket_counts):
+                cumulative += bucket_count
+                labels = _format_labels(base + [("le", _format_value(bound))])
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(base)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    """In-process metrics rendered in the Prometheus text exposition format.
+
+    Collectors are callables returning (name, type, help, [(labels, value)])
+    tuples, for state that lives in other services and is read at scrape time.
+    """
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def counter(self, name, documentation, labelnames=()):
+        metric = Counter(name, documentation, labelnames)
+        self._metrics.append(metric)
+        return metric
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        metric = Histogram(name, documentation, labelnames, buckets)
+        self._metrics.append(metric)
+        return metric
+
+    def register_collector(self, collector):
+        self._collectors.append(collector)
+        return collector
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.collect())
+        for collector in self._collectors:
+            for name, metric_type, documentation, samples in collector():
+                lines.append(f"# HELP {name} {documentation}")
+                lines.append(f"# TYPE {name} {metric_type}")
+                for labels, value in samples:
+                    lines.append(
+                        f"{name}{_format_labels(labels.items())} {_format_value(value)}"
+                    )
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+llm_requests = registry.counter(
+    "llm_requests_total",
+    "LLM completions by outcome",
+    ("backend", "model", "role", "outcome"),
+)
+llm_errors = registry.counter(
+    "llm_errors_total",
+    "Failed LLM completions by exception type",
+    ("backend", "model", "role", "error_type"),
+)
+llm_latency = registry.histogram(
+    "llm_request_duration_seconds",
+    "Wall-clock time of LLM completions",
+    ("backend", "model", "role"),
+)
+llm_ttft = registry.histogram(
+    "llm_time_to_first_token_seconds",
+    "Time until the first streamed token of an LLM completion",
+    ("backend", "model", "role"),
+)
+llm_prompt_tokens = registry.counter(
+    "llm_prompt_tokens_total",
+    "Prompt tokens reported by the backend",
+    ("backend", "model", "role"),
+)
+llm_completion_tokens = registry.counter(
+    "llm_completion_tokens_total",
+    "Completion tokens reported by the backend",
+    ("backend", "model", "role"),
+)
+llm_cached_prompt_tokens = registry.counter(
+    "llm_cached_prompt_tokens_total",
+    "Prompt tokens the backend served from its prompt cache",
+    ("backend", "model", "role"),
+)
+llm_queue_delay = registry.histogram(
+    "llm_queue_delay_seconds",
+    "Time LLM calls waited for the client-side rate limiter",
+    ("backend",),
+)
+llm_retries = registry.counter(
+    "llm_retries_total",
+    "LLM calls retried with backoff after failing on every backend",
+    ("error_type",),
+)
+llm_cascade_escalations = registry.counter(
+    "llm_cascade_escalations_total",
+    "Single-role answers re-generated after the cascade's cheap model failed",
+    ("role",),
+)
+retrieval_latency = registry.histogram(
+    "retrieval_duration_seconds",
+    "Time to retrieve source passages for a role prompt",
+    buckets=FAST_LATENCY_BUCKETS,
+)
+http_requests = registry.counter(
+    "http_requests_total",
+    "HTTP requests by view and status code",
+    ("view", "method", "status"),
+)
+http_latency = registry.histogram(
+    "http_request_duration_seconds",
+    "Time to fully serve a request, including streamed bodies",
+    ("view", "method"),
+)
+
+
+class LLMCallRecorder:
+    """Records one backend call; create it right before the request is sent"""
+
+    def __init__(self, backend, model, role=None):
+        self.labels = {"backend": backend, "model": model, "role": role or ""}
+        self.started_at = time.perf_counter()
+        self.first_token_at = None
+        self.usage = {}
+
+    def set_usage(self, prompt_tokens, completion_tokens, cached_tokens=None):
+        self.usage = {
+            "prompt_tokens": prompt_tokens or 0,
+            "completion_tokens": completion_tokens or 0,
+            "cached_tokens": cached_tokens or 0,
+        }
+
+    def first_token(self):
+        if self.first_token_at is None:
+            self.first_token_at = time.perf_counter()
+            llm_ttft.observe(self.first_token_at - self.started_at, **self.labels)
+
+    def success(self):
+        llm_latency.observe(time.perf_counter() - self.started_at, **self.labels)
+        llm_requests.inc(outcome="success", **self.labels)
+        if self.usage:
+            llm_prompt_tokens.inc(self.usage["prompt_tokens"], **self.labels)
+            llm_completion_tokens.inc(self.usage["completion_tokens"], **self.labels)
+            llm_cached_prompt_tokens.inc(self.usage["cached_tokens"], **self.labels)
+
+    def failure(self, error):
+        llm_latency.observe(time.perf_counter() - self.started_at, **self.labels)
+        llm_requests.inc(outcome="error", **self.labels)
+        llm_errors.inc(error_type=type(error).__name__, **self.labels)
+
+    def cancelled(self):
+        """The caller stopped waiting: a closed stream or a cancelled task"""
+        llm_latency.observe(time.perf_counter() - self.started_at, **self.labels)
+        llm_requests.inc(outcome="cancelled", **self.labels)
+
+
+@registry.register_collector
+def collect_completion_cache():
+    stats = get_completion_cache().stats()
+    labels = {"backend": stats["backend"]}
+    families = [
+        (
+            "llm_cache_hits_total",
+            "counter",
+            "Completion cache hits",
+            [(labels, stats["hits"])],
+        ),
+        (
+            "llm_cache_misses_total",
+            "counter",
+            "Completion cache misses",
+            [(labels, stats["misses"])],
+        ),
+    ]
+    # Only the in-process cache can count these; a shared Django cache
+    # exports neither rather than a constant 0
+    if stats["evictions"] is not None:
+        families.append(
+            (
+                "llm_cache_evictions_total",
+                "counter",
+                "Completion cache LRU evictions",
+                [(labels, stats["evictions"])],
+            )
+        )
+    if stats["entries"] is not None:
+        families.append(
+            (
+                "llm_cache_entries",
+                "gauge",
+                "Entries in the in-process completion cache",
+                [(labels, stats["entries"])],
+            )
+        )
+    return families
+
+
+@registry.register_collector
+def collect_client_pool():
+    pools = client_pool.stats()
+
+    def samples(field):
+        return [
+            (
+                {
+                    "backend": pool["backend"],
+                    "base_url": pool["base_url"],
+                    "key": pool["key"],
+                },
+                pool[field],
+            )
+            for pool in pools
+        ]
+
+    return [
+        (
+            "llm_pool_clients_created_total",
+            "counter",
+            "Pooled LLM clients created",
+            samples("clients_created"),
+        ),
+        (
+            "llm_pool_clients_reused_total",
+            "counter",
+            "Pooled LLM client reuses",
+            samples("clients_reused"),
+        ),
+        (
+            "llm_pool_open_connections",
+            "gauge",
+            "Open HTTP connections to LLM backends",
+            samples("open_connections"),
+        ),
+        (
+            "llm_pool_idle_connections",
+            "gauge",
+            "Idle keep-alive connections to LLM backends",
+            samples("idle_connections"),
+        ),
+    ]
+
+
+@registry.register_collector
+def collect_speculation():
+    stats = speculation_stats.snapshot()
+    return [
+        (
+            "llm_speculation_launched_total",
+            "counter",
+            "Speculative solo completions started",
+            [({}, stats["launched"])],
+        ),
+        (
+            "llm_speculation_hits_total",
+            "counter",
+            "Speculative completions kept",
+            [({}, stats["hits"])],
+        ),
+        (
+            "llm_speculation_misses_total",
+            "counter",
+            "Speculative completions discarded",
+            [({}, stats["misses"])],
+        ),
+        (
+            "llm_speculation_wasted_tokens_total",
+            "counter",
+            "Estimated tokens spent on discarded speculation",
+            [
+                ({"kind": "prompt"}, stats["wasted_prompt_tokens"]),
+                ({"kind": "completion"}, stats["wasted_completion_tokens"]),
+            ],
+        ),
+    ]
+
+
+@registry.register_collector
+def collect_history_writer():
+    stats = get_history_writer().stats()
+    return [
+        (
+            "history_writes_pending",
+            "gauge",
+            "History records queued for the next batch",
+            [({}, stats["pending"])],
+        ),
+        (
+            "history_writes_total",
+            "counter",
+            "History records saved by the write-behind queue",
+            [({}, stats["written"])],
+        ),
+        (
+            "history_writes_spooled_total",
+            "counter",
+            "History records spooled to disk because they couldn't be saved",
+            [({}, stats["spooled"])],
+        ),
+    ]
+
+
+@registry.register_collector
+def collect_singleflight():
+    stats = get_singleflight().stats()
+    return [
+        (
+            "llm_singleflight_calls_total",
+            "counter",
+            "LLM calls sent to a backend by the request coalescer",
+            [({"kind": kind}, count) for kind, count in stats["calls"].items()],
+        ),
+        (
+            "llm_singleflight_coalesced_total",
+            "counter",
+            "LLM calls served by an identical call already in flight",
+            [({"kind": kind}, count) for kind, count in stats["coalesced"].items()],
+        ),
+    ]
@@ -0,0 +1,212 @@
+from collections import OrderedDict
+import asyncio
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+
+from django.conf import settings
+import httpx
+import openai
+
+from ai_app.services.token_budget import approximate_tokens
+
+DEFAULT_MOCK_SETTINGS = {
+    "ENABLED": False,
+    "TTFT": 0.05,
+    "TOKEN_LATENCY": 0.01,
+    "RESPONSE_TOKENS": 60,
+    "ERROR_RATE": 0.0,
+    "RATE_LIMIT_RATE": 0.0,
+    "RETRY_AFTER": 1,
+    "SEED": 0,
+}
+
+MOCK_BASE_URL = "http://mock-llm.invalid/v1"
+
+# System prompts remembered for the simulated prompt cache
+PROMPT_CACHE_ENTRIES = 1024
+
+COLLABORATION_PROMPT = re.compile(r"decide if collaboration would be valuable")
+COLLABORATOR_LINE = re.compile(r"^\s*- (.+?): ", re.MULTILINE)
+ARRAY_FORMAT_ROLE = re.compile(r'\{"role": "([^"]+)", "response": ')
+
+VOCABULARY = (
+    "awareness silence presence breath light stillness heart union wisdom "
+    "emptiness form love time being becoming path mystery grace insight "
+    "spirit journey surrender truth practice devotion attention source "
+    "unfolds reveals invites holds deepens dissolves returns opens rests "
+    "gently quietly fully within beyond through beneath always"
+).split()
+
+
+def get_mock_settings():
+    return {**DEFAULT_MOCK_SETTINGS, **getattr(settings, "LLM_MOCK_BACKEND", {})}
+
+
+class MockLLM:
+    """Offline stand-in for a chat backend.
+
+    Output is a pure function of the messages and SEED, and follows the JSON
+    shapes the dialogue prompts ask for. Latency and failures (500s and 429s
+    with Retry-After) are injected from a seeded RNG so load tests replay.
+    Like a provider's prompt cache, a system prompt seen before is reported
+    as cached tokens. Usage is estimated from characters, so the mock never
+    needs a tokenizer from the hub.
+    """
+
+    def __init__(self, conf=None):
+        self.conf = conf or get_mock_settings()
+        self._faults = random.Random(self.conf["SEED"])
+        self._prompt_cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _rng(self, messages):
+        payload = json.dumps([self.conf["SEED"], messages], sort_keys=True)
+        return random.Random(hashlib.sha256(payload.encode("utf-8")).digest())
+
+    def _sentences(self, rng, max_words):
+        words, sentences = 0, []
+        while words < max_words:
+            length = min(rng.randint(6, 14), max_words - words)
+            sentence = " ".join(rng.choice(VOCABULARY) for _ in range(length))
+            sentences.append(sentence.capitalize() + ".")
+            words += length
+        return " ".join(sentences)
+
+    def respond(self, messages, max_tokens):
+        """The deterministic completion text for these messages"""
+        rng = self._rng(messages)
+        budget = max(4, min(self.conf["RESPONSE_TOKENS"], max_tokens))
+        system = next((m["content"] for m in messages if m["role"] == "system"), "")
+
+        if COLLABORATION_PROMPT.search(system):
+            collaborators = COLLABORATOR_LINE.findall(system)
+            should_collaborate = bool(collaborators) and rng.random() < 0.5
+            return json.dumps(
+                {
+                    "should_collaborate": should_collaborate,
+                    "chosen_collaborator": (
+                        rng.choice(collaborators) if should_collaborate else None
+                    ),
+                    "reasoning": self._sentences(rng, 12),
+                }
+            )
+
+        speakers = ARRAY_FORMAT_ROLE.findall(system)
+        if speakers:
+            share = max(4, budget // len(speakers))
+            return json.dumps(
+                [
+                    {"role": speaker, "response": self._sentences(rng, share)}
+                    for speaker in speakers
+                ]
+            )
+
+        return self._sentences(rng, budget)
+
+    def cached_tokens(self, messages):
+        system = next((m["content"] for m in messages if m["role"] == "system"), "")
+        with self._lock:
+            seen = system in self._prompt_cache
+            self._prompt_cache[system] = True
+            self._prompt_cache.move_to_end(system)
+            if len(self._prompt_cache) > PROMPT_CACHE_ENTRIES:
+                self._prompt_cache.popitem(last=False)
+        return approximate_tokens(system) if seen else 0
+
+    def usage(self, messages, content):
+        prompt_tokens = sum(approximate_tokens(m["content"]) for m in messages)
+        return prompt_tokens, approximate_tokens(content), self.cached_tokens(messages)
+
+    def chunks(self, content):
+        return re.findall(r"\S+\s*", content)
+
+    def next_fault(self):
+        """None, "rate_limit" or "error" for the next call"""
+        with self._lock:
+            roll = self._faults.random()
+        if roll < self.conf["RATE_LIMIT_RATE"]:
+            return "rate_limit"
+        if roll < self.conf["RATE_LIMIT_RATE"] + self.conf["ERROR_RATE"]:
+            return "error"
+        return None
+
+    def rate_limit_error(self):
+        request = httpx.Request("POST", f"{MOCK_BASE_URL}/chat/completions")
+        response = httpx.Response(
+            429,
+            headers={"retry-after": str(self.conf["RETRY_AFTER"])},
+            request=request,
+        )
+        return openai.RateLimitError(
+            "Mock backend rate limit", response=response, body=None
+        )
+
+    def server_error(self):
+        request = httpx.Request("POST", f"{MOCK_BASE_URL}/chat/completions")
+        response = httpx.Response(500, request=request)
+        return openai.InternalServerError(
+            "Mock backend error", response=response, body=None
+        )
+
+    def complete(self, messages, max_tokens, recorder):
+        content = self.respond(messages, max_tokens)
+        for _ in self.stream(messages, max_tokens, recorder, content):
+            pass
+        return content
+
+    def stream(self, messages, max_tokens, recorder, content=None):
+        fault = self.next_fault()
+        if fault == "rate_limit":
+            raise self.rate_limit_error()
+        time.sleep(self.conf["TTFT"])
+        if fault == "error":
+            raise self.server_error()
+
+        if content is None:
+            content = self.respond(messages, max_tokens)
+        for i, chunk in enumerate(self.chunks(content)):
+            if i:
+                time.sleep(self.conf["TOKEN_LATENCY"])
+            recorder.first_token()
+            yield chunk
+        recorder.set_usage(*self.usage(messages, content))
+
+    async def acomplete(self, messages, max_tokens, recorder):
+        content = self.respond(messages, max_tokens)
+        async for _ in self.astream(messages, max_tokens, recorder, content):
+            pass
+        return content
+
+    async def astream(self, messages, max_tokens, recorder, content=None):
+        fault = self.next_fault()
+        if fault == "rate_limit":
+            raise self.rate_limit_error()
+        await asyncio.sleep(self.conf["TTFT"])
+        if fault == "error":
+            raise self.server_error()
+
+        if content is None:
+            content = self.respond(messages, max_tokens)
+        for i, chunk in enumerate(self.chunks(content)):
+            if i:
+                await asyncio.sleep(self.conf["TOKEN_LATENCY"])
+            recorder.first_token()
+            yield chunk
+        recorder.set_usage(*self.usage(messages, content))
+
+
+_mock_llm = None
+_mock_llm_lock = threading.Lock()
+
+
+def get_mock_llm():
+    global _mock_llm
+    if _mock_llm is None:
+        with _mock_llm_lock:
+            if _mock_llm is None:
+                _mock_llm = MockLLM()
+    return _mock_llm
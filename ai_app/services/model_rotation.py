@@ -1,71 +1,230 @@
-from openai import OpenAI
-from ollama import chat
-import os
+from ai_app.services.completion_cache import get_completion_cache, make_cache_key
+from ai_app.services.model_router import (
+    DEFAULT_POOL,
+    get_cascade_settings,
+    get_model_router,
+)
+from ai_app.services.singleflight import get_singleflight
 import logging
 
 logger = logging.getLogger("ai_app")
 
 
 class OpenAIService:
-    def __init__(self, use_ollama=False, model_name=None):
-        self.use_ollama = use_ollama
-        self.model_name = model_name or ("llama3.2" if use_ollama else "gpt-4o-mini")
-        if not use_ollama:
-            self.client = OpenAI(
-                base_url="https://models.inference.ai.azure.com",
-                api_key=os.getenv("GITHUB_TOKEN"),
-            )
+    """Completions from the LLM_BACKENDS pool a request asked for.
+
+    use_mock and use_ollama pick the mock or Ollama backends, otherwise the
+    OpenAI-compatible ones (GitHub Models by default); model_name restricts
+    the pool to backends serving that model. Otherwise each call may ask for
+    a model (a role's model_name), used when a backend of the pool serves
+    it. The model router chooses the backend for each call and fails over
+    between them.
+    """
+
+    def __init__(
+        self, use_ollama=False, model_name=None, use_cache=True, use_mock=False
+    ):
+        self.use_mock = use_mock
+        self.use_ollama = use_ollama and not use_mock
+        if use_mock:
+            self.pool = "mock"
+        else:
+            self.pool = "ollama" if use_ollama else DEFAULT_POOL
+        self.model_name = model_name
+        self.use_cache = use_cache
+        self.router = get_model_router()
+
+    def resolve_model(self, model):
+        """The model a call asking for model is routed to; None for any
+        backend of the pool"""
+        if self.model_name:
+            return self.model_name
+        return self.router.resolve_model(self.pool, model)
+
+    def cascade_model(self, model):
+        """The cheap model to try before model when LLM_CASCADE is enabled
+        and both are served by backends of the pool"""
+        conf = get_cascade_settings()
+        if not conf["ENABLED"] or self.model_name:
+            return None
+        cheap = self.resolve_model(conf["MODELS"].get(self.pool))
+        model = self.resolve_model(model)
+        if cheap is None or model is None or cheap == model:
+            return None
+        return cheap
+
+    def request_key(self, model, messages, temperature, max_tokens, top_p):
+        return make_cache_key(
+            self.pool, model, messages, temperature, max_tokens, top_p
+        )
+
+    def cache_key(self, model, messages, temperature, max_tokens, top_p):
+        if not self.use_cache:
+            return None
+        return self.request_key(model, messages, temperature, max_tokens, top_p)
+
+    def create_completion(
+        self,
+        messages,
+        temperature=0.7,
+        max_tokens=1000,
+        top_p=1.0,
+        role_name=None,
+        model=None,
+    ):
+        model = self.resolve_model(model)
+        cache_key = self.cache_key(model, messages, temperature, max_tokens, top_p)
+        if cache_key:
+            cached = get_completion_cache().get(cache_key)
+            if cached is not None:
+                return cached
 
-    def create_completion(self, messages, temperature=0.7, max_tokens=1000, top_p=1.0):
+        # Identical calls already in flight share one backend call
+        return get_singleflight().do(
+            self.request_key(model, messages, temperature, max_tokens, top_p),
+            lambda: self._routed_completion(
+                model, messages, temperature, max_tokens, top_p, role_name, cache_key
+            ),
+        )
+
+    def _routed_completion(
+        self, model, messages, temperature, max_tokens, top_p, role_name, cache_key
+    ):
         try:
-            if self.use_ollama:
-                response_stream = chat(
-                    model=self.model_name, messages=messages, stream=True
-                )
-
-                full_response = ""
-                for chunk in response_stream:
-                    if chunk and "message" in chunk and "content" in chunk["message"]:
-                        content = chunk["message"]["content"]
-                        full_response += content
-                        print(content, end="", flush=True)
-
-                return full_response
-            else:
-                response = self.client.chat.completions.create(
-                    model=self.model_name,
-                    messages=messages,
-                    temperature=temperature,
-                    max_tokens=max_tokens,
-                    top_p=top_p,
-                )
-                return response.choices[0].message.content
+            content = self.router.complete(
+                self.pool,
+                model,
+                messages,
+                temperature,
+                max_tokens,
+                top_p,
+                role_name,
+            )
         except Exception as e:
             logger.error(f"Error in completion: {e}")
             raise
 
-    def create_streaming_completion(self, messages, temperature=0.7, max_tokens=1000):
+        if cache_key:
+            get_completion_cache().set(cache_key, content)
+        return content
+
+    def create_streaming_completion(
+        self, messages, temperature=0.7, max_tokens=1000, role_name=None, model=None
+    ):
         """Separate method for streaming responses"""
+        model = self.resolve_model(model)
+        cache_key = self.cache_key(model, messages, temperature, max_tokens, 1.0)
+        if cache_key:
+            cached = get_completion_cache().get(cache_key)
+            if cached is not None:
+                yield cached
+                return
+
+        yield from get_singleflight().stream(
+            self.request_key(model, messages, temperature, max_tokens, 1.0),
+            lambda: self._routed_stream(
+                model, messages, temperature, max_tokens, role_name, cache_key
+            ),
+        )
+
+    def _routed_stream(
+        self, model, messages, temperature, max_tokens, role_name, cache_key
+    ):
+        full_response = ""
         try:
-            if self.use_ollama:
-                stream = chat(
-                    model="llama2",
-                    messages=messages,
-                    stream=True,
-                )
-                for chunk in stream:
-                    yield chunk["message"]["content"]
-            else:
-                response = self.client.chat.completions.create(
-                    model=self.model_name,
-                    messages=messages,
-                    temperature=temperature,
-                    max_tokens=max_tokens,
-                    stream=True,
-                )
-                for chunk in response:
-                    if chunk.choices[0].delta.content:
-                        yield chunk.choices[0].delta.content
+            for chunk in self.router.stream(
+                self.pool, model, messages, temperature, max_tokens, role_name
+            ):
+                full_response += chunk
+                yield chunk
         except Exception as e:
             logger.error(f"Error in streaming completion: {e}")
             raise
+
+        if cache_key:
+            get_completion_cache().set(cache_key, full_response)
+
+
+class AsyncOpenAIService(OpenAIService):
+    """Asyncio counterpart of OpenAIService, used by the async views"""
+
+    async def create_completion(
+        self,
+        messages,
+        temperature=0.7,
+        max_tokens=1000,
+        top_p=1.0,
+        role_name=None,
+        model=None,
+    ):
+        model = self.resolve_model(model)
+        cache_key = self.cache_key(model, messages, temperature, max_tokens, top_p)
+        if cache_key:
+            cached = await get_completion_cache().aget(cache_key)
+            if cached is not None:
+                return cached
+
+        return await get_singleflight().ado(
+            self.request_key(model, messages, temperature, max_tokens, top_p),
+            lambda: self._routed_completion(
+                model, messages, temperature, max_tokens, top_p, role_name, cache_key
+            ),
+        )
+
+    async def _routed_completion(
+        self, model, messages, temperature, max_tokens, top_p, role_name, cache_key
+    ):
+        try:
+            content = await self.router.acomplete(
+                self.pool,
+                model,
+                messages,
+                temperature,
+                max_tokens,
+                top_p,
+                role_name,
+            )
+        except Exception as e:
+            logger.error(f"Error in async completion: {e}")
+            raise
+
+        if cache_key:
+            await get_completion_cache().aset(cache_key, content)
+        return content
+
+    async def create_streaming_completion(
+        self, messages, temperature=0.7, max_tokens=1000, role_name=None, model=None
+    ):
+        """Async generator yielding content chunks as they arrive"""
+        model = self.resolve_model(model)
+        cache_key = self.cache_key(model, messages, temperature, max_tokens, 1.0)
+        if cache_key:
+            cached = await get_completion_cache().aget(cache_key)
+            if cached is not None:
+                yield cached
+                return
+
+        async for chunk in get_singleflight().astream(
+            self.request_key(model, messages, temperature, max_tokens, 1.0),
+            lambda: self._routed_stream(
+                model, messages, temperature, max_tokens, role_name, cache_key
+            ),
+        ):
+            yield chunk
+
+    async def _routed_stream(
+        self, model, messages, temperature, max_tokens, role_name, cache_key
+    ):
+        full_response = ""
+        try:
+            async for chunk in self.router.astream(
+                self.pool, model, messages, temperature, max_tokens, role_name
+            ):
+                full_response += chunk
+                yield chunk
+        except Exception as e:
+            logger.error(f"Error in async streaming completion: {e}")
+            raise
+
+        if cache_key:
+            await get_completion_cache().aset(cache_key, full_response)
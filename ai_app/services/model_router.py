@@ -0,0 +1,992 @@
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import asyncio
+import contextlib
+import itertools
+import logging
+import os
+import threading
+import time
+
+from django.conf import settings
+
+from ai_app.services.client_pool import client_pool
+from ai_app.services.metrics import (
+    LLMCallRecorder,
+    llm_queue_delay,
+    llm_retries,
+    registry,
+)
+from ai_app.services.mock_backend import get_mock_llm
+from ai_app.services.rate_limiter import (
+    QueueFull,
+    RateLimiter,
+    backoff_delay,
+    estimate_call_tokens,
+    get_rate_limit_settings,
+    retry_after,
+)
+from ai_app.services.token_budget import approximate_tokens
+
+logger = logging.getLogger("ai_app")
+
+GITHUB_MODELS_BASE_URL = "https://models.inference.ai.azure.com"
+OLLAMA_HOST = os.getenv("OLLAMA_HOST", "http://localhost:11434")
+
+DEFAULT_MODELS = {"github": "gpt-4o-mini", "ollama": "llama3.2", "mock": "mock"}
+DEFAULT_BASE_URLS = {"github": GITHUB_MODELS_BASE_URL, "ollama": OLLAMA_HOST}
+
+# Requests pick a pool: "ollama" and "mock" are served by backends of that
+# kind, "default" by every other (OpenAI-compatible) backend
+DEFAULT_POOL = "default"
+LOCAL_KINDS = ("ollama", "mock")
+
+DEFAULT_LLM_BACKENDS = [
+    {
+        "NAME": "github/gpt-4o-mini",
+        "BACKEND": "github",
+        "MODEL": "gpt-4o-mini",
+        "RPM": 15,
+    },
+    {"NAME": "ollama/llama3.2", "BACKEND": "ollama", "MODEL": "llama3.2"},
+    {"NAME": "mock", "BACKEND": "mock", "MODEL": "mock"},
+]
+
+DEFAULT_ROUTER_SETTINGS = {
+    "WINDOW": 50,
+    "LATENCY_SMOOTHING": 0.2,
+    "FAILURE_THRESHOLD": 3,
+    "COOLDOWN": 30.0,
+    "HEDGE": False,
+    "HEDGE_QUANTILE": 0.95,
+    "HEDGE_MIN_SAMPLES": 20,
+    "HEDGE_WORKERS": 16,
+    # Model names roles may use for a configured model
+    "MODEL_ALIASES": {"gpt-3.5-turbo": "gpt-4o-mini"},
+}
+
+DEFAULT_CASCADE_SETTINGS = {
+    "ENABLED": False,
+    "MODELS": {DEFAULT_POOL: "gpt-4o-mini", "ollama": "llama3.2"},
+}
+
+# Errors that would fail on every backend, so failing over can't help
+NON_RETRYABLE_STATUSES = frozenset((400, 413, 422))
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+CIRCUIT_STATES = {CLOSED: 0, OPEN: 1, HALF_OPEN: 2}
+
+
+class CircuitOpen(Exception):
+    """The backend's circuit is half open and its trial call is in flight"""
+
+
+class HedgeLost(Exception):
+    """The other call of a hedged pair finished first"""
+
+
+def get_router_settings():
+    return {**DEFAULT_ROUTER_SETTINGS, **getattr(settings, "LLM_ROUTER", {})}
+
+
+def get_cascade_settings():
+    return {**DEFAULT_CASCADE_SETTINGS, **getattr(settings, "LLM_CASCADE", {})}
+
+
+def get_backend_settings():
+    return getattr(settings, "LLM_BACKENDS", DEFAULT_LLM_BACKENDS)
+
+
+def error_status(error):
+    return getattr(error, "status_code", None)
+
+
+def is_retryable(error):
+    return error_status(error) not in NON_RETRYABLE_STATUSES
+
+
+def cached_tokens(usage):
+    """Prompt tokens an OpenAI-compatible backend read from its prompt cache"""
+    details = getattr(usage, "prompt_tokens_details", None)
+    return getattr(details, "cached_tokens", None)
+
+
+def ollama_options(temperature, max_tokens, top_p=None):
+    """Ollama's names for the OpenAI sampling parameters"""
+    options = {"temperature": temperature, "num_predict": max_tokens}
+    if top_p is not None:
+        options["top_p"] = top_p
+    return options
+
+
+class Backend:
+    """One model on one endpoint, with its rolling health.
+
+    Keeps the latency of recent successes (smoothed, and the raw window for
+    hedging quantiles) and the outcomes of recent calls. A circuit breaker
+    opens after FAILURE_THRESHOLD consecutive failures, or on a 429 for its
+    Retry-After, and stays open for COOLDOWN seconds; after that it is half
+    open and admits a single trial call, whose result closes or re-opens it.
+    """
+
+    def __init__(
+        self,
+        name,
+        kind,
+        model,
+        base_url=None,
+        api_key=None,
+        fallback=False,
+        rpm=None,
+        tpm=None,
+    ):
+        self.name = name
+        self.kind = kind
+        self.model = model
+        self.base_url = base_url or DEFAULT_BASE_URLS.get(kind)
+        self.api_key = api_key
+        self.fallback = fallback
+        conf = get_router_settings()
+        self.window = conf["WINDOW"]
+        self.smoothing = conf["LATENCY_SMOOTHING"]
+        self.failure_threshold = conf["FAILURE_THRESHOLD"]
+        self.cooldown = conf["COOLDOWN"]
+        self.latencies = deque(maxlen=self.window)
+        self.outcomes = deque(maxlen=self.window)
+        self.latency = None
+        self.consecutive_failures = 0
+        self.state = CLOSED
+        self.open_until = 0.0
+        self.probing = False
+        self.limiter = RateLimiter(
+            name, rpm, tpm, get_rate_limit_settings()["MAX_QUEUE_DELAY"]
+        )
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_settings(cls, conf):
+        kind = conf.get("BACKEND", "github")
+        model = conf.get("MODEL") or DEFAULT_MODELS.get(kind)
+        api_key_env = conf.get(
+            "API_KEY_ENV", "GITHUB_TOKEN" if kind == "github" else None
+        )
+        return cls(
+            conf.get("NAME") or f"{kind}/{model}",
+            kind,
+            model,
+            conf.get("BASE_URL"),
+            os.getenv(api_key_env) if api_key_env else conf.get("API_KEY"),
+            conf.get("FALLBACK", False),
+            conf.get("RPM"),
+            conf.get("TPM"),
+        )
+
+    def serves(self, pool):
+        if pool == DEFAULT_POOL:
+            return self.kind not in LOCAL_KINDS
+        return self.kind == pool
+
+    def circuit(self):
+        with self._lock:
+            if self.state == OPEN and time.monotonic() >= self.open_until:
+                self.state = HALF_OPEN
+            return self.state
+
+    def available(self):
+        """Whether a call routed here now would be admitted"""
+        state = self.circuit()
+        return state == CLOSED or (state == HALF_OPEN and not self.probing)
+
+    def admit(self):
+        """Claim the right to send a call; while half open only the trial
+        call is admitted, until its result closes or re-opens the circuit"""
+        with self._lock:
+            if self.state == OPEN and time.monotonic() >= self.open_until:
+                self.state = HALF_OPEN
+            if self.state != HALF_OPEN:
+                return True
+            if self.probing:
+                return False
+            self.probing = True
+            return True
+
+    def release(self):
+        """Give up the trial call without a result, e.g. when cancelled"""
+        with self._lock:
+            self.probing = False
+
+    @property
+    def error_rate(self):
+        with self._lock:
+            if not self.outcomes:
+                return 0.0
+            return self.outcomes.count(False) / len(self.outcomes)
+
+    def score(self):
+        """Expected seconds to a successful completion; untried backends
+        score 0 so that they get measured"""
+        if self.latency is None:
+            return 0.0
+        return self.latency / max(1.0 - self.error_rate, 0.05)
+
+    def hedge_delay(self, quantile, min_samples):
+        with self._lock:
+            if len(self.latencies) < min_samples:
+                return None
+            ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(quantile * len(ordered)))]
+
+    def record_success(self, latency):
+        with self._lock:
+            self.latencies.append(latency)
+            self.outcomes.append(True)
+            self.latency = (
+                latency
+                if self.latency is None
+                else self.latency + self.smoothing * (latency - self.latency)
+            )
+            self.consecutive_failures = 0
+            self.state = CLOSED
+            self.probing = False
+
+    def record_failure(self, error):
+        wait_for = retry_after(error) if error_status(error) == 429 else None
+        with self._lock:
+            self.outcomes.append(False)
+            self.consecutive_failures += 1
+            self.probing = False
+            if (
+                wait_for is not None
+                or self.state == HALF_OPEN
+                or self.consecutive_failures >= self.failure_threshold
+            ):
+                self.state = OPEN
+                self.open_until = time.monotonic() + (
+                    wait_for if wait_for is not None else self.cooldown
+                )
+                logger.warning(
+                    f"Circuit for {self.name} opened for "
+                    f"{self.open_until - time.monotonic():.1f}s after: {error}"
+                )
+
+    def client(self):
+        if self.kind == "mock":
+            return get_mock_llm()
+        return client_pool.get_client(self.kind, self.base_url, api_key=self.api_key)
+
+    def async_client(self):
+        if self.kind == "mock":
+            return get_mock_llm()
+        return client_pool.get_async_client(
+            self.kind, self.base_url, api_key=self.api_key
+        )
+
+    def complete(self, messages, temperature, max_tokens, top_p, recorder):
+        if self.kind == "mock":
+            return self.client().complete(messages, max_tokens, recorder)
+        if self.kind == "ollama":
+            response_stream = self.client().chat(
+                model=self.model,
+                messages=messages,
+                stream=True,
+                options=ollama_options(temperature, max_tokens, top_p),
+            )
+
+            full_response = ""
+            for chunk in response_stream:
+                if chunk and "message" in chunk and "content" in chunk["message"]:
+                    recorder.first_token()
+                    full_response += chunk["message"]["content"]
+                if chunk and chunk.get("done"):
+                    recorder.set_usage(
+                        chunk.get("prompt_eval_count"), chunk.get("eval_count")
+                    )
+
+            return full_response
+        response = self.client().chat.completions.create(
+            model=self.model,
+            messages=messages,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            top_p=top_p,
+        )
+        if response.usage:
+            recorder.set_usage(
+                response.usage.prompt_tokens,
+                response.usage.completion_tokens,
+                cached_tokens(response.usage),
+            )
+        return response.choices[0].message.content
+
+    def stream(self, messages, temperature, max_tokens, recorder, top_p=None):
+        if self.kind == "mock":
+            yield from self.client().stream(messages, max_tokens, recorder)
+            return
+        if self.kind == "ollama":
+            stream = self.client().chat(
+                model=self.model,
+                messages=messages,
+                stream=True,
+                options=ollama_options(temperature, max_tokens, top_p),
+            )
+            for chunk in stream:
+                if chunk.get("done"):
+                    recorder.set_usage(
+                        chunk.get("prompt_eval_count"), chunk.get("eval_count")
+                    )
+                if chunk["message"]["content"]:
+                    yield chunk["message"]["content"]
+            return
+        response = self.client().chat.completions.create(
+            model=self.model,
+            messages=messages,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            top_p=top_p,
+            stream=True,
+            stream_options={"include_usage": True},
+        )
+        # Closing the response ends the request when the stream is abandoned
+        with response:
+            for chunk in response:
+                if chunk.usage:
+                    recorder.set_usage(
+                        chunk.usage.prompt_tokens,
+                        chunk.usage.completion_tokens,
+                        cached_tokens(chunk.usage),
+                    )
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+
+    async def acomplete(self, messages, temperature, max_tokens, top_p, recorder):
+        if self.kind == "mock":
+            return await self.async_client().acomplete(messages, max_tokens, recorder)
+        if self.kind == "ollama":
+            response_stream = await self.async_client().chat(
+                model=self.model,
+                messages=messages,
+                stream=True,
+                options=ollama_options(temperature, max_tokens, top_p),
+            )
+
+            full_response = ""
+            async for chunk in response_stream:
+                if chunk and "message" in chunk and "content" in chunk["message"]:
+                    recorder.first_token()
+                    full_response += chunk["message"]["content"]
+                if chunk and chunk.get("done"):
+                    recorder.set_usage(
+                        chunk.get("prompt_eval_count"), chunk.get("eval_count")
+                    )
+
+            return full_response
+        response = await self.async_client().chat.completions.create(
+            model=self.model,
+            messages=messages,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            top_p=top_p,
+        )
+        if response.usage:
+            recorder.set_usage(
+                response.usage.prompt_tokens,
+                response.usage.completion_tokens,
+                cached_tokens(response.usage),
+            )
+        return response.choices[0].message.content
+
+    async def astream(self, messages, temperature, max_tokens, recorder, top_p=None):
+        if self.kind == "mock":
+            async for chunk in self.async_client().astream(
+                messages, max_tokens, recorder
+            ):
+                yield chunk
+            return
+        if self.kind == "ollama":
+            stream = await self.async_client().chat(
+                model=self.model,
+                messages=messages,
+                stream=True,
+                options=ollama_options(temperature, max_tokens, top_p),
+            )
+            async for chunk in stream:
+                if chunk.get("done"):
+                    recorder.set_usage(
+                        chunk.get("prompt_eval_count"), chunk.get("eval_count")
+                    )
+                if chunk["message"]["content"]:
+                    yield chunk["message"]["content"]
+            return
+        response = await self.async_client().chat.completions.create(
+            model=self.model,
+            messages=messages,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            top_p=top_p,
+            stream=True,
+            stream_options={"include_usage": True},
+        )
+        async with response:
+            async for chunk in response:
+                if chunk.usage:
+                    recorder.set_usage(
+                        chunk.usage.prompt_tokens,
+                        chunk.usage.completion_tokens,
+                        cached_tokens(chunk.usage),
+                    )
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+
+
+class ModelRouter:
+    """Routes completions over the configured LLM_BACKENDS.
+
+    A request goes to the healthy backend of its pool (and model, if one was
+    asked for) with the lowest expected time to a successful completion.
+    Failed calls fail over to the next candidate, then to backends marked
+    FALLBACK; streams only fail over before their first chunk. With HEDGE
+    on, a completion still running after the HEDGE_QUANTILE latency of its
+    backend is raced against the next candidate, and the first to finish
+    wins.
+    """
+
+    def __init__(self, backends, conf):
+        self.backends = list(backends)
+        self.conf = conf
+        self._adhoc = {}
+        self._lock = threading.Lock()
+        self._hedge_executor = None
+        self.retry_conf = get_rate_limit_settings()
+        self.failovers = 0
+        self.hedges = {"won": 0, "lost": 0}
+
+    def _backend_for(self, pool, model):
+        """A backend for a model that isn't configured, using its pool's
+        default endpoint"""
+        kind = "github" if pool == DEFAULT_POOL else pool
+        model = model or DEFAULT_MODELS[kind]
+        with self._lock:
+            backend = self._adhoc.get((kind, model))
+            if backend is None:
+                conf = next(
+                    (
+                        {**b, "NAME": None, "MODEL": model}
+                        for b in get_backend_settings()
+                        if b.get("BACKEND", "github") == kind
+                    ),
+                    {"BACKEND": kind, "MODEL": model},
+                )
+                backend = self._adhoc[(kind, model)] = Backend.from_settings(conf)
+            return backend
+
+    def resolve_model(self, pool, model):
+        """The model a role's model_name stands for in pool: the name or its
+        MODEL_ALIASES entry when a backend of the pool serves it, otherwise
+        None for the pool's default backends"""
+        if not model:
+            return None
+        model = self.conf["MODEL_ALIASES"].get(model, model)
+        if any(b.serves(pool) and b.model == model for b in self.backends):
+            return model
+        return None
+
+    def candidates(self, pool, model=None):
+        """Backends to try for a request, best first"""
+        primary = [
+            b
+            for b in self.backends
+            if b.serves(pool) and (model is None or b.model == model)
+        ]
+        if not primary:
+            primary = [self._backend_for(pool, model)]
+        fallback = [b for b in self.backends if b.fallback and b not in primary]
+
+        ranked = []
+        for group in (primary, fallback):
+            healthy = [b for b in group if b.available()]
+            ranked.extend(sorted(healthy, key=Backend.score))
+        if not ranked:
+            # Every circuit is open (or busy with its trial call): try the one
+            # that reopens first
+            ranked = sorted(primary, key=lambda b: b.open_until)
+        return ranked
+
+    def hedge_delay(self, backend):
+        if not self.conf["HEDGE"]:
+            return None
+        return backend.hedge_delay(
+            self.conf["HEDGE_QUANTILE"], self.conf["HEDGE_MIN_SAMPLES"]
+        )
+
+    def _count_failover(self, backend, error):
+        logger.warning(f"LLM backend {backend.name} failed, failing over: {error}")
+        with self._lock:
+            self.failovers += 1
+
+    def _count_hedge(self, won):
+        with self._lock:
+            self.hedges["won" if won else "lost"] += 1
+
+    def _fail(self, backend, recorder, error):
+        recorder.failure(error)
+        if is_retryable(error):
+            backend.record_failure(error)
+        if error_status(error) == 429:
+            wait_for = retry_after(error)
+            if wait_for is not None:
+                # Hold back the calls queued behind this one too
+                backend.limiter.pause(wait_for)
+
+    def _reserve(self, backend, messages, max_tokens):
+        """(estimated tokens, seconds to wait) for a call to backend; raises
+        CircuitOpen when a half-open backend is busy with its trial call"""
+        if not backend.admit():
+            raise CircuitOpen(f"{backend.name} is waiting on its trial call")
+        tokens = 0
+        try:
+            if backend.limiter.counts_tokens:
+                tokens = estimate_call_tokens(messages, max_tokens)
+            delay = backend.limiter.acquire(tokens)
+        except QueueFull:
+            backend.release()
+            raise
+        llm_queue_delay.observe(delay, backend=backend.name)
+        return tokens, delay
+
+    def _abandon(self, backend, recorder, tokens, unused):
+        """A call closed or cancelled by its consumer: neither a success nor
+        a failure of the backend; returns the tokens it didn't get to use"""
+        recorder.cancelled()
+        backend.release()
+        if tokens:
+            backend.limiter.settle(tokens, tokens - unused)
+
+    def _succeed(self, backend, recorder, tokens):
+        backend.record_success(time.perf_counter() - recorder.started_at)
+        recorder.success()
+        if tokens and recorder.usage:
+            backend.limiter.settle(
+                tokens,
+                recorder.usage["prompt_tokens"] + recorder.usage["completion_tokens"],
+            )
+
+    def _retry_delay(self, retry, error):
+        """Seconds to back off before retrying a call that failed on every
+        candidate, or None when it shouldn't be retried"""
+        if (
+            not is_retryable(error)
+            or isinstance(error, QueueFull)
+            or retry >= self.retry_conf["MAX_RETRIES"]
+        ):
+            return None
+        wait_at_least = retry_after(error)
+        if (
+            wait_at_least is not None
+            and wait_at_least > self.retry_conf["MAX_QUEUE_DELAY"]
+        ):
+            # Like a full queue: e.g. a daily quota, not worth holding the
+            # request open for
+            return None
+        delay = backoff_delay(
+            retry,
+            self.retry_conf["BACKOFF_BASE"],
+            self.retry_conf["BACKOFF_MAX"],
+            wait_at_least,
+        )
+        llm_retries.inc(error_type=type(error).__name__)
+        logger.warning(f"Retrying LLM call in {delay:.2f}s after: {error}")
+        return delay
+
+    def _attempt(
+        self,
+        backend,
+        messages,
+        temperature,
+        max_tokens,
+        top_p,
+        role_name,
+        cancel=None,
+    ):
+        """One call to backend; with a cancel event the completion is
+        streamed so that it can stop once the event is set"""
+        tokens, delay = self._reserve(backend, messages, max_tokens)
+        if delay:
+            time.sleep(delay)
+        recorder = LLMCallRecorder(backend.kind, backend.model, role_name)
+        generated = 0
+        try:
+            if cancel is None:
+                content = backend.complete(
+                    messages, temperature, max_tokens, top_p, recorder
+                )
+            else:
+                parts = []
+                stream = backend.stream(
+                    messages, temperature, max_tokens, recorder, top_p
+                )
+                with contextlib.closing(stream):
+                    for chunk in stream:
+                        if cancel.is_set():
+                            raise HedgeLost(backend.name)
+                        recorder.first_token()
+                        generated += approximate_tokens(chunk)
+                        parts.append(chunk)
+                content = "".join(parts)
+        except HedgeLost:
+            self._abandon(backend, recorder, tokens, max(max_tokens - generated, 0))
+            raise
+        except Exception as e:
+            self._fail(backend, recorder, e)
+            raise
+        self._succeed(backend, recorder, tokens)
+        return content
+
+    def _hedged(self, primary, secondary, delay, *args):
+        if self._hedge_executor is None:
+            with self._lock:
+                if self._hedge_executor is None:
+                    self._hedge_executor = ThreadPoolExecutor(
+                        max_workers=self.conf["HEDGE_WORKERS"],
+                        thread_name_prefix="llm-hedge",
+                    )
+        # Set once a winner is in, so that the loser stops at its next chunk
+        # and gives back its worker and rate limit reservation
+        cancel = threading.Event()
+        first = self._hedge_executor.submit(self._attempt, primary, *args, cancel)
+        done, _ = wait([first], timeout=delay)
+        if done:
+            error = first.exception()
+            if error is None:
+                return first.result()
+            if not is_retryable(error):
+                raise error
+            self._count_failover(primary, error)
+            return self._attempt(secondary, *args)
+        second = self._hedge_executor.submit(self._attempt, secondary, *args, cancel)
+        pending = {first, second}
+        error = None
+        try:
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    if future.exception() is None:
+                        self._count_hedge(future is second)
+                        return future.result()
+                    error = future.exception()
+            raise error
+        finally:
+            cancel.set()
+
+    def complete(
+        self, pool, model, messages, temperature, max_tokens, top_p, role_name
+    ):
+        for retry in itertools.count():
+            try:
+                return self._complete_once(
+                    pool, model, messages, temperature, max_tokens, top_p, role_name
+                )
+            except Exception as e:
+                delay = self._retry_delay(retry, e)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+
+    def _complete_once(
+        self, pool, model, messages, temperature, max_tokens, top_p, role_name
+    ):
+        args = (messages, temperature, max_tokens, top_p, role_name)
+        candidates = self.candidates(pool, model)
+        i = 0
+        while True:
+            backend = candidates[i]
+            delay = self.hedge_delay(backend) if i + 1 < len(candidates) else None
+            tried = 1
+            try:
+                if delay is not None:
+                    tried = 2
+                    return self._hedged(backend, candidates[i + 1], delay, *args)
+                return self._attempt(backend, *args)
+            except Exception as e:
+                i += tried
+                if not is_retryable(e) or i >= len(candidates):
+                    raise
+                self._count_failover(backend, e)
+
+    def stream(self, pool, model, messages, temperature, max_tokens, role_name):
+        for retry in itertools.count():
+            started = False
+            try:
+                for chunk in self._stream_once(
+                    pool, model, messages, temperature, max_tokens, role_name
+                ):
+                    started = True
+                    yield chunk
+                return
+            except Exception as e:
+                delay = None if started else self._retry_delay(retry, e)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+
+    def _stream_once(self, pool, model, messages, temperature, max_tokens, role_name):
+        candidates = self.candidates(pool, model)
+        for i, backend in enumerate(candidates):
+            started = False
+            try:
+                tokens, delay = self._reserve(backend, messages, max_tokens)
+                if delay:
+                    time.sleep(delay)
+                recorder = LLMCallRecorder(backend.kind, backend.model, role_name)
+                generated = 0
+                try:
+                    for chunk in backend.stream(
+                        messages, temperature, max_tokens, recorder
+                    ):
+                        recorder.first_token()
+                        started = True
+                        generated += approximate_tokens(chunk)
+                        yield chunk
+                except Exception as e:
+                    self._fail(backend, recorder, e)
+                    raise
+                except BaseException:
+                    # Closed or cancelled by the consumer mid-stream
+                    self._abandon(
+                        backend, recorder, tokens, max(max_tokens - generated, 0)
+                    )
+                    raise
+            except Exception as e:
+                if started or not is_retryable(e) or i + 1 == len(candidates):
+                    raise
+                self._count_failover(backend, e)
+                continue
+            self._succeed(backend, recorder, tokens)
+            return
+
+    async def _aattempt(
+        self, backend, messages, temperature, max_tokens, top_p, role_name
+    ):
+        tokens, delay = self._reserve(backend, messages, max_tokens)
+        if delay:
+            await asyncio.sleep(delay)
+        recorder = LLMCallRecorder(backend.kind, backend.model, role_name)
+        try:
+            content = await backend.acomplete(
+                messages, temperature, max_tokens, top_p, recorder
+            )
+        except Exception as e:
+            self._fail(backend, recorder, e)
+            raise
+        except asyncio.CancelledError:
+            self._abandon(backend, recorder, tokens, max_tokens)
+            raise
+        self._succeed(backend, recorder, tokens)
+        return content
+
+    async def _ahedged(self, primary, secondary, delay, *args):
+        first = asyncio.ensure_future(self._aattempt(primary, *args))
+        tasks = [first]
+        try:
+            done, _ = await asyncio.wait([first], timeout=delay)
+            if done:
+                error = first.exception()
+                if error is None:
+                    return first.result()
+                if not is_retryable(error):
+                    raise error
+                self._count_failover(primary, error)
+                return await self._aattempt(secondary, *args)
+            second = asyncio.ensure_future(self._aattempt(secondary, *args))
+            tasks.append(second)
+            pending = set(tasks)
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    if task.exception() is None:
+                        self._count_hedge(task is second)
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            # Also when the caller is cancelled, so no call keeps its
+            # reservation running in the background
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+    async def acomplete(
+        self, pool, model, messages, temperature, max_tokens, top_p, role_name
+    ):
+        for retry in itertools.count():
+            try:
+                return await self._acomplete_once(
+                    pool, model, messages, temperature, max_tokens, top_p, role_name
+                )
+            except Exception as e:
+                delay = self._retry_delay(retry, e)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+
+    async def _acomplete_once(
+        self, pool, model, messages, temperature, max_tokens, top_p, role_name
+    ):
+        args = (messages, temperature, max_tokens, top_p, role_name)
+        candidates = self.candidates(pool, model)
+        i = 0
+        while True:
+            backend = candidates[i]
+            delay = self.hedge_delay(backend) if i + 1 < len(candidates) else None
+            tried = 1
+            try:
+                if delay is not None:
+                    tried = 2
+                    return await self._ahedged(backend, candidates[i + 1], delay, *args)
+                return await self._aattempt(backend, *args)
+            except Exception as e:
+                i += tried
+                if not is_retryable(e) or i >= len(candidates):
+                    raise
+                self._count_failover(backend, e)
+
+    async def astream(self, pool, model, messages, temperature, max_tokens, role_name):
+        for retry in itertools.count():
+            started = False
+            try:
+                async for chunk in self._astream_once(
+                    pool, model, messages, temperature, max_tokens, role_name
+                ):
+                    started = True
+                    yield chunk
+                return
+            except Exception as e:
+                delay = None if started else self._retry_delay(retry, e)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+
+    async def _astream_once(
+        self, pool, model, messages, temperature, max_tokens, role_name
+    ):
+        candidates = self.candidates(pool, model)
+        for i, backend in enumerate(candidates):
+            started = False
+            try:
+                tokens, delay = self._reserve(backend, messages, max_tokens)
+                if delay:
+                    await asyncio.sleep(delay)
+                recorder = LLMCallRecorder(backend.kind, backend.model, role_name)
+                generated = 0
+                try:
+                    async for chunk in backend.astream(
+                        messages, temperature, max_tokens, recorder
+                    ):
+                        recorder.first_token()
+                        started = True
+                        generated += approximate_tokens(chunk)
+                        yield chunk
+                except Exception as e:
+                    self._fail(backend, recorder, e)
+                    raise
+                except BaseException:
+                    # Closed or cancelled by the consumer mid-stream
+                    self._abandon(
+                        backend, recorder, tokens, max(max_tokens - generated, 0)
+                    )
+                    raise
+            except Exception as e:
+                if started or not is_retryable(e) or i + 1 == len(candidates):
+                    raise
+                self._count_failover(backend, e)
+                continue
+            self._succeed(backend, recorder, tokens)
+            return
+
+    def stats(self):
+        with self._lock:
+            backends = self.backends + list(self._adhoc.values())
+            return {
+                "failovers": self.failovers,
+                "hedges": dict(self.hedges),
+                "backends": [
+                    {
+                        "name": b.name,
+                        "kind": b.kind,
+                        "model": b.model,
+                        "circuit": b.circuit(),
+                        "latency": b.latency,
+                        "error_rate": b.error_rate,
+                    }
+                    for b in backends
+                ],
+            }
+
+
+_model_router = None
+_model_router_lock = threading.Lock()
+
+
+def get_model_router():
+    global _model_router
+    if _model_router is None:
+        with _model_router_lock:
+            if _model_router is None:
+                _model_router = ModelRouter(
+                    [Backend.from_settings(conf) for conf in get_backend_settings()],
+                    get_router_settings(),
+                )
+    return _model_router
+
+
+@registry.register_collector
+def collect_model_router():
+    if _model_router is None:
+        return []
+    stats = _model_router.stats()
+
+    def samples(field):
+        return [
+            ({"backend": b["name"], "model": b["model"]}, field(b))
+            for b in stats["backends"]
+        ]
+
+    return [
+        (
+            "llm_backend_circuit_state",
+            "gauge",
+            "Circuit breaker per backend (0 closed, 1 open, 2 half open)",
+            samples(lambda b: CIRCUIT_STATES[b["circuit"]]),
+        ),
+        (
+            "llm_backend_latency_seconds",
+            "gauge",
+            "Smoothed latency of recent successful calls per backend",
+            samples(lambda b: b["latency"] or 0.0),
+        ),
+        (
+            "llm_backend_error_rate",
+            "gauge",
+            "Share of failed calls in the recent window per backend",
+            samples(lambda b: b["error_rate"]),
+        ),
+        (
+            "llm_failovers_total",
+            "counter",
+            "LLM calls retried on another backend after a failure",
+            [({}, stats["failovers"])],
+        ),
+        (
+            "llm_hedges_total",
+            "counter",
+            "Hedged completions by whether the hedge finished first",
+            [
+                ({"outcome": outcome}, count)
+                for outcome, count in stats["hedges"].items()
+            ],
+        ),
+    ]
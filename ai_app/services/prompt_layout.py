@@ -0,0 +1,30 @@
+def join_sections(*sections):
+    """The non-empty sections, stripped and separated by blank lines"""
+    return "\n\n".join(s.strip() for s in sections if s and s.strip())
+
+
+class PromptLayout:
+    """Chat messages laid out for provider prompt caching and Ollama's KV
+    cache reuse, which only skip the longest prefix a prompt shares with an
+    earlier one.
+
+    The system message is the static prefix: only what is fixed for a role
+    (or task), so it is byte-identical from one request to the next. The
+    per-request sections follow in the user message in the order they were
+    added; put the growing dialogue last so that a later prompt extends an
+    earlier one instead of changing it.
+    """
+
+    def __init__(self, *static):
+        self.prefix = join_sections(*static)
+        self.sections = []
+
+    def add(self, *sections):
+        self.sections.extend(sections)
+        return self
+
+    def messages(self):
+        return [
+            {"role": "system", "content": self.prefix},
+            {"role": "user", "content": join_sections(*self.sections)},
+        ]
@@ -0,0 +1,163 @@
+from email.utils import parsedate_to_datetime
+import random
+import re
+import threading
+import time
+
+from django.conf import settings
+
+from ai_app.services.token_budget import count_tokens
+
+DEFAULT_RATE_LIMIT_SETTINGS = {
+    "MAX_RETRIES": 3,
+    "BACKOFF_BASE": 0.5,
+    "BACKOFF_MAX": 20.0,
+    "MAX_QUEUE_DELAY": 30.0,
+}
+
+DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+DURATION_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+
+def get_rate_limit_settings():
+    return {**DEFAULT_RATE_LIMIT_SETTINGS, **getattr(settings, "LLM_RATE_LIMITS", {})}
+
+
+class QueueFull(Exception):
+    """The backend's rate limit wouldn't admit the call within
+    MAX_QUEUE_DELAY seconds"""
+
+    def __init__(self, backend, delay):
+        super().__init__(f"{backend} is rate limited for the next {delay:.1f}s")
+        self.delay = delay
+
+
+def parse_duration(value):
+    """Seconds in a rate-limit reset header: "1.5", "20ms", "6m0s" """
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        pass
+    parts = DURATION_PART.findall(value or "")
+    if not parts:
+        return None
+    return sum(float(number) * DURATION_UNITS[unit] for number, unit in parts)
+
+
+def retry_after(error):
+    """Seconds the backend asked us to wait in the headers of an error:
+    Retry-After (seconds or an HTTP date), retry-after-ms, or the longest
+    x-ratelimit-reset-* of a limit that is used up"""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    if headers.get("retry-after-ms"):
+        delay = parse_duration(headers["retry-after-ms"])
+        if delay is not None:
+            return delay / 1000
+    value = headers.get("retry-after")
+    if value:
+        delay = parse_duration(value)
+        if delay is not None:
+            return delay
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            pass
+    resets = [
+        parse_duration(headers.get(f"x-ratelimit-reset-{kind}"))
+        for kind in ("requests", "tokens")
+        if headers.get(f"x-ratelimit-remaining-{kind}") == "0"
+    ]
+    resets = [delay for delay in resets if delay is not None]
+    return max(resets) if resets else None
+
+
+def backoff_delay(attempt, base, cap, wait_at_least=None):
+    """Full-jitter exponential backoff for retry number attempt (0-based),
+    never shorter than the wait the backend asked for"""
+    delay = random.uniform(0, min(cap, base * 2**attempt))
+    if wait_at_least is not None:
+        delay = max(delay, wait_at_least + random.uniform(0, base))
+    return delay
+
+
+def estimate_call_tokens(messages, max_tokens):
+    return sum(count_tokens(m["content"]) for m in messages) + (max_tokens or 0)
+
+
+class Rate:
+    """Generic cell rate algorithm for one per-minute limit.
+
+    The limit is a bucket of `limit` units refilled at limit / 60 per
+    second; the state is just the theoretical arrival time (TAT) of the next
+    unit. A reservation moves the TAT forward and waits until the TAT is
+    within one bucket of now, so callers are admitted in arrival order.
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.interval = 60.0 / limit
+        self.tat = 0.0
+
+    def reserve(self, now, units):
+        """Seconds to wait before units may be spent, and the new TAT"""
+        units = min(units, self.limit)
+        tat = max(self.tat, now) + units * self.interval
+        return max(0.0, tat - 60.0 - now), tat
+
+    def refund(self, units):
+        self.tat -= units * self.interval
+
+
+class RateLimiter:
+    """Client-side requests-per-minute and tokens-per-minute limits of one
+    backend, plus a pause while the backend itself says we're limited.
+
+    acquire() reserves a request and the call's estimated tokens (prompt
+    plus max_tokens) and returns how long to wait before sending it;
+    settle() gives back tokens the call didn't use. Reservations are taken
+    in arrival order, which makes the wait a fair FIFO queue.
+    """
+
+    def __init__(self, name, rpm=None, tpm=None, max_queue_delay=30.0):
+        self.name = name
+        self.requests = Rate(rpm) if rpm else None
+        self.tokens = Rate(tpm) if tpm else None
+        self.max_queue_delay = max_queue_delay
+        self.paused_until = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def counts_tokens(self):
+        return self.tokens is not None
+
+    def acquire(self, tokens=0):
+        """Seconds to wait before sending the call; raises QueueFull rather
+        than queueing past max_queue_delay"""
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self.paused_until)
+            delay = start - now
+            reservations = []
+            for rate, units in ((self.requests, 1), (self.tokens, tokens)):
+                if rate is not None and units:
+                    wait, tat = rate.reserve(start, units)
+                    delay = max(delay, start - now + wait)
+                    reservations.append((rate, tat))
+            if delay > self.max_queue_delay:
+                raise QueueFull(self.name, delay)
+            for rate, tat in reservations:
+                rate.tat = tat
+            return delay
+
+    def settle(self, estimated, used):
+        """Return the tokens a call reserved but didn't use"""
+        if self.tokens is None or used is None or used >= estimated:
+            return
+        with self._lock:
+            self.tokens.refund(estimated - used)
+
+    def pause(self, seconds):
+        """Admit nothing for the next seconds, after a 429"""
+        with self._lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
@@ -1,4 +1,3 @@
-from django.forms.models import model_to_dict
 import logging
 
 logger = logging.getLogger("ai_app")
@@ -10,14 +9,19 @@ class ResponseFormatter:
         return [{"name": role.name, "description": role.description} for role in roles]
 
     @staticmethod
-    def format_history(history_items):
-        history_data = [
-            model_to_dict(item, fields=["id", "prompt", "response"])
-            for item in history_items
+    def format_history(history_rows):
+        """Rows from HistoryQuery (values() dicts) as API items"""
+        return [
+            {
+                "id": row["id"],
+                "prompt": row["prompt"],
+                "response": row["response"],
+                "role": row["role__name"],
+                "user": row["user__username"],
+                "created_at": row["created_at"].isoformat(),
+                "dialogue_id": row["dialogue_id"] and str(row["dialogue_id"]),
+                "turn": row["turn"],
+                **({"score": row["score"]} if "score" in row else {}),
+            }
+            for row in history_rows
         ]
-
-        for i, item in enumerate(history_items):
-            history_data[i]["role"] = item.role.name if item.role else None
-            history_data[i]["created_at"] = item.created_at.isoformat()
-
-        return history_data
@@ -0,0 +1,289 @@
+from collections import Counter, OrderedDict, namedtuple
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+import logging
+import threading
+import time
+
+from django.conf import settings
+import numpy as np
+
+from ai_app.services.ann_index import PASSAGES_INDEX, get_ann_index
+from ai_app.services.bm25_index import BM25Index, tokenize
+from ai_app.services.corpus_store import CorpusStore, get_corpus
+from ai_app.services.embeddings import embed_texts, embeddings_available
+from ai_app.services.metrics import retrieval_latency
+
+logger = logging.getLogger("ai_app")
+
+DEFAULT_RETRIEVAL_SETTINGS = {
+    "ENABLED": True,
+    "TOP_K": 3,
+    "ROLE_WEIGHT": 0.3,
+    "CANDIDATES": 50,
+    "RRF_K": 60,
+    "LATENCY_BUDGET_MS": 5,
+}
+
+RESULT_CACHE_SIZE = 256
+
+Passage = namedtuple("Passage", ["source", "text", "score"])
+
+
+def get_retrieval_settings():
+    return {
+        **DEFAULT_RETRIEVAL_SETTINGS,
+        **getattr(settings, "PASSAGE_RETRIEVAL", {}),
+    }
+
+
+def parse_source_texts(value):
+    """LLMRole.source_texts is a comma-separated list of text names"""
+    return [name.strip() for name in (value or "").split(",") if name.strip()]
+
+
+def top_ranked(scores, limit):
+    """Indices of the `limit` best positive scores, best first"""
+    limit = min(limit, len(scores))
+    if limit <= 0:
+        return np.empty(0, dtype=np.int64)
+    top = np.argpartition(-scores, limit - 1)[:limit]
+    top = top[scores[top] > 0]
+    return top[np.argsort(-scores[top])]
+
+
+def reciprocal_rank_fusion(rankings, k):
+    """Fuse best-first index arrays into (indices, scores), best first"""
+    rankings = [ranking for ranking in rankings if len(ranking)]
+    if not rankings:
+        return np.empty(0, dtype=np.int64), np.empty(0)
+    ids = np.concatenate(rankings)
+    weights = np.concatenate(
+        [1.0 / (k + 1 + np.arange(len(ranking))) for ranking in rankings]
+    )
+    unique, inverse = np.unique(ids, return_inverse=True)
+    fused = np.bincount(inverse, weights=weights)
+    order = np.argsort(-fused, kind="stable")
+    return unique[order], fused[order]
+
+
+class PassageRetriever:
+    """Hybrid BM25 + embedding search over the corpus chunks (see
+    corpus_store and bm25_index).
+
+    Rare names and terms are matched lexically by BM25, paraphrases by the
+    chunk embeddings when the store has them; the two rankings are merged
+    with reciprocal rank fusion. Searches over every text rank embeddings
+    with the IVF index (see ann_index) when it is built. A built store is only
+    memory-mapped; without one the BM25 index is built in a background
+    thread, and searches return nothing instead of blocking until it is
+    ready. Likewise a query embedding that isn't ready within the latency
+    budget is left to finish in the background, and the search ranks with
+    BM25 alone.
+    """
+
+    def __init__(self, top_k, role_weight, candidates, rrf_k, budget_ms):
+        self.top_k = top_k
+        self.role_weight = role_weight
+        self.candidates = candidates
+        self.rrf_k = rrf_k
+        self.budget_ms = budget_ms
+        self._ready = threading.Event()
+        self._started = False
+        self._lock = threading.Lock()
+        self._results = OrderedDict()
+        self._query_vectors = OrderedDict()
+        self._pending_vectors = {}
+        self._embedder = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="query-embedding"
+        )
+
+    @property
+    def ready(self):
+        return self._ready.is_set()
+
+    def start(self):
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        threading.Thread(target=self._build, name="passage-index", daemon=True).start()
+
+    def _build(self):
+        started_at = time.perf_counter()
+        try:
+            corpus = get_corpus()
+            index = None
+            if isinstance(corpus, CorpusStore):
+                index = BM25Index.open(corpus.path)
+            if index is None or index.doc_count != len(corpus):
+                index = BM25Index.build(corpus.texts())
+            self.corpus = corpus
+            self.index = index
+            self.source_ranges = self._source_ranges(corpus)
+            self.vectors = (
+                corpus.quantized
+                if corpus.quantized is not None and embeddings_available()
+                else None
+            )
+            self.ann_index = None
+            if self.vectors is not None:
+                ann_index = get_ann_index(PASSAGES_INDEX)
+                if ann_index is not None and len(ann_index) == len(corpus):
+                    self.ann_index = ann_index
+            self._ready.set()
+            logger.info(
+                f"Loaded passage index over {len(corpus)} passages from "
+                f"{len(corpus.sources)} texts in {time.perf_counter() - started_at:.1f}s"
+                f"{'' if self.vectors is not None else ' (lexical only)'}"
+            )
+        except Exception as e:
+            logger.error(f"Could not build passage index: {e}")
+
+    def _source_ranges(self, corpus):
+        """{lowercased source name: (first chunk, end)}; chunks of a source
+        are contiguous"""
+        source_ids = np.asarray(corpus.source_ids)
+        indices = np.arange(len(corpus.sources))
+        starts = np.searchsorted(source_ids, indices, side="left")
+        ends = np.searchsorted(source_ids, indices, side="right")
+        return {
+            name.lower(): (int(start), int(end))
+            for name, start, end in zip(corpus.sources, starts, ends)
+        }
+
+    def _ranges(self, source_texts):
+        if not source_texts:
+            return [(0, len(self.corpus))]
+        return [
+            self.source_ranges[name.lower()]
+            for name in source_texts
+            if name.lower() in self.source_ranges
+        ]
+
+    def _lexical_ranking(self, query, role_query, ranges):
+        weights = Counter(tokenize(query))
+        if self.role_weight:
+            for term in tokenize(role_query):
+                weights[term] += self.role_weight
+        scores = self.index.scores(weights)
+        if scores is None:
+            return np.empty(0, dtype=np.int64)
+        if ranges != [(0, len(self.corpus))]:
+            allowed = np.zeros(len(scores), dtype=bool)
+            for start, end in ranges:
+                allowed[start:end] = True
+            scores = np.where(allowed, scores, 0)
+        return top_ranked(scores, self.candidates)
+
+    def _query_vector(self, query):
+        """Future embedding of the query, memoised since every role in a
+        dialogue searches with the same prompt"""
+        with self._lock:
+            vector = self._query_vectors.get(query)
+            if vector is not None:
+                future = Future()
+                future.set_result(vector)
+                return future
+            future = self._pending_vectors.get(query)
+            if future is None:
+                future = self._embedder.submit(self._embed_query, query)
+                self._pending_vectors[query] = future
+            return future
+
+    def _embed_query(self, query):
+        try:
+            vector = embed_texts([query])[0]
+        except Exception:
+            with self._lock:
+                self._pending_vectors.pop(query, None)
+            raise
+        with self._lock:
+            self._pending_vectors.pop(query, None)
+            self._query_vectors[query] = vector
+            while len(self._query_vectors) > RESULT_CACHE_SIZE:
+                self._query_vectors.popitem(last=False)
+        return vector
+
+    def _semantic_ranking(self, vector, ranges):
+        if self.ann_index is not None and ranges == [(0, len(self.corpus))]:
+            return self.ann_index.search(vector, self.candidates)[0]
+        ids, scores = [], []
+        for start, end in ranges:
+            rows, range_scores = self.vectors.search(
+                vector, self.candidates, start, end
+            )
+            ids.append(rows[range_scores > 0])
+            scores.append(range_scores[range_scores > 0])
+        ids, scores = np.concatenate(ids), np.concatenate(scores)
+        return ids[np.argsort(-scores)][: self.candidates]
+
+    def search(self, query, role_query="", source_texts=()):
+        """Top passages for the query, boosted by role_query, from source_texts
+        (every text when empty)"""
+        if not self.ready:
+            self.start()
+            return []
+
+        cache_key = (query, role_query, tuple(source_texts))
+        with self._lock:
+            if cache_key in self._results:
+                self._results.move_to_end(cache_key)
+                return self._results[cache_key]
+
+        started_at = time.perf_counter()
+        ranges = self._ranges(source_texts)
+        if not ranges:
+            return []
+        # The query embeds while BM25 ranks
+        pending = self._query_vector(query) if self.vectors is not None else None
+        rankings = [self._lexical_ranking(query, role_query, ranges)]
+        if pending is not None:
+            remaining = self.budget_ms / 1000 - (time.perf_counter() - started_at)
+            try:
+                vector = pending.result(timeout=max(remaining, 0))
+                rankings.append(self._semantic_ranking(vector, ranges))
+            except FutureTimeout:
+                logger.debug("Query embedding missed the latency budget")
+        ids, scores = reciprocal_rank_fusion(rankings, self.rrf_k)
+        results = [
+            Passage(self.corpus.source(i), self.corpus.text(i), float(score))
+            for i, score in zip(ids[: self.top_k], scores)
+        ]
+
+        elapsed = time.perf_counter() - started_at
+        retrieval_latency.observe(elapsed)
+        if elapsed * 1000 > self.budget_ms:
+            logger.warning(f"Passage retrieval took {elapsed * 1000:.1f}ms")
+
+        # Lexical-only results are not cached, so the next search of the
+        # query ranks with its embedding once it is ready
+        if len(rankings) == 2 or pending is None:
+            with self._lock:
+                self._results[cache_key] = results
+                while len(self._results) > RESULT_CACHE_SIZE:
+                    self._results.popitem(last=False)
+        return results
+
+
+_passage_retriever = None
+_passage_retriever_lock = threading.Lock()
+
+
+def get_passage_retriever():
+    """Shared retriever, or None when retrieval is disabled"""
+    global _passage_retriever
+    conf = get_retrieval_settings()
+    if not conf["ENABLED"]:
+        return None
+    if _passage_retriever is None:
+        with _passage_retriever_lock:
+            if _passage_retriever is None:
+                _passage_retriever = PassageRetriever(
+                    conf["TOP_K"],
+                    conf["ROLE_WEIGHT"],
+                    conf["CANDIDATES"],
+                    conf["RRF_K"],
+                    conf["LATENCY_BUDGET_MS"],
+                )
+    return _passage_retriever
@@ -0,0 +1,195 @@
+from collections import namedtuple
+import logging
+import threading
+import time
+from types import MappingProxyType
+import uuid
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+
+from ai_app.models.llm_role import LLMRole
+
+logger = logging.getLogger("ai_app")
+
+DEFAULT_ROLE_REGISTRY_SETTINGS = {
+    "CACHE_ALIAS": "role_registry",
+    "VERSION_CHECK_INTERVAL": 1.0,
+}
+
+VERSION_KEY = "ai_app:role_registry_version"
+
+ROLE_FIELDS = (
+    "id",
+    "name",
+    "description",
+    "prompt_template",
+    "model_name",
+    "max_tokens",
+    "temperature",
+    "collaboration_triggers",
+    "source_texts",
+)
+
+Role = namedtuple("Role", ROLE_FIELDS + ("collaborator_ids",))
+
+
+def get_role_registry_settings():
+    return {
+        **DEFAULT_ROLE_REGISTRY_SETTINGS,
+        **getattr(settings, "ROLE_REGISTRY", {}),
+    }
+
+
+def new_version():
+    return uuid.uuid4().hex
+
+
+class RoleRegistry:
+    """Immutable snapshot of every LLMRole and its collaborators.
+
+    Roles are read-only Role tuples with the model's fields, so they stand
+    in for LLMRole instances in prompt building and routing; a new snapshot
+    replaces this one whenever a role or collaboration changes.
+    """
+
+    def __init__(self, roles, version):
+        self.roles = tuple(roles)
+        self.version = version
+        by_id = {role.id: role for role in self.roles}
+        self._by_name = MappingProxyType(
+            {role.name: role for role in reversed(self.roles)}
+        )
+        self._collaborators = MappingProxyType(
+            {
+                role.id: tuple(by_id[i] for i in role.collaborator_ids if i in by_id)
+                for role in self.roles
+            }
+        )
+
+    @classmethod
+    def load(cls, version):
+        collaborator_ids = {}
+        links = LLMRole.collaborators.through.objects.order_by("pk").values_list(
+            "from_llmrole_id", "to_llmrole_id"
+        )
+        for from_id, to_id in links:
+            collaborator_ids.setdefault(from_id, []).append(to_id)
+        roles = [
+            Role(*values, tuple(collaborator_ids.get(values[0], ())))
+            for values in LLMRole.objects.order_by("pk").values_list(*ROLE_FIELDS)
+        ]
+        return cls(roles, version)
+
+    def get(self, name):
+        """The role called name; raises LLMRole.DoesNotExist like a query"""
+        try:
+            return self._by_name[name]
+        except KeyError:
+            raise LLMRole.DoesNotExist(f"LLMRole matching name={name!r} does not exist")
+
+    def collaborators(self, role):
+        return self._collaborators.get(role.id, ())
+
+
+class RoleRegistryCache:
+    """The current RoleRegistry of this process.
+
+    Signals drop the snapshot when roles change in this process and store a
+    new random version in a shared cache; other processes compare it with
+    their snapshot's at most every VERSION_CHECK_INTERVAL seconds and reload
+    when it changed. A fresh random value can't collide with an old one the
+    way a counter restarting after eviction, or two processes' racing
+    increments, could. Between changes no request queries LLMRole.
+    """
+
+    def __init__(self, cache_alias, version_check_interval):
+        self.cache_alias = cache_alias
+        self.version_check_interval = version_check_interval
+        self._registry = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def cache(self):
+        return caches[self.cache_alias]
+
+    def _shared_version(self):
+        try:
+            version = self.cache.get(VERSION_KEY)
+            if version is None:
+                self.cache.add(VERSION_KEY, new_version(), timeout=None)
+                version = self.cache.get(VERSION_KEY)
+            return version
+        except Exception as e:
+            logger.warning(f"Could not read the role registry version: {e}")
+            return None
+
+    def current(self):
+        """The snapshot if it is known to be fresh, else None"""
+        registry = self._registry
+        if registry is None:
+            return None
+        if time.monotonic() - self._checked_at < self.version_check_interval:
+            return registry
+        return None
+
+    def get(self):
+        registry = self.current()
+        if registry is not None:
+            return registry
+        with self._lock:
+            version = self._shared_version()
+            self._checked_at = time.monotonic()
+            registry = self._registry
+            if registry is None or (
+                version is not None and version != registry.version
+            ):
+                registry = RoleRegistry.load(version)
+                self._registry = registry
+                logger.info(f"Loaded {len(registry.roles)} roles (version {version})")
+            return registry
+
+    async def aget(self):
+        registry = self.current()
+        if registry is not None:
+            return registry
+        return await sync_to_async(self.get)()
+
+    def invalidate(self):
+        """Drop this process's snapshot and tell the other processes"""
+        with self._lock:
+            self._registry = None
+        try:
+            self.cache.set(VERSION_KEY, new_version(), timeout=None)
+        except Exception as e:
+            logger.warning(f"Could not bump the role registry version: {e}")
+
+
+_role_registry_cache = None
+_role_registry_cache_lock = threading.Lock()
+
+
+def get_role_registry_cache():
+    global _role_registry_cache
+    if _role_registry_cache is None:
+        with _role_registry_cache_lock:
+            if _role_registry_cache is None:
+                conf = get_role_registry_settings()
+                _role_registry_cache = RoleRegistryCache(
+                    conf["CACHE_ALIAS"], conf["VERSION_CHECK_INTERVAL"]
+                )
+    return _role_registry_cache
+
+
+def get_role_registry():
+    return get_role_registry_cache().get()
+
+
+async def aget_role_registry():
+    return await get_role_registry_cache().aget()
+
+
+def invalidate_role_registry():
+    get_role_registry_cache().invalidate()
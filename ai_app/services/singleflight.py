@@ -0,0 +1,306 @@
+import asyncio
+import threading
+
+from django.conf import settings
+
+DEFAULT_SINGLEFLIGHT_SETTINGS = {
+    "ENABLED": True,
+}
+
+COMPLETION = "completion"
+STREAM = "stream"
+
+
+def get_singleflight_settings():
+    return {
+        **DEFAULT_SINGLEFLIGHT_SETTINGS,
+        **getattr(settings, "LLM_SINGLEFLIGHT", {}),
+    }
+
+
+class Flight:
+    """One in-flight completion and what it returned or raised"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class AsyncFlight:
+    def __init__(self, task):
+        self.task = task
+        self.waiters = 0
+
+
+class StreamFlight:
+    """Chunks of one in-flight stream, kept so that every follower can
+    replay the stream from its first chunk"""
+
+    def __init__(self, source):
+        self.source = source
+        self.chunks = []
+        self.finished = False
+        self.abandoned = False
+        self.pulling = False
+        self.error = None
+        self.followers = 0
+        self.changed = threading.Condition()
+
+
+class AsyncStreamFlight:
+    def __init__(self):
+        self.chunks = []
+        self.finished = False
+        self.abandoned = False
+        self.error = None
+        self.followers = 0
+        self.task = None
+        self.changed = asyncio.Event()
+
+    def notify(self):
+        changed, self.changed = self.changed, asyncio.Event()
+        changed.set()
+
+
+class SingleFlight:
+    """Coalesces identical concurrent LLM calls into one backend call.
+
+    The first caller for a key starts the call; callers arriving while it is
+    in flight wait for it and get the same completion, or the same
+    exception. A stream's chunks are recorded as they arrive, so each
+    follower gets the whole stream however late it joined. Whichever
+    follower runs out of recorded chunks first pulls the next one on its
+    own thread (asyncio streams are driven by a task); the backend call is
+    closed once every follower is gone.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._async_calls = {}
+        self._streams = {}
+        self._async_streams = {}
+        self.calls = {COMPLETION: 0, STREAM: 0}
+        self.coalesced = {COMPLETION: 0, STREAM: 0}
+
+    def _count(self, kind, leader):
+        with self._lock:
+            (self.calls if leader else self.coalesced)[kind] += 1
+
+    def do(self, key, fn):
+        """fn() for the first caller with key; the same result for callers
+        that arrive before it returns"""
+        with self._lock:
+            flight = self._calls.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._calls[key] = Flight()
+            (self.calls if leader else self.coalesced)[COMPLETION] += 1
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            flight.result = fn()
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            flight.done.set()
+        return flight.result
+
+    async def ado(self, key, factory):
+        """Asyncio counterpart of do(); factory() returns the coroutine to
+        await. The call is cancelled when every waiter has been cancelled."""
+        flight_key = (asyncio.get_running_loop(), key)
+        flight = self._async_calls.get(flight_key)
+        leader = flight is None
+        if leader:
+            flight = AsyncFlight(asyncio.ensure_future(factory()))
+            self._async_calls[flight_key] = flight
+            flight.task.add_done_callback(
+                lambda _: self._forget(self._async_calls, flight_key, flight)
+            )
+        self._count(COMPLETION, leader)
+
+        flight.waiters += 1
+        try:
+            return await asyncio.shield(flight.task)
+        finally:
+            flight.waiters -= 1
+            if not flight.waiters and not flight.task.done():
+                flight.task.cancel()
+
+    def _forget(self, flights, key, flight):
+        if flights.get(key) is flight:
+            del flights[key]
+
+    def stream(self, key, factory):
+        """Chunks of factory()'s generator, shared with concurrent callers
+        that stream the same key"""
+        with self._lock:
+            flight = self._streams.get(key)
+            leader = flight is None
+            if not leader:
+                with flight.changed:
+                    if flight.abandoned:
+                        leader = True
+                    else:
+                        flight.followers += 1
+            if leader:
+                flight = self._streams[key] = StreamFlight(factory())
+                flight.followers = 1
+            (self.calls if leader else self.coalesced)[STREAM] += 1
+        return self._follow(key, flight)
+
+    def _pull(self, key, flight):
+        """Record the source's next chunk; one follower pulls at a time"""
+        chunk, finished, error = None, False, None
+        try:
+            chunk = next(flight.source)
+        except StopIteration:
+            finished = True
+        except Exception as e:
+            finished, error = True, e
+        finally:
+            if finished:
+                with self._lock:
+                    self._forget(self._streams, key, flight)
+            with flight.changed:
+                if finished:
+                    flight.finished, flight.error = True, error
+                elif error is None:
+                    flight.chunks.append(chunk)
+                flight.pulling = False
+                flight.changed.notify_all()
+
+    def _follow(self, key, flight):
+        position = 0
+        try:
+            while True:
+                with flight.changed:
+                    while (
+                        position == len(flight.chunks)
+                        and not flight.finished
+                        and flight.pulling
+                    ):
+                        flight.changed.wait()
+                    chunks = flight.chunks[position:]
+                    finished = flight.finished
+                    pull = not chunks and not finished
+                    if pull:
+                        flight.pulling = True
+                if pull:
+                    self._pull(key, flight)
+                    continue
+                position += len(chunks)
+                yield from chunks
+                if finished:
+                    if flight.error is not None:
+                        raise flight.error
+                    return
+        finally:
+            with flight.changed:
+                flight.followers -= 1
+                # No follower is pulling once they have all left
+                abandon = not flight.followers and not flight.finished
+                if abandon:
+                    flight.abandoned = flight.finished = True
+            if abandon:
+                with self._lock:
+                    self._forget(self._streams, key, flight)
+                flight.source.close()
+
+    async def astream(self, key, factory):
+        """Asyncio counterpart of stream(); factory() returns the async
+        generator to share"""
+        flight_key = (asyncio.get_running_loop(), key)
+        flight = self._async_streams.get(flight_key)
+        leader = flight is None or flight.abandoned
+        if leader:
+            flight = self._async_streams[flight_key] = AsyncStreamFlight()
+            flight.task = asyncio.ensure_future(
+                self._adrive(flight_key, flight, factory)
+            )
+        self._count(STREAM, leader)
+
+        flight.followers += 1
+        position = 0
+        try:
+            while True:
+                while position == len(flight.chunks) and not flight.finished:
+                    await flight.changed.wait()
+                chunks = flight.chunks[position:]
+                position += len(chunks)
+                for chunk in chunks:
+                    yield chunk
+                if flight.finished and position == len(flight.chunks):
+                    if flight.error is not None:
+                        raise flight.error
+                    return
+        finally:
+            flight.followers -= 1
+            if not flight.followers and not flight.finished:
+                flight.abandoned = True
+                flight.task.cancel()
+
+    async def _adrive(self, flight_key, flight, factory):
+        source = factory()
+        try:
+            async for chunk in source:
+                flight.chunks.append(chunk)
+                flight.notify()
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            flight.error = e
+        finally:
+            await source.aclose()
+            self._forget(self._async_streams, flight_key, flight)
+            flight.finished = True
+            flight.notify()
+
+    def stats(self):
+        with self._lock:
+            return {"calls": dict(self.calls), "coalesced": dict(self.coalesced)}
+
+
+class PassThrough:
+    """Stand-in for SingleFlight when coalescing is disabled"""
+
+    def do(self, key, fn):
+        return fn()
+
+    async def ado(self, key, factory):
+        return await factory()
+
+    def stream(self, key, factory):
+        return factory()
+
+    def astream(self, key, factory):
+        return factory()
+
+    def stats(self):
+        empty = {COMPLETION: 0, STREAM: 0}
+        return {"calls": dict(empty), "coalesced": dict(empty)}
+
+
+_singleflight = None
+_singleflight_lock = threading.Lock()
+
+
+def get_singleflight():
+    global _singleflight
+    if _singleflight is None:
+        with _singleflight_lock:
+            if _singleflight is None:
+                if get_singleflight_settings()["ENABLED"]:
+                    _singleflight = SingleFlight()
+                else:
+                    _singleflight = PassThrough()
+    return _singleflight
@@ -0,0 +1,270 @@
+from collections import namedtuple
+import re
+
+# A speaker's new response text ("delta") or a finished speaker ("speaker"),
+# index being the speaker's position in the response
+SpeakerEvent = namedtuple("SpeakerEvent", "kind index role text")
+
+ESCAPES = {"b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+STRING_RUN = re.compile(r'[^"\\]+')
+SCALAR_END = frozenset(',:}] \t\r\n"')
+FENCE = re.compile(r"^\s*```[a-zA-Z]*\s*|\s*```\s*$")
+SENTENCE_END = re.compile(r"[.!?][\"')\]]*(?=\s|$)")
+
+
+def trim_truncated(text):
+    """text cut back to its last full sentence, for a response that ran
+    into max_tokens"""
+    text = text.rstrip()
+    ends = list(SENTENCE_END.finditer(text))
+    if ends:
+        return text[: ends[-1].end()]
+    return text + "..." if text else text
+
+
+class Frame:
+    __slots__ = ("kind", "state", "key", "item", "index")
+
+    def __init__(self, kind, item=None, index=None):
+        self.kind = kind
+        # "[": "value" or "comma"; "{": "key", "colon", "value" or "comma"
+        self.state = "key" if kind == "{" else "value"
+        self.key = None
+        self.item = item
+        self.index = index
+
+
+class SpeakerStreamParser:
+    """Incremental parser for a collaborative response, a JSON array of
+    {"role", "response"} objects, fed the completion chunk by chunk.
+
+    feed() returns the events the chunk completes: "delta" events with new
+    text of the response being written and a "speaker" event as each object
+    closes, so callers can pass speakers on while the model is still
+    generating. Text around the JSON (``` fences, prose, anything after the
+    closing bracket) and stray characters inside it are skipped. close()
+    salvages a speaker cut off by max_tokens, and falls back to the whole
+    text as one speaker when the response isn't JSON at all.
+    """
+
+    def __init__(self, default_role):
+        self.default_role = default_role
+        self.speakers = []
+        self.truncated = False
+        self._chunks = []
+        self._stack = []
+        # Depth of the stack at which an object is a speaker: objects in
+        # the top-level array, or a bare top-level object
+        self._speaker_depth = None
+        self._done = False
+        self._string = None
+        self._escape = ""
+        self._surrogates = False
+        self._emitted = 0
+        self._scalar = None
+
+    @property
+    def content(self):
+        return "".join(self._chunks)
+
+    @property
+    def parsed(self):
+        """Whether any speaker came from the JSON rather than the fallback"""
+        return self._speaker_depth is not None and bool(self.speakers)
+
+    def feed(self, chunk):
+        self._chunks.append(chunk)
+        events = []
+        i, n = 0, len(chunk)
+        while i < n and not self._done:
+            if self._string is not None:
+                i = self._read_string(chunk, i, events)
+                continue
+            c = chunk[i]
+            if self._scalar is not None:
+                if c not in SCALAR_END:
+                    self._scalar += c
+                    i += 1
+                    continue
+                self._scalar = None
+                self._end_value(None, events)
+                continue
+            i += 1
+            if not self._stack:
+                if c in "[{":
+                    self._speaker_depth = 1 if c == "[" else 0
+                    self._open(c)
+                continue
+            self._structural(c, events)
+        self._emit_delta(events)
+        return events
+
+    def close(self):
+        """Finish the response; returns the last events, including a speaker
+        salvaged from a truncated object"""
+        events = []
+        self._escape = ""
+        self._emit_delta(events)
+
+        frame = self._speaker_frame()
+        if frame is not None:
+            self.truncated = True
+            item = frame.item
+            if self._string is not None and self._stack[-1] is frame:
+                if frame.state == "value":
+                    item[frame.key] = self._string_value()
+            if isinstance(item.get("response"), str):
+                item["response"] = trim_truncated(item["response"])
+                self._finish_speaker(frame, events)
+        self._stack = []
+        self._string = None
+
+        if not self.speakers:
+            text = FENCE.sub("", self.content).strip()
+            self._speaker_depth = None
+            self.speakers.append({"role": self.default_role, "response": text})
+            events.append(SpeakerEvent("speaker", 0, self.default_role, text))
+        return events
+
+    def _open(self, kind):
+        item = index = None
+        if kind == "{" and len(self._stack) == self._speaker_depth:
+            item, index = {}, len(self.speakers)
+        self._stack.append(Frame(kind, item, index))
+
+    def _expects_value(self, frame):
+        if frame.kind == "[":
+            # Lenient about a missing comma between array elements
+            return True
+        return frame.state == "value"
+
+    def _structural(self, c, events):
+        frame = self._stack[-1]
+        if c in " \t\r\n":
+            return
+        if c == '"':
+            self._string = ""
+            self._emitted = 0
+            self._surrogates = False
+        elif c in "[{":
+            if self._expects_value(frame):
+                self._open(c)
+        elif c == "]" and frame.kind == "[" or c == "}" and frame.kind == "{":
+            self._stack.pop()
+            if frame.item is not None:
+                self._finish_speaker(frame, events)
+            if self._stack:
+                self._end_value(None, events)
+            elif self.speakers:
+                self._done = True
+            else:
+                # Brackets in the prose before the JSON; keep looking
+                self._speaker_depth = None
+        elif c == ":" and frame.kind == "{" and frame.state == "colon":
+            frame.state = "value"
+        elif c == ",":
+            frame.state = "key" if frame.kind == "{" else "value"
+        elif c in "-0123456789tfn" and self._expects_value(frame):
+            self._scalar = c
+
+    def _end_value(self, value, events):
+        frame = self._stack[-1]
+        if frame.kind == "{":
+            if frame.state in ("key", "comma") and isinstance(value, str):
+                # A key, tolerating a missing comma before it
+                frame.key = value
+                frame.state = "colon"
+                return
+            if frame.state == "value" and frame.item is not None and value is not None:
+                frame.item[frame.key] = value
+        frame.state = "comma"
+
+    def _speaker_frame(self):
+        depth = self._speaker_depth
+        if depth is None or len(self._stack) <= depth:
+            return None
+        frame = self._stack[depth]
+        return frame if frame.item is not None else None
+
+    def _finish_speaker(self, frame, events):
+        item = frame.item
+        if not isinstance(item.get("response"), str):
+            return
+        if not isinstance(item.get("role"), str) or not item["role"]:
+            item["role"] = self.default_role
+        self.speakers.append(item)
+        events.append(
+            SpeakerEvent("speaker", frame.index, item["role"], item["response"])
+        )
+
+    def _in_response(self):
+        frame = self._stack[-1] if self._stack else None
+        return (
+            frame is not None
+            and frame.item is not None
+            and frame.state == "value"
+            and frame.key == "response"
+        )
+
+    def _read_string(self, chunk, i, events):
+        n = len(chunk)
+        while i < n:
+            if self._escape:
+                self._escape += chunk[i]
+                i += 1
+                self._decode_escape()
+                continue
+            match = STRING_RUN.match(chunk, i)
+            if match:
+                self._string += match.group()
+                i = match.end()
+                continue
+            c = chunk[i]
+            i += 1
+            if c == "\\":
+                self._escape = c
+                continue
+            self._emit_delta(events)
+            value = self._string_value()
+            self._string = None
+            self._end_value(value, events)
+            return i
+        return i
+
+    def _decode_escape(self):
+        escape = self._escape
+        if escape[1] != "u":
+            self._string += ESCAPES.get(escape[1], escape[1])
+            self._escape = ""
+        elif len(escape) == 6:
+            try:
+                code = int(escape[2:], 16)
+            except ValueError:
+                self._string += escape[2:]
+            else:
+                self._surrogates |= 0xD800 <= code < 0xE000
+                self._string += chr(code)
+            self._escape = ""
+
+    def _string_value(self, string=None):
+        string = self._string if string is None else string
+        if self._surrogates:
+            return string.encode("utf-16", "surrogatepass").decode("utf-16", "replace")
+        return string
+
+    def _emit_delta(self, events):
+        if self._string is None or not self._in_response():
+            return
+        string = self._string
+        # Hold back half of a surrogate pair until the other half arrives
+        if string and "\ud800" <= string[-1] < "\udc00":
+            string = string[:-1]
+        text = self._string_value(string)
+        if len(text) > self._emitted:
+            frame = self._stack[-1]
+            events.append(
+                SpeakerEvent(
+                    "delta", frame.index, frame.item.get("role"), text[self._emitted :]
+                )
+            )
+            self._emitted = len(text)
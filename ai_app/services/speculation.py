@@ -0,0 +1,81 @@
+from concurrent.futures import ThreadPoolExecutor
+import threading
+
+from django.conf import settings
+
+from ai_app.services.token_budget import count_tokens
+
+DEFAULT_SPECULATION_SETTINGS = {
+    "ENABLED": False,
+    "MAX_WORKERS": 8,
+}
+
+
+def get_speculation_settings():
+    return {
+        **DEFAULT_SPECULATION_SETTINGS,
+        **getattr(settings, "SPECULATIVE_EXECUTION", {}),
+    }
+
+
+def estimate_tokens(text):
+    return count_tokens(text) if text else 0
+
+
+class SpeculationStats:
+    """Counters for speculative solo completions in process_single_role"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.launched = 0
+        self.hits = 0
+        self.misses = 0
+        self.wasted_prompt_tokens = 0
+        self.wasted_completion_tokens = 0
+
+    def record_launch(self):
+        with self._lock:
+            self.launched += 1
+
+    def record_hit(self):
+        with self._lock:
+            self.hits += 1
+
+    def record_miss(self, prompt_tokens):
+        with self._lock:
+            self.misses += 1
+            self.wasted_prompt_tokens += prompt_tokens
+
+    def record_wasted_completion(self, completion_tokens):
+        with self._lock:
+            self.wasted_completion_tokens += completion_tokens
+
+    def snapshot(self):
+        with self._lock:
+            decided = self.hits + self.misses
+            return {
+                "launched": self.launched,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / decided if decided else None,
+                "wasted_prompt_tokens": self.wasted_prompt_tokens,
+                "wasted_completion_tokens": self.wasted_completion_tokens,
+            }
+
+
+speculation_stats = SpeculationStats()
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_speculation_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=get_speculation_settings()["MAX_WORKERS"],
+                    thread_name_prefix="speculation",
+                )
+    return _executor
@@ -0,0 +1,220 @@
+from collections import Counter
+import logging
+import os
+import re
+import threading
+
+from django.conf import settings
+
+try:
+    from tokenizers import Tokenizer
+except ImportError:
+    Tokenizer = None
+
+logger = logging.getLogger("ai_app")
+
+DEFAULT_TOKEN_BUDGET_SETTINGS = {
+    "TOKENIZER": "gpt2",
+    "ROLE_PROMPT_TOKENS": 1500,
+    "SYNTHESIS_PROMPT_TOKENS": 3000,
+    "RECENT_TURNS": 2,
+    "KEY_SENTENCES": 2,
+    "MIN_CONTEXT_TOKENS": 200,
+}
+
+# Per-message framing tokens added by chat templates
+MESSAGE_OVERHEAD_TOKENS = 4
+
+SENTENCE_BOUNDARY = re.compile(r"(?<=[.!?])\s+")
+WORD = re.compile(r"[a-z][a-z'-]+")
+STOPWORDS = frozenset(
+    "the and that this with from your our their there have has for are was were "
+    "but not you all can its into what when which who how why will would could "
+    "should about them they these those then than been being such also more".split()
+)
+
+
+def get_token_budget_settings():
+    return {
+        **DEFAULT_TOKEN_BUDGET_SETTINGS,
+        **getattr(settings, "DIALOGUE_TOKEN_BUDGET", {}),
+    }
+
+
+def format_dialogue_context(conversation):
+    return "".join(f"\n\n{turn['role']}: {turn['response']}" for turn in conversation)
+
+
+def approximate_tokens(text):
+    """~4 characters per token, for when no tokenizer is at hand"""
+    return max(1, len(text) // 4) if text else 0
+
+
+class TokenCounter:
+    """Counts tokens locally with a Hugging Face tokenizer.
+
+    TOKENIZER may be a hub id or a path to a tokenizer.json, or None to always
+    estimate ~4 characters per token. The tokenizer loads in a background
+    thread, started by the ASGI/WSGI application or else by the first count;
+    counts are estimated until it is ready, or for good if it can't be loaded.
+    """
+
+    def __init__(self, tokenizer_name):
+        self.tokenizer_name = tokenizer_name
+        self._tokenizer = None
+        self._loaded = not tokenizer_name
+        self._started = False
+        self._lock = threading.Lock()
+
+    @property
+    def tokenizer(self):
+        if not self._loaded:
+            self.warm_up()
+        return self._tokenizer
+
+    def _load(self):
+        if Tokenizer is None:
+            logger.warning("tokenizers is not installed, estimating token counts")
+            return None
+        try:
+            if os.path.exists(self.tokenizer_name):
+                return Tokenizer.from_file(self.tokenizer_name)
+            return Tokenizer.from_pretrained(self.tokenizer_name)
+        except Exception as e:
+            logger.warning(f"Could not load tokenizer {self.tokenizer_name}: {e}")
+            return None
+
+    def _load_in_background(self):
+        self._tokenizer = self._load()
+        self._loaded = True
+
+    def warm_up(self):
+        """Start loading the tokenizer, once"""
+        with self._lock:
+            if self._started or self._loaded:
+                return
+            self._started = True
+        threading.Thread(
+            target=self._load_in_background, name="tokenizer-load", daemon=True
+        ).start()
+
+    def count(self, text):
+        if not text:
+            return 0
+        if self.tokenizer is None:
+            return approximate_tokens(text)
+        return len(self.tokenizer.encode(text, add_special_tokens=False).ids)
+
+    def count_messages(self, messages):
+        return sum(
+            self.count(message["content"]) + MESSAGE_OVERHEAD_TOKENS
+            for message in messages
+        )
+
+    def keep_last(self, text, max_tokens):
+        """The longest suffix of text that fits in max_tokens"""
+        if max_tokens <= 0:
+            return ""
+        if self.tokenizer is None:
+            return text[-max_tokens * 4 :]
+        offsets = self.tokenizer.encode(text, add_special_tokens=False).offsets
+        if len(offsets) <= max_tokens:
+            return text
+        return text[offsets[-max_tokens][0] :]
+
+
+def key_sentences(text, weights, limit):
+    """Extract the `limit` highest-weighted sentences, in their original order"""
+    sentences = [s for s in SENTENCE_BOUNDARY.split(text.strip()) if s]
+    if len(sentences) <= limit:
+        return text.strip()
+
+    def score(sentence):
+        words = WORD.findall(sentence.lower())
+        if not words:
+            return 0.0
+        return sum(weights[word] for word in set(words)) / len(words) ** 0.5
+
+    ranked = sorted(range(len(sentences)), key=lambda i: score(sentences[i]))
+    keep = sorted(ranked[-limit:])
+    return " ".join(sentences[i] for i in keep)
+
+
+class TokenBudget:
+    """Fits a dialogue's turns into a token budget.
+
+    The most recent turns are kept verbatim. Older turns are first reduced to
+    their key sentences (weighted by how often their words recur across the
+    dialogue and the question), then dropped oldest-first, and as a last
+    resort the remaining text keeps only its most recent tokens.
+    """
+
+    def __init__(self, counter, recent_turns, key_sentence_count):
+        self.counter = counter
+        self.recent_turns = recent_turns
+        self.key_sentence_count = key_sentence_count
+
+    def fit(self, conversation, max_tokens, user_prompt=""):
+        context = format_dialogue_context(conversation)
+        if self.counter.count(context) <= max_tokens:
+            return context
+
+        split = max(len(conversation) - self.recent_turns, 0)
+        older, recent = conversation[:split], conversation[split:]
+
+        weights = Counter(
+            word
+            for text in [turn["response"] for turn in conversation]
+            for word in WORD.findall(text.lower())
+            if word not in STOPWORDS
+        )
+        for word in WORD.findall(user_prompt.lower()):
+            weights[word] += 3
+
+        compacted = [
+            {
+                **turn,
+                "response": key_sentences(
+                    turn["response"], weights, self.key_sentence_count
+                ),
+            }
+            for turn in older
+        ]
+
+        omitted = []
+        while True:
+            context = format_dialogue_context(compacted + recent)
+            if omitted:
+                context = (
+                    f"\n\n(Earlier perspectives from {', '.join(omitted)} "
+                    f"omitted for length.)" + context
+                )
+            if self.counter.count(context) <= max_tokens or not compacted:
+                break
+            omitted.append(compacted.pop(0)["role"])
+
+        if self.counter.count(context) > max_tokens:
+            context = self.counter.keep_last(context, max_tokens)
+        return context
+
+
+_token_counter = None
+_token_counter_lock = threading.Lock()
+
+
+def get_token_counter():
+    global _token_counter
+    if _token_counter is None:
+        with _token_counter_lock:
+            if _token_counter is None:
+                _token_counter = TokenCounter(get_token_budget_settings()["TOKENIZER"])
+    return _token_counter
+
+
+def count_tokens(text):
+    return get_token_counter().count(text)
+
+
+def get_token_budget():
+    conf = get_token_budget_settings()
+    return TokenBudget(get_token_counter(), conf["RECENT_TURNS"], conf["KEY_SENTENCES"])
@@ -0,0 +1,130 @@
+import os
+
+import numpy as np
+
+CODES_SUFFIX = ".codes.npy"
+QUANTIZER_SUFFIX = ".quantizer.npy"
+
+# Codes are widened to float32 a block at a time; 512 rows of 384 dims stay
+# in L2, which makes the scan faster than a float32 matvec over the same rows
+BLOCK_ROWS = 512
+# Candidates re-ranked with the float vectors, per result wanted
+RERANK_FACTOR = 4
+
+
+def top_k(scores, k):
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    top = np.argpartition(-scores, k - 1)[:k]
+    return top[np.argsort(-scores[top])]
+
+
+def replace_npy(path, array):
+    tmp = path + ".tmp.npy"
+    np.save(tmp, array)
+    os.replace(tmp, path)
+
+
+class QuantizedVectors:
+    """Vectors scalar-quantized to 8 bits per dimension.
+
+    Dimension j of a row is offset[j] + scale[j] * code, so a query scores
+    codes against query * scale and adds query . offset. The uint8 codes,
+    a quarter the size of float32, are all a scan touches; the float rows
+    (usually a memory map of the file the codes were made from) are read
+    only to re-rank the best few candidates exactly.
+    """
+
+    def __init__(self, codes, offset, scale, vectors=None):
+        self.codes = codes
+        self.offset = offset
+        self.scale = scale
+        self.vectors = vectors
+
+    @classmethod
+    def quantize(cls, vectors):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if not len(vectors):
+            dim = vectors.shape[1]
+            return cls(
+                np.empty((0, dim), dtype=np.uint8),
+                np.zeros(dim, dtype=np.float32),
+                np.ones(dim, dtype=np.float32),
+                vectors,
+            )
+        offset = vectors.min(axis=0)
+        scale = np.maximum(vectors.max(axis=0) - offset, 1e-12) / 255
+        codes = np.empty(vectors.shape, dtype=np.uint8)
+        for start in range(0, len(vectors), BLOCK_ROWS):
+            block = (vectors[start : start + BLOCK_ROWS] - offset) / scale
+            np.rint(block, out=block)
+            codes[start : start + BLOCK_ROWS] = block
+        return cls(codes, offset.astype(np.float32), scale.astype(np.float32), vectors)
+
+    def save(self, path):
+        """Write codes and quantizer next to the float vectors at path (.npy)"""
+        stem = path[: -len(".npy")]
+        replace_npy(stem + CODES_SUFFIX, self.codes)
+        replace_npy(stem + QUANTIZER_SUFFIX, np.stack([self.offset, self.scale]))
+
+    @classmethod
+    def open(cls, path):
+        """Memory-map the codes saved for the float vectors at path, or None
+        if they haven't been written"""
+        stem = path[: -len(".npy")]
+        if not os.path.exists(stem + CODES_SUFFIX):
+            return None
+        offset, scale = np.load(stem + QUANTIZER_SUFFIX)
+        vectors = np.load(path, mmap_mode="r") if os.path.exists(path) else None
+        return cls(np.load(stem + CODES_SUFFIX, mmap_mode="r"), offset, scale, vectors)
+
+    @staticmethod
+    def remove(path):
+        stem = path[: -len(".npy")]
+        for suffix in (CODES_SUFFIX, QUANTIZER_SUFFIX):
+            if os.path.exists(stem + suffix):
+                os.remove(stem + suffix)
+
+    def __len__(self):
+        return len(self.codes)
+
+    @property
+    def nbytes(self):
+        return self.codes.nbytes
+
+    def scores(self, query, start=0, end=None):
+        """Approximate dot products of rows start:end with query"""
+        end = len(self.codes) if end is None else end
+        scaled = (query * self.scale).astype(np.float32)
+        out = np.empty(end - start, dtype=np.float32)
+        block = np.empty((min(BLOCK_ROWS, end - start), len(scaled)), np.float32)
+        for i in range(start, end, BLOCK_ROWS):
+            j = min(i + BLOCK_ROWS, end)
+            block[: j - i] = self.codes[i:j]
+            np.matmul(block[: j - i], scaled, out=out[i - start : j - start])
+        out += float(query @ self.offset)
+        return out
+
+    def row_scores(self, query, rows):
+        """Approximate dot products of the given rows with query"""
+        scaled = (query * self.scale).astype(np.float32)
+        return self.codes[rows] @ scaled + float(query @ self.offset)
+
+    def rerank(self, query, rows, k):
+        """(rows, scores) of the k best of rows, scored with the float vectors
+        when they are available"""
+        if self.vectors is not None:
+            rows = np.sort(rows)
+            scores = self.vectors[rows] @ query
+        else:
+            scores = self.row_scores(query, rows)
+        top = top_k(scores, k)
+        return rows[top], scores[top]
+
+    def search(self, query, k, start=0, end=None):
+        """(rows, scores) of the top k of rows start:end: an 8-bit scan for
+        RERANK_FACTOR * k candidates, re-ranked exactly"""
+        approximate = self.scores(query, start, end)
+        candidates = top_k(approximate, k * RERANK_FACTOR) + start
+        return self.rerank(query, candidates, k)
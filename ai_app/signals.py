@@ -0,0 +1,32 @@
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from ai_app.models.history import History
+from ai_app.models.llm_role import LLMRole
+from ai_app.services.ann_index import index_history_prompt, remove_history_prompt
+from ai_app.services.role_registry import invalidate_role_registry
+
+
+@receiver(post_save, sender=History)
+def index_new_history(sender, instance, created, **kwargs):
+    if created:
+        index_history_prompt(instance.pk, instance.prompt)
+
+
+@receiver(post_delete, sender=History)
+def unindex_deleted_history(sender, instance, **kwargs):
+    remove_history_prompt(instance.pk)
+
+
+@receiver(post_save, sender=LLMRole)
+@receiver(post_delete, sender=LLMRole)
+def reload_roles(sender, **kwargs):
+    # After commit, so no process reloads the old rows under the new version
+    transaction.on_commit(invalidate_role_registry)
+
+
+@receiver(m2m_changed, sender=LLMRole.collaborators.through)
+def reload_collaborators(sender, action, **kwargs):
+    if action.startswith("post_"):
+        transaction.on_commit(invalidate_role_registry)
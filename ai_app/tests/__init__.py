@@ -0,0 +1,4 @@
+from ai_app.services import token_budget
+
+# The suite estimates token counts rather than fetching a tokenizer
+token_budget._token_counter = token_budget.TokenCounter(None)
@@ -0,0 +1,64 @@
+import shutil
+import tempfile
+from collections import Counter
+
+import numpy as np
+from django.test import SimpleTestCase
+
+from ai_app.services.bm25_index import BM25Index, tokenize
+
+DOCS = [
+    "Karma is action done without attachment to its fruits.",
+    "Grace is given freely and cannot be earned.",
+    "Grace, grace and more grace.",
+    "Grace and karma meet in the long practice of a patient and devoted life.",
+]
+
+
+def query(text):
+    return Counter(tokenize(text))
+
+
+class BM25IndexTests(SimpleTestCase):
+    def setUp(self):
+        self.index = BM25Index.build(DOCS)
+
+    def test_tokenize_drops_stop_words_and_single_letters(self):
+        self.assertEqual(
+            tokenize("What is a Karma-yoga, O Arjuna?"), ["karma", "yoga", "arjuna"]
+        )
+
+    def test_only_matching_documents_score(self):
+        scores = self.index.scores(query("karma"))
+        self.assertEqual(list(np.flatnonzero(scores)), [0, 3])
+        self.assertIsNone(self.index.scores(query("dharma")))
+
+    def test_term_frequency_saturates_and_long_documents_are_penalised(self):
+        scores = self.index.scores(query("grace"))
+        # Repetition helps, but a short document mentioning it once comes close
+        self.assertGreater(scores[2], scores[1])
+        self.assertLess(scores[2], 2 * scores[1])
+        self.assertGreater(scores[1], scores[3])
+
+    def test_rare_terms_weigh_more(self):
+        scores = self.index.scores(query("karma grace"))
+        # karma is in fewer documents than grace
+        self.assertGreater(scores[0], scores[1])
+
+    def test_query_weights_scale_term_scores(self):
+        once = self.index.scores({"karma": 1.0})
+        boosted = self.index.scores({"karma": 0.3})
+        np.testing.assert_allclose(boosted, 0.3 * once, rtol=1e-6)
+
+    def test_saved_indexes_open_memory_mapped(self):
+        path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, path)
+        self.assertIsNone(BM25Index.open(path))
+        self.index.save(path)
+        opened = BM25Index.open(path)
+        self.assertIsInstance(opened.doc_ids, np.memmap)
+        self.assertEqual(opened.doc_count, len(DOCS))
+        for text in ("karma", "grace", "patient practice"):
+            np.testing.assert_allclose(
+                opened.scores(query(text)), self.index.scores(query(text))
+            )
@@ -0,0 +1,25 @@
+from django.test import SimpleTestCase
+
+from ai_app.services.client_pool import ClientPool
+
+BASE_URL = "https://llm.test/v1"
+
+
+class ClientPoolTests(SimpleTestCase):
+    def setUp(self):
+        self.pool = ClientPool()
+
+    def test_reuses_the_client_of_an_endpoint_and_key(self):
+        first = self.pool.get_client("github", BASE_URL, api_key="key-a")
+        self.assertIs(self.pool.get_client("github", BASE_URL, api_key="key-a"), first)
+        (stats,) = self.pool.stats()
+        self.assertEqual((stats["clients_created"], stats["clients_reused"]), (1, 1))
+
+    def test_keys_on_one_endpoint_get_their_own_clients(self):
+        first = self.pool.get_client("github", BASE_URL, api_key="key-a")
+        second = self.pool.get_client("github", BASE_URL, api_key="key-b")
+        self.assertIsNot(first, second)
+        self.assertEqual(second.api_key, "key-b")
+        stats = self.pool.stats()
+        self.assertEqual(len({pool["key"] for pool in stats}), 2)
+        self.assertNotIn("key-a", repr(stats))
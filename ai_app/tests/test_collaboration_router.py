@@ -0,0 +1,62 @@
+from types import SimpleNamespace
+from unittest import mock
+
+import numpy as np
+from django.test import SimpleTestCase
+
+from ai_app.services.collaboration_router import CollaborationRouter
+
+TOPICS = ["karma", "grace", "silence"]
+
+
+def fake_embed_texts(texts):
+    """One axis per topic the text mentions"""
+    vectors = np.array(
+        [[float(topic in text.lower()) for topic in TOPICS] + [0.1] for text in texts],
+        dtype=np.float32,
+    )
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def collaborator(name, description, triggers=""):
+    return SimpleNamespace(
+        name=name, description=description, collaboration_triggers=triggers
+    )
+
+
+@mock.patch("ai_app.services.collaboration_router.embed_texts", fake_embed_texts)
+class CollaborationRouterTests(SimpleTestCase):
+    def setUp(self):
+        self.router = CollaborationRouter(0.5, 0.25)
+        self.collaborators = [
+            collaborator("Sage", "Speaks of karma", "action, duty"),
+            collaborator("Mystic", "Teacher", "grace"),
+        ]
+
+    def ready_router(self):
+        with mock.patch(
+            "ai_app.services.collaboration_router.embeddings_available",
+            return_value=True,
+        ):
+            self.router.start()
+            self.assertTrue(self.router._ready.wait(5))
+        return self.router
+
+    def test_asks_the_llm_until_the_encoder_is_loaded(self):
+        with mock.patch.object(CollaborationRouter, "start") as start:
+            self.assertIsNone(self.router.route("What is grace?", self.collaborators))
+        start.assert_called_once()
+
+    def test_picks_the_collaborator_matching_a_trigger(self):
+        decision = self.ready_router().route("What is grace?", self.collaborators)
+        self.assertTrue(decision["should_collaborate"])
+        self.assertEqual(decision["chosen_collaborator"], "Mystic")
+        self.assertIn('trigger "grace"', decision["reasoning"])
+
+    def test_stays_solo_when_nothing_matches(self):
+        decision = self.ready_router().route("Why silence?", self.collaborators)
+        self.assertFalse(decision["should_collaborate"])
+
+    def test_no_collaborators(self):
+        decision = self.router.route("What is grace?", [])
+        self.assertFalse(decision["should_collaborate"])
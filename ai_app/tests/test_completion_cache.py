@@ -0,0 +1,159 @@
+from unittest import mock
+
+from django.test import SimpleTestCase, override_settings
+
+from ai_app.services import completion_cache
+from ai_app.services.completion_cache import (
+    CompletionCache,
+    DjangoCompletionCache,
+    MemoryCompletionCache,
+    make_cache_key,
+)
+from ai_app.services.model_rotation import OpenAIService
+
+MESSAGES = [{"role": "user", "content": "What is grace?"}]
+
+
+class CacheKeyTests(SimpleTestCase):
+    def key(self, **changes):
+        args = {
+            "backend": "github",
+            "model": "gpt-4o-mini",
+            "messages": MESSAGES,
+            "temperature": 0.7,
+            "max_tokens": 300,
+            "top_p": 1.0,
+            **changes,
+        }
+        return make_cache_key(**args)
+
+    def test_the_same_request_has_the_same_key(self):
+        self.assertEqual(self.key(), self.key(messages=[dict(MESSAGES[0])]))
+        self.assertTrue(self.key().startswith("completion:"))
+
+    def test_every_parameter_is_part_of_the_key(self):
+        changes = [
+            {"backend": "ollama"},
+            {"model": "gpt-4o"},
+            {"messages": [{"role": "user", "content": "What is karma?"}]},
+            {"temperature": 0.2},
+            {"max_tokens": 400},
+            {"top_p": 0.9},
+        ]
+        keys = {self.key(**change) for change in changes}
+        self.assertEqual(len(keys), len(changes))
+        self.assertNotIn(self.key(), keys)
+
+
+class MemoryCompletionCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.now = 1000.0
+        patcher = mock.patch.object(
+            completion_cache.time, "monotonic", lambda: self.now
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.cache = MemoryCompletionCache(max_entries=2, ttl=60)
+
+    def test_entries_expire_after_the_ttl(self):
+        self.cache.set("a", "grace")
+        self.now += 59
+        self.assertEqual(self.cache.get("a"), "grace")
+        self.now += 2
+        self.assertIsNone(self.cache.get("a"))
+        self.assertEqual(len(self.cache), 0)
+
+    def test_least_recently_used_entries_are_evicted(self):
+        self.cache.set("a", "grace")
+        self.cache.set("b", "karma")
+        self.cache.get("a")
+        self.cache.set("c", "dharma")
+        self.assertIsNone(self.cache.get("b"))
+        self.assertEqual(self.cache.get("a"), "grace")
+        self.assertEqual(self.cache.get("c"), "dharma")
+        self.assertEqual(self.cache.evictions, 1)
+
+    def test_setting_an_entry_again_renews_it(self):
+        self.cache.set("a", "grace")
+        self.now += 50
+        self.cache.set("a", "karma")
+        self.now += 50
+        self.assertEqual(self.cache.get("a"), "karma")
+
+
+class CompletionCacheTests(SimpleTestCase):
+    def test_stats_count_hits_and_misses(self):
+        cache = CompletionCache(MemoryCompletionCache(max_entries=2, ttl=60))
+        cache.get("a")
+        cache.set("a", "grace")
+        cache.set("b", None)
+        self.assertEqual(cache.get("a"), "grace")
+        self.assertEqual(
+            cache.stats(),
+            {
+                "backend": "MemoryCompletionCache",
+                "hits": 1,
+                "misses": 1,
+                "evictions": 0,
+                "entries": 1,
+            },
+        )
+
+    def test_backend_errors_are_misses(self):
+        backend = mock.Mock()
+        backend.get.side_effect = OSError("disk is gone")
+        backend.set.side_effect = OSError("disk is gone")
+        cache = CompletionCache(backend)
+        with self.assertLogs("ai_app", "WARNING"):
+            cache.set("a", "grace")
+            self.assertIsNone(cache.get("a"))
+        self.assertEqual(cache.misses, 1)
+
+    @override_settings(
+        CACHES={
+            "completions": {
+                "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+                "LOCATION": "completion-cache-tests",
+            }
+        }
+    )
+    async def test_django_backend(self):
+        cache = CompletionCache(DjangoCompletionCache("completions", ttl=60))
+        await cache.aset("a", "grace")
+        self.assertEqual(await cache.aget("a"), "grace")
+        self.assertEqual(cache.get("a"), "grace")
+        self.assertIsNone(cache.stats()["entries"])
+
+
+class ServiceCacheTests(SimpleTestCase):
+    def setUp(self):
+        patcher = mock.patch(
+            "ai_app.services.model_rotation.get_completion_cache",
+            return_value=CompletionCache(MemoryCompletionCache(16, 60)),
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def service(self, **kwargs):
+        service = OpenAIService(**kwargs)
+        service.router = mock.Mock()
+        service.router.resolve_model.return_value = "gpt-4o-mini"
+        service.router.complete.return_value = "Grace is a gift."
+        return service
+
+    def test_identical_completions_are_served_from_the_cache(self):
+        service = self.service()
+        for _ in range(2):
+            self.assertEqual(
+                service.create_completion(MESSAGES, max_tokens=300),
+                "Grace is a gift.",
+            )
+        self.assertEqual(service.router.complete.call_count, 1)
+        service.create_completion(MESSAGES, max_tokens=400)
+        self.assertEqual(service.router.complete.call_count, 2)
+
+    def test_the_cache_can_be_skipped(self):
+        service = self.service(use_cache=False)
+        service.create_completion(MESSAGES)
+        service.create_completion(MESSAGES)
+        self.assertEqual(service.router.complete.call_count, 2)
@@ -0,0 +1,530 @@
+import asyncio
+import json
+import threading
+import time
+from unittest import mock
+
+from django.test import SimpleTestCase, override_settings
+
+from ai_app.services.dialogue_generator import (
+    COLLABORATION_DECISION_LABEL,
+    SYNTHESIS_LABEL,
+    PANEL_MODE,
+    AsyncDialogueGenerator,
+    DialogueGenerator,
+)
+from ai_app.services.metrics import llm_cascade_escalations
+from ai_app.services.role_registry import Role, RoleRegistry
+
+SOLO = json.dumps({"should_collaborate": False})
+SAGE_ANSWER = [{"role": "Sage", "response": "Grace is a gift."}]
+
+
+def make_role(id, name, model_name=""):
+    return Role(
+        id, name, f"The {name}", "Speak plainly.", model_name, 300, 0.7, "", "", ()
+    )
+
+
+ROLES = [make_role(1, "Sage"), make_role(2, "Mystic"), make_role(3, "Monk")]
+
+
+class FakeService:
+    """Stands in for OpenAIService: answers each call with replies[role_name]
+    (called with the model when callable), one word per streamed chunk after
+    delay seconds, and raises for the roles in fail"""
+
+    def __init__(self, replies=None, fail=(), cheap_model=None, delay=0.0):
+        self.replies = replies or {}
+        self.fail = set(fail)
+        self.cheap_model = cheap_model
+        self.delay = delay
+        self.calls = []
+        self.chunks_sent = 0
+        self.streaming = 0
+        self.max_streaming = 0
+        self.lock = threading.Lock()
+
+    def reply(self, messages, role_name, model):
+        self.calls.append((role_name, model, messages))
+        if role_name in self.fail:
+            raise RuntimeError(f"{role_name} is down")
+        reply = self.replies.get(role_name, f"{role_name} speaks")
+        return reply(model) if callable(reply) else reply
+
+    def chunks(self, content):
+        words = content.split(" ")
+        return [words[0]] + [" " + word for word in words[1:]]
+
+    def started_streaming(self):
+        with self.lock:
+            self.streaming += 1
+            self.max_streaming = max(self.max_streaming, self.streaming)
+
+    def sent_chunk(self, done):
+        with self.lock:
+            self.chunks_sent += 1
+            self.streaming -= done
+
+    def prompts(self, role_name):
+        return [messages for name, _, messages in self.calls if name == role_name]
+
+    def cascade_model(self, model):
+        return self.cheap_model
+
+    def create_completion(
+        self,
+        messages,
+        temperature=0.7,
+        max_tokens=1000,
+        top_p=1.0,
+        role_name=None,
+        model=None,
+    ):
+        return self.reply(messages, role_name, model)
+
+    def create_streaming_completion(
+        self, messages, temperature=0.7, max_tokens=1000, role_name=None, model=None
+    ):
+        chunks = self.chunks(self.reply(messages, role_name, model))
+        self.started_streaming()
+        for i, chunk in enumerate(chunks):
+            time.sleep(self.delay)
+            self.sent_chunk(i + 1 == len(chunks))
+            yield chunk
+
+
+class AsyncFakeService(FakeService):
+    async def create_completion(
+        self,
+        messages,
+        temperature=0.7,
+        max_tokens=1000,
+        top_p=1.0,
+        role_name=None,
+        model=None,
+    ):
+        await asyncio.sleep(self.delay)
+        return self.reply(messages, role_name, model)
+
+    async def create_streaming_completion(
+        self, messages, temperature=0.7, max_tokens=1000, role_name=None, model=None
+    ):
+        chunks = self.chunks(self.reply(messages, role_name, model))
+        self.started_streaming()
+        for i, chunk in enumerate(chunks):
+            await asyncio.sleep(self.delay)
+            self.sent_chunk(i + 1 == len(chunks))
+            yield chunk
+
+
+def user_message(messages):
+    return messages[-1]["content"]
+
+
+def responses(events):
+    return [
+        (event["data"]["role"], event["data"]["response"])
+        for event in events
+        if event["type"] == "response"
+    ]
+
+
+@override_settings(
+    PASSAGE_RETRIEVAL={"ENABLED": False},
+    COLLABORATION_ROUTER={"ENABLED": False},
+    LLM_SPECULATION={"ENABLED": False},
+)
+class DialogueTestCase(SimpleTestCase):
+    def setUp(self):
+        registry = RoleRegistry(ROLES, "test")
+
+        async def aget_role_registry():
+            return registry
+
+        for name, registry_getter in [
+            ("get_role_registry", lambda: registry),
+            ("aget_role_registry", aget_role_registry),
+        ]:
+            patcher = mock.patch(
+                f"ai_app.services.dialogue_generator.{name}", registry_getter
+            )
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+
+class AsyncDialogueTests(DialogueTestCase):
+    def setUp(self):
+        super().setUp()
+        self.service = AsyncFakeService()
+        self.generator = AsyncDialogueGenerator(self.service)
+
+    async def test_sequential_roles_see_the_dialogue_so_far(self):
+        result = await self.generator.process_full_dialogue("What is grace?", False)
+        self.assertEqual(
+            [(turn["role"], turn["response"]) for turn in result["conversation"]],
+            [
+                ("Sage", "Sage speaks"),
+                ("Mystic", "Mystic speaks"),
+                ("Monk", "Monk speaks"),
+                ("Synthesis", f"{SYNTHESIS_LABEL} speaks"),
+            ],
+        )
+        self.assertEqual(result["final_analysis"], f"{SYNTHESIS_LABEL} speaks")
+        self.assertNotIn(
+            "Previous perspectives", user_message(self.service.prompts("Sage")[0])
+        )
+        monk_prompt = user_message(self.service.prompts("Monk")[0])
+        self.assertIn("Sage: Sage speaks", monk_prompt)
+        self.assertIn("Mystic: Mystic speaks", monk_prompt)
+        synthesis_prompt = user_message(self.service.prompts(SYNTHESIS_LABEL)[0])
+        self.assertIn("Monk: Monk speaks", synthesis_prompt)
+
+    async def test_a_failed_role_is_skipped(self):
+        self.service.fail = {"Mystic"}
+        with self.assertLogs("ai_app", "ERROR"):
+            result = await self.generator.process_full_dialogue("What is grace?", False)
+        self.assertEqual(
+            [turn["role"] for turn in result["conversation"]],
+            ["Sage", "Monk", "Synthesis"],
+        )
+        self.assertNotIn("Mystic", user_message(self.service.prompts("Monk")[0]))
+
+    async def test_streamed_dialogue_events(self):
+        events = [
+            event
+            async for event in self.generator.stream_full_dialogue(
+                "What is grace?", True
+            )
+        ]
+        self.assertEqual(
+            [(event["type"], event["data"]["role"]) for event in events[:5]],
+            [
+                ("thinking", "Sage"),
+                ("delta", "Sage"),
+                ("delta", "Sage"),
+                ("response", "Sage"),
+                ("thinking", "Mystic"),
+            ],
+        )
+        self.assertEqual(
+            "".join(
+                event["data"]["delta"]
+                for event in events
+                if event["type"] == "delta" and event["data"]["role"] == "Mystic"
+            ),
+            "Mystic speaks",
+        )
+        self.assertEqual(
+            responses(events),
+            [
+                ("Sage", "Sage speaks"),
+                ("Mystic", "Mystic speaks"),
+                ("Monk", "Monk speaks"),
+            ],
+        )
+        self.assertEqual(
+            events[-1],
+            {
+                "type": "synthesis",
+                "data": {
+                    "turn": 4,
+                    "role": "Synthesis",
+                    "response": f"{SYNTHESIS_LABEL} speaks",
+                },
+            },
+        )
+
+    async def test_a_streamed_role_error_is_an_event(self):
+        self.service.fail = {"Sage"}
+        with self.assertLogs("ai_app", "ERROR"):
+            events = [
+                event
+                async for event in self.generator.stream_full_dialogue(
+                    "What is grace?", False
+                )
+            ]
+        self.assertIn(
+            {"type": "error", "data": {"role": "Sage", "error": "Sage is down"}},
+            events,
+        )
+        self.assertEqual(
+            responses(events), [("Mystic", "Mystic speaks"), ("Monk", "Monk speaks")]
+        )
+        self.assertEqual(events[-1]["type"], "synthesis")
+
+    async def test_single_role_answer(self):
+        self.service.replies = {
+            COLLABORATION_DECISION_LABEL: SOLO,
+            "Sage": json.dumps([{"role": "Sage", "response": "Grace is a gift."}]),
+        }
+        result = await self.generator.process_single_role("Sage", "What is grace?")
+        self.assertEqual(
+            result["response_data"], [{"role": "Sage", "response": "Grace is a gift."}]
+        )
+        self.assertEqual(result["collab_decision"], {"should_collaborate": False})
+        self.assertEqual(result["role"], ROLES[0])
+        self.assertEqual(
+            [name for name, _, _ in self.service.calls],
+            [COLLABORATION_DECISION_LABEL, "Sage"],
+        )
+
+    async def test_single_role_events(self):
+        self.service.replies = {
+            COLLABORATION_DECISION_LABEL: SOLO,
+            "Sage": json.dumps([{"role": "Sage", "response": "Grace is a gift."}]),
+        }
+        events = [
+            event
+            async for event in self.generator.stream_single_role(
+                "Sage", "What is grace?"
+            )
+        ]
+        self.assertEqual(
+            events[0], {"type": "collaboration", "data": {"should_collaborate": False}}
+        )
+        self.assertEqual(
+            events[1], {"type": "thinking", "data": {"turn": 1, "role": "Sage"}}
+        )
+        self.assertEqual(responses(events), [("Sage", "Grace is a gift.")])
+        self.assertEqual(events[-1]["type"], "result")
+
+
+class PanelDialogueTests(DialogueTestCase):
+    def setUp(self):
+        super().setUp()
+        self.service = FakeService(delay=0.01)
+        self.generator = DialogueGenerator(self.service)
+
+    def test_roles_answer_independently(self):
+        result = self.generator.process_full_dialogue(
+            "What is grace?", False, mode=PANEL_MODE
+        )
+        self.assertEqual(
+            [turn["role"] for turn in result["conversation"]],
+            ["Sage", "Mystic", "Monk", "Synthesis"],
+        )
+        for role in ROLES:
+            prompt = user_message(self.service.prompts(role.name)[0])
+            self.assertNotIn("Previous perspectives", prompt)
+        synthesis_prompt = user_message(self.service.prompts(SYNTHESIS_LABEL)[0])
+        for role in ROLES:
+            self.assertIn(f"{role.name}: {role.name} speaks", synthesis_prompt)
+
+    def test_a_failed_role_is_left_out(self):
+        self.service.fail = {"Sage"}
+        with self.assertLogs("ai_app", "ERROR"):
+            result = self.generator.process_full_dialogue(
+                "What is grace?", False, mode=PANEL_MODE
+            )
+        self.assertEqual(
+            [(turn["turn"], turn["role"]) for turn in result["conversation"][:-1]],
+            [(2, "Mystic"), (3, "Monk")],
+        )
+
+    @override_settings(DIALOGUE_PANEL_CONCURRENCY=2)
+    def test_streamed_roles_run_concurrently(self):
+        events = list(
+            self.generator.stream_full_dialogue(
+                "What is grace?", False, mode=PANEL_MODE
+            )
+        )
+        self.assertEqual(self.service.max_streaming, 2)
+        self.assertEqual(
+            sorted(responses(events)),
+            [
+                ("Monk", "Monk speaks"),
+                ("Mystic", "Mystic speaks"),
+                ("Sage", "Sage speaks"),
+            ],
+        )
+        self.assertEqual(events[-1]["type"], "synthesis")
+
+    def test_a_streamed_role_error_does_not_stop_the_others(self):
+        self.service.fail = {"Mystic"}
+        with self.assertLogs("ai_app", "ERROR"):
+            events = list(
+                self.generator.stream_full_dialogue(
+                    "What is grace?", False, mode=PANEL_MODE
+                )
+            )
+        self.assertIn(
+            {"type": "error", "data": {"role": "Mystic", "error": "Mystic is down"}},
+            events,
+        )
+        self.assertEqual(
+            sorted(responses(events)),
+            [("Monk", "Monk speaks"), ("Sage", "Sage speaks")],
+        )
+
+    def test_closing_the_stream_stops_the_roles(self):
+        self.service.replies = {role.name: "word " * 50 for role in ROLES}
+        events = self.generator.stream_full_dialogue(
+            "What is grace?", False, mode=PANEL_MODE
+        )
+        while next(events)["type"] != "delta":
+            pass
+        events.close()
+        time.sleep(0.05)
+        sent = self.service.chunks_sent
+        time.sleep(0.05)
+        self.assertEqual(self.service.chunks_sent, sent)
+        self.assertLess(sent, 3 * 51)
+
+
+class AsyncPanelDialogueTests(DialogueTestCase):
+    def setUp(self):
+        super().setUp()
+        self.service = AsyncFakeService(delay=0.01)
+        self.generator = AsyncDialogueGenerator(self.service)
+
+    async def test_roles_answer_independently(self):
+        self.service.fail = {"Mystic"}
+        with self.assertLogs("ai_app", "ERROR"):
+            result = await self.generator.process_full_dialogue(
+                "What is grace?", False, mode=PANEL_MODE
+            )
+        self.assertEqual(
+            [turn["role"] for turn in result["conversation"]],
+            ["Sage", "Monk", "Synthesis"],
+        )
+        self.assertNotIn(
+            "Previous perspectives", user_message(self.service.prompts("Monk")[0])
+        )
+
+    @override_settings(DIALOGUE_PANEL_CONCURRENCY=2)
+    async def test_streamed_events_interleave(self):
+        events = [
+            event
+            async for event in self.generator.stream_full_dialogue(
+                "What is grace?", False, mode=PANEL_MODE
+            )
+        ]
+        self.assertEqual(self.service.max_streaming, 2)
+        roles = [event["data"]["role"] for event in events if event["type"] == "delta"]
+        # Sage and Mystic stream side by side
+        self.assertNotEqual(roles[:2], ["Sage", "Sage"])
+        self.assertEqual(
+            sorted(responses(events)),
+            [
+                ("Monk", "Monk speaks"),
+                ("Mystic", "Mystic speaks"),
+                ("Sage", "Sage speaks"),
+            ],
+        )
+        self.assertEqual(events[-1]["type"], "synthesis")
+
+    async def test_closing_the_stream_cancels_the_roles(self):
+        self.service.replies = {role.name: "word " * 50 for role in ROLES}
+        events = self.generator.stream_full_dialogue(
+            "What is grace?", False, mode=PANEL_MODE
+        )
+        async for event in events:
+            if event["type"] == "delta":
+                break
+        await events.aclose()
+        await asyncio.sleep(0.05)
+        sent = self.service.chunks_sent
+        await asyncio.sleep(0.05)
+        self.assertEqual(self.service.chunks_sent, sent)
+        self.assertLess(sent, 3 * 51)
+
+
+def escalations(role):
+    label = f'{{role="{role}"}}'
+    return sum(
+        int(line.rsplit(" ", 1)[1])
+        for line in llm_cascade_escalations.collect()
+        if label in line
+    )
+
+
+def cheap_answer(answer):
+    """Replies with answer from the cascade's cheap model, and with
+    SAGE_ANSWER from the role's own"""
+    return lambda model: answer if model == "cheap" else json.dumps(SAGE_ANSWER)
+
+
+class CascadeTests(DialogueTestCase):
+    def setUp(self):
+        super().setUp()
+        self.service = FakeService(cheap_model="cheap")
+        self.generator = DialogueGenerator(self.service)
+        self.escalations = escalations("Sage")
+
+    def answer(self, cheap, speculative=False):
+        self.service.replies = {
+            COLLABORATION_DECISION_LABEL: SOLO,
+            "Sage": cheap_answer(cheap),
+        }
+        return self.generator.process_single_role(
+            "Sage", "What is grace?", speculative=speculative
+        )
+
+    def models(self):
+        return [model for name, model, _ in self.service.calls if name == "Sage"]
+
+    def test_a_valid_cheap_answer_is_kept(self):
+        cheap = [{"role": "Sage", "response": "Grace is free."}]
+        result = self.answer(json.dumps(cheap))
+        self.assertEqual(result["response_data"], cheap)
+        self.assertEqual(self.models(), ["cheap"])
+        self.assertEqual(escalations("Sage"), self.escalations)
+
+    def test_invalid_json_escalates_to_the_roles_model(self):
+        with self.assertLogs("ai_app", "INFO"):
+            result = self.answer("Grace is free.")
+        self.assertEqual(result["response_data"], SAGE_ANSWER)
+        self.assertEqual(self.models(), ["cheap", ""])
+        self.assertEqual(escalations("Sage"), self.escalations + 1)
+
+    def test_a_truncated_answer_escalates(self):
+        with self.assertLogs("ai_app", "INFO"):
+            result = self.answer('[{"role": "Sage", "response": "Grace is')
+        self.assertEqual(result["response_data"], SAGE_ANSWER)
+        self.assertEqual(self.models(), ["cheap", ""])
+
+    def test_a_speculative_cheap_answer_escalates(self):
+        with self.assertLogs("ai_app", "INFO"):
+            result = self.answer("Grace is free.", speculative=True)
+        self.assertEqual(result["response_data"], SAGE_ANSWER)
+        self.assertEqual(self.models(), ["cheap", ""])
+        self.assertEqual(escalations("Sage"), self.escalations + 1)
+
+    def test_without_a_cascade_only_the_roles_model_answers(self):
+        self.service.cheap_model = None
+        result = self.answer("Grace is free.")
+        self.assertEqual(result["response_data"], SAGE_ANSWER)
+        self.assertEqual(self.models(), [""])
+
+
+class AsyncCascadeTests(DialogueTestCase):
+    def setUp(self):
+        super().setUp()
+        self.service = AsyncFakeService(
+            cheap_model="cheap",
+            replies={
+                COLLABORATION_DECISION_LABEL: SOLO,
+                "Sage": cheap_answer("Grace is free."),
+            },
+        )
+        self.generator = AsyncDialogueGenerator(self.service)
+
+    async def test_escalated_answers_stream_only_the_final_answer(self):
+        escalated = escalations("Sage")
+        with self.assertLogs("ai_app", "INFO"):
+            events = [
+                event
+                async for event in self.generator.stream_single_role(
+                    "Sage", "What is grace?", speculative=False
+                )
+            ]
+        self.assertEqual(
+            "".join(
+                event["data"]["delta"] for event in events if event["type"] == "delta"
+            ),
+            "Grace is a gift.",
+        )
+        self.assertEqual(responses(events), [("Sage", "Grace is a gift.")])
+        self.assertEqual(events[-1]["data"]["response_data"], SAGE_ANSWER)
+        self.assertEqual(escalations("Sage"), escalated + 1)
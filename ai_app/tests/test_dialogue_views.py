@@ -0,0 +1,99 @@
+import json
+from unittest import mock
+
+from ai_app.services.dialogue_generator import COLLABORATION_DECISION_LABEL
+from ai_app.services.role_registry import RoleRegistry
+from ai_app.tests.test_dialogue_generator import (
+    ROLES,
+    SOLO,
+    AsyncFakeService,
+    DialogueTestCase,
+)
+
+SAGE_ANSWER = [{"role": "Sage", "response": "Grace is a gift."}]
+
+
+class StreamAskRoleTests(DialogueTestCase):
+    def setUp(self):
+        super().setUp()
+        self.service = AsyncFakeService(
+            replies={
+                COLLABORATION_DECISION_LABEL: SOLO,
+                "Sage": json.dumps(SAGE_ANSWER),
+            }
+        )
+        registry = RoleRegistry(ROLES, "test")
+
+        async def aget_role_registry():
+            return registry
+
+        for target, value in (
+            ("ai_app.views.dialogue.AsyncOpenAIService", lambda **kw: self.service),
+            ("ai_app.views.dialogue.aget_role_registry", aget_role_registry),
+        ):
+            patcher = mock.patch(target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        patcher = mock.patch("ai_app.views.dialogue.get_history_writer")
+        self.history_writer = patcher.start().return_value
+        self.addCleanup(patcher.stop)
+
+    async def post(self, **data):
+        return await self.async_client.post(
+            "/ai/stream-ask-role/", data, content_type="application/json"
+        )
+
+    async def events(self, response):
+        self.assertEqual(response["Content-Type"], "application/x-ndjson")
+        body = b"".join([chunk async for chunk in response.streaming_content])
+        return [json.loads(line) for line in body.decode().splitlines()]
+
+    async def test_event_sequence(self):
+        events = await self.events(
+            await self.post(prompt="What is grace?", role="Sage")
+        )
+        self.assertEqual(
+            [event["type"] for event in events],
+            ["start", "collaboration", "thinking"]
+            + ["delta"] * 4
+            + ["response", "result", "complete"],
+        )
+        self.assertEqual(
+            events[0]["data"], {"prompt": "What is grace?", "role": "Sage"}
+        )
+        self.assertEqual(events[1]["data"], {"should_collaborate": False})
+        self.assertEqual(
+            "".join(event["data"]["delta"] for event in events[3:7]),
+            "Grace is a gift.",
+        )
+        self.assertEqual(
+            events[7]["data"],
+            {"turn": 1, "role": "Sage", "response": "Grace is a gift."},
+        )
+        self.assertEqual(
+            events[8]["data"], {"response": SAGE_ANSWER, "collaboration": None}
+        )
+        self.history_writer.record.assert_called_once_with(
+            "What is grace?", json.dumps(SAGE_ANSWER), role_name="Sage"
+        )
+
+    async def test_errors_end_the_stream(self):
+        self.service.fail = {"Sage"}
+        with self.assertLogs("ai_app", "ERROR"):
+            events = await self.events(
+                await self.post(prompt="What is grace?", role="Sage")
+            )
+        self.assertEqual(
+            events[-2:],
+            [
+                {"type": "error", "data": {"role": "Sage", "error": "Sage is down"}},
+                {"type": "complete", "data": None},
+            ],
+        )
+        self.history_writer.record.assert_not_called()
+
+    async def test_bad_requests_are_rejected_before_streaming(self):
+        response = await self.post(prompt="What is grace?", role="Nobody")
+        self.assertEqual(response.status_code, 404)
+        response = await self.post(role="Sage")
+        self.assertEqual(response.status_code, 400)
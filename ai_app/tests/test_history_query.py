@@ -0,0 +1,157 @@
+from datetime import timedelta
+import uuid
+
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from ai_app.models.history import History
+from ai_app.models.llm_role import LLMRole
+from ai_app.models.user import User
+from ai_app.services.history_query import (
+    MAX_PAGE_SIZE,
+    HistoryQuery,
+    InvalidHistoryQuery,
+    encode_cursor,
+)
+
+START = timezone.now().replace(microsecond=0) - timedelta(days=1)
+
+
+@override_settings(ANN_INDEX={"ENABLED": False})
+class HistoryQueryTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.alice = User.objects.create(username="alice", email="alice@example.com")
+        cls.bob = User.objects.create(username="bob", email="bob@example.com")
+        cls.sage = LLMRole.objects.create(
+            name="Sage", description="", prompt_template=""
+        )
+        cls.mystic = LLMRole.objects.create(
+            name="Mystic", description="", prompt_template=""
+        )
+        cls.dialogue = uuid.uuid4()
+        # Pairs of rows share a timestamp, so that pages break inside ties
+        for i in range(12):
+            cls.add(
+                i,
+                START + timedelta(minutes=i // 2),
+                user=cls.alice if i % 3 else cls.bob,
+                role=cls.sage if i % 2 else cls.mystic,
+                dialogue_id=cls.dialogue if i < 4 else None,
+            )
+
+    @classmethod
+    def add(cls, i, created_at, **fields):
+        fields = {"user": cls.alice, "role": cls.sage, **fields}
+        row = History.objects.create(prompt=f"prompt {i}", response="...", **fields)
+        History.objects.filter(pk=row.pk).update(created_at=created_at)
+        return row
+
+    def newest_first(self, queryset=None):
+        queryset = History.objects.all() if queryset is None else queryset
+        return list(
+            queryset.order_by("-created_at", "-id").values_list("id", flat=True)
+        )
+
+    def walk(self, **params):
+        """Ids of every page of the query, and the number of pages"""
+        ids, pages, cursor = [], 0, None
+        while True:
+            query = {**params, **({"cursor": cursor} if cursor else {})}
+            rows, cursor = HistoryQuery(query).page()
+            ids.extend(row["id"] for row in rows)
+            pages += 1
+            if cursor is None:
+                return ids, pages
+
+    def test_pages_walk_every_row_newest_first(self):
+        for limit in (1, 3, 5, 12, 50):
+            ids, pages = self.walk(limit=str(limit))
+            self.assertEqual(ids, self.newest_first())
+            self.assertEqual(pages, max(1, -(-12 // limit)))
+
+    def test_new_rows_do_not_shift_later_pages(self):
+        rows, cursor = HistoryQuery({"limit": "4"}).page()
+        self.add(99, timezone.now())
+        rest, _ = self.walk(limit="4", cursor=cursor)
+        self.assertEqual([r["id"] for r in rows] + rest, self.newest_first()[1:])
+
+    def test_rows_carry_role_and_user_names(self):
+        rows, _ = HistoryQuery({"limit": "1"}).page()
+        row = History.objects.order_by("-created_at", "-id").first()
+        self.assertEqual(rows[0]["role__name"], row.role.name)
+        self.assertEqual(rows[0]["user__username"], row.user.username)
+
+    def test_filters(self):
+        cases = [
+            ({"role": "Sage"}, History.objects.filter(role=self.sage)),
+            ({"user": "bob"}, History.objects.filter(user=self.bob)),
+            ({"user": str(self.alice.pk)}, History.objects.filter(user=self.alice)),
+            (
+                {"dialogue": str(self.dialogue)},
+                History.objects.filter(dialogue_id=self.dialogue),
+            ),
+            (
+                {
+                    "since": (START + timedelta(minutes=1)).isoformat(),
+                    "until": (START + timedelta(minutes=4)).isoformat(),
+                },
+                History.objects.filter(
+                    created_at__gte=START + timedelta(minutes=1),
+                    created_at__lt=START + timedelta(minutes=4),
+                ),
+            ),
+            ({"role": "Nobody"}, History.objects.none()),
+        ]
+        for params, expected in cases:
+            with self.subTest(params):
+                ids, _ = self.walk(limit="2", **params)
+                self.assertEqual(ids, self.newest_first(expected))
+
+    def test_cursor_round_trips(self):
+        row = History.objects.order_by("created_at").first()
+        rows, _ = HistoryQuery(
+            {"cursor": encode_cursor(row.created_at, row.pk + 1)}
+        ).page()
+        self.assertEqual(rows[0]["id"], row.pk)
+
+    def test_limit_is_capped(self):
+        self.assertEqual(HistoryQuery({"limit": "100000"}).limit, MAX_PAGE_SIZE)
+
+    def test_invalid_parameters(self):
+        for params in (
+            {"limit": "0"},
+            {"limit": "ten"},
+            {"cursor": "not a cursor"},
+            {"since": "yesterday"},
+            {"dialogue": "42"},
+        ):
+            with self.subTest(params):
+                with self.assertRaises(InvalidHistoryQuery):
+                    HistoryQuery(params)
+
+
+@override_settings(ANN_INDEX={"ENABLED": False})
+class HistoryViewTests(TestCase):
+    def test_pages_through_the_api(self):
+        user = User.objects.create(username="alice", email="alice@example.com")
+        for i in range(3):
+            History.objects.create(user=user, prompt=f"prompt {i}", response="...")
+        first = self.client.get("/ai/history/", {"limit": 2}).json()
+        self.assertEqual(
+            [row["prompt"] for row in first["history"]], ["prompt 2", "prompt 1"]
+        )
+        second = self.client.get(
+            "/ai/history/", {"limit": 2, "cursor": first["next_cursor"]}
+        ).json()
+        self.assertEqual([row["prompt"] for row in second["history"]], ["prompt 0"])
+        self.assertIsNone(second["next_cursor"])
+
+    def test_rejects_invalid_parameters(self):
+        response = self.client.get("/ai/history/", {"cursor": "nope"})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {"error": "Invalid cursor"})
+
+    def test_similar_needs_the_history_index(self):
+        response = self.client.get("/ai/history/", {"similar": "grace"})
+        self.assertEqual(response.status_code, 503)
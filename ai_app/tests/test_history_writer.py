@@ -0,0 +1,128 @@
+import json
+import os
+import shutil
+import tempfile
+from unittest import mock
+
+from django.db import DatabaseError
+from django.test import TestCase
+
+from ai_app.models.history import History
+from ai_app.models.llm_role import LLMRole
+from ai_app.models.user import User
+from ai_app.services.history_writer import HistoryWriter
+from ai_app.services.role_registry import RoleRegistry
+
+
+class HistoryWriterTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create(username="testuser", email="test@example.com")
+        cls.role = LLMRole.objects.create(
+            name="Sage", description="", prompt_template=""
+        )
+
+    def setUp(self):
+        spool_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, spool_dir)
+        self.spool_path = os.path.join(spool_dir, "history_spool.jsonl")
+        self.writer = HistoryWriter(
+            batch_size=2,
+            flush_interval=60,
+            max_pending=5,
+            spool_path=self.spool_path,
+            username="testuser",
+        )
+        # Flushed by the tests rather than by the background thread
+        self.patch(mock.patch.object(HistoryWriter, "_start"))
+        self.patch(
+            mock.patch(
+                "ai_app.services.history_writer.get_role_registry",
+                lambda: RoleRegistry.load("test"),
+            )
+        )
+        self.index = self.patch(
+            mock.patch("ai_app.services.history_writer.index_history_prompt")
+        )
+
+    def patch(self, patcher):
+        patched = patcher.start()
+        self.addCleanup(patcher.stop)
+        return patched
+
+    def record(self, count, start=0, **fields):
+        for i in range(start, start + count):
+            self.writer.record(f"prompt {i}", f"response {i}", **fields)
+
+    def spooled(self):
+        if not os.path.exists(self.spool_path):
+            return []
+        with open(self.spool_path, encoding="utf-8") as f:
+            return [json.loads(line)["prompt"] for line in f]
+
+    def saved(self):
+        return list(History.objects.order_by("id").values_list("prompt", flat=True))
+
+    def test_flush_saves_queued_records_in_batches(self):
+        self.record(3, role_name="Sage", turn=1)
+        self.assertEqual(History.objects.count(), 0)
+        self.assertEqual(self.writer.flush(), 3)
+        self.assertEqual(self.saved(), ["prompt 0", "prompt 1", "prompt 2"])
+        row = History.objects.first()
+        self.assertEqual((row.user, row.role, row.turn), (self.user, self.role, 1))
+        self.assertEqual(
+            self.writer.stats(), {"pending": 0, "written": 3, "spooled": 0}
+        )
+        self.assertEqual(self.index.call_count, 3)
+
+    def test_unknown_users_and_roles(self):
+        self.record(1, user="nobody")
+        self.record(1, start=1, role_name="Nobody")
+        self.writer.flush()
+        self.assertEqual(self.saved(), ["prompt 1"])
+        self.assertIsNone(History.objects.get().role)
+
+    def test_records_over_max_pending_are_spooled(self):
+        self.record(7)
+        self.assertEqual(self.writer.stats()["pending"], 5)
+        self.assertEqual(self.spooled(), ["prompt 5", "prompt 6"])
+        self.assertEqual(self.writer.flush(), 7)
+        self.assertEqual(sorted(self.saved()), [f"prompt {i}" for i in range(7)])
+        self.assertEqual(self.spooled(), [])
+
+    def test_a_failed_batch_spools_only_what_was_not_saved(self):
+        self.record(5)
+        save = self.writer._save
+        calls = []
+
+        def fail_second_batch(batch):
+            calls.append(batch)
+            if len(calls) == 2:
+                raise DatabaseError("database is locked")
+            return save(batch)
+
+        with mock.patch.object(self.writer, "_save", fail_second_batch):
+            self.assertEqual(self.writer.flush(), 2)
+        self.assertEqual(self.saved(), ["prompt 0", "prompt 1"])
+        self.assertEqual(self.spooled(), ["prompt 2", "prompt 3", "prompt 4"])
+        # Only the saved rows are indexed
+        self.assertEqual(self.index.call_count, 2)
+
+        self.record(1, start=5)
+        self.assertEqual(self.writer.flush(), 4)
+        self.assertEqual(self.saved(), [f"prompt {i}" for i in range(6)])
+        self.assertEqual(self.spooled(), [])
+        self.assertEqual(os.listdir(os.path.dirname(self.spool_path)), [])
+
+    def test_index_errors_do_not_spool_saved_rows(self):
+        self.index.side_effect = RuntimeError("index is gone")
+        self.record(2)
+        self.assertEqual(self.writer.flush(), 2)
+        self.assertEqual(len(self.saved()), 2)
+        self.assertEqual(self.spooled(), [])
+
+    def test_close_saves_without_indexing(self):
+        self.record(2)
+        self.writer.close()
+        self.assertEqual(len(self.saved()), 2)
+        self.index.assert_not_called()
@@ -0,0 +1,100 @@
+import re
+
+from django.test import SimpleTestCase
+
+from ai_app.services.metrics import MetricsRegistry
+from ai_app.views.metrics import PROMETHEUS_CONTENT_TYPE
+
+SAMPLE = re.compile(
+    r'^[a-zA-Z_:][a-zA-Z0-9_:]*(\{([a-zA-Z_]\w*="([^"\\]|\\.)*",?)*\})? \S+$'
+)
+
+
+class MetricsFormatTests(SimpleTestCase):
+    def setUp(self):
+        self.registry = MetricsRegistry()
+
+    def test_counters(self):
+        requests = self.registry.counter(
+            "llm_requests_total", "LLM completions", ("role", "outcome")
+        )
+        requests.inc(role="Sage", outcome="success")
+        requests.inc(2, role="Sage", outcome="success")
+        requests.inc(role='The "Monk"\n', outcome="error")
+        self.assertEqual(
+            self.registry.render(),
+            "# HELP llm_requests_total LLM completions\n"
+            "# TYPE llm_requests_total counter\n"
+            'llm_requests_total{role="Sage",outcome="success"} 3\n'
+            'llm_requests_total{role="The \\"Monk\\" ",outcome="error"} 1\n',
+        )
+
+    def test_histograms(self):
+        latency = self.registry.histogram(
+            "retrieval_duration_seconds", "Retrieval time", buckets=(0.1, 1)
+        )
+        for value in (0.05, 0.1, 0.5, 2):
+            latency.observe(value)
+        self.assertEqual(
+            self.registry.render(),
+            "# HELP retrieval_duration_seconds Retrieval time\n"
+            "# TYPE retrieval_duration_seconds histogram\n"
+            'retrieval_duration_seconds_bucket{le="0.1"} 2\n'
+            'retrieval_duration_seconds_bucket{le="1"} 3\n'
+            'retrieval_duration_seconds_bucket{le="+Inf"} 4\n'
+            "retrieval_duration_seconds_sum 2.65\n"
+            "retrieval_duration_seconds_count 4\n",
+        )
+
+    def test_labelled_histograms_put_le_last(self):
+        latency = self.registry.histogram(
+            "llm_queue_delay_seconds", "Queue delay", ("backend",), buckets=(1,)
+        )
+        latency.observe(0.5, backend="github")
+        self.assertIn(
+            'llm_queue_delay_seconds_bucket{backend="github",le="1"} 1\n',
+            self.registry.render(),
+        )
+
+    def test_collectors_are_read_at_render_time(self):
+        entries = {"count": 1}
+        self.registry.register_collector(
+            lambda: [
+                (
+                    "llm_cache_entries",
+                    "gauge",
+                    "Cache entries",
+                    [({"backend": "memory"}, entries["count"])],
+                )
+            ]
+        )
+        entries["count"] = 5
+        self.assertEqual(
+            self.registry.render(),
+            "# HELP llm_cache_entries Cache entries\n"
+            "# TYPE llm_cache_entries gauge\n"
+            'llm_cache_entries{backend="memory"} 5\n',
+        )
+
+
+class MetricsViewTests(SimpleTestCase):
+    def test_exposition(self):
+        response = self.client.get("/ai/metrics/")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], PROMETHEUS_CONTENT_TYPE)
+
+        families = []
+        for line in response.content.decode().splitlines():
+            if line.startswith("# TYPE "):
+                families.append(line.split(" ")[2])
+            elif not line.startswith("# HELP "):
+                self.assertRegex(line, SAMPLE)
+        self.assertEqual(len(families), len(set(families)))
+        for family in (
+            "llm_requests_total",
+            "llm_request_duration_seconds",
+            "llm_cache_hits_total",
+            "llm_pool_open_connections",
+            "history_writes_pending",
+        ):
+            self.assertIn(family, families)
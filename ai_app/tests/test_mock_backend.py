@@ -0,0 +1,115 @@
+import json
+from unittest import mock
+
+import openai
+from django.test import SimpleTestCase
+
+from ai_app.services.dialogue_generator import SOLO_DECISION, DialogueGenerator
+from ai_app.services.mock_backend import DEFAULT_MOCK_SETTINGS, MockLLM
+from ai_app.services.role_registry import Role
+
+ROLE = Role(1, "Sage", "A sage", "Speak wisely.", "", 300, 0.7, "", "", ())
+COLLABORATOR = Role(2, "Mystic", "A mystic", "", "", 300, 0.7, "union", "", ())
+QUESTION = [{"role": "user", "content": "What is grace?"}]
+
+
+def mock_llm(**conf):
+    return MockLLM({**DEFAULT_MOCK_SETTINGS, "TTFT": 0, "TOKEN_LATENCY": 0, **conf})
+
+
+class MockLLMTests(SimpleTestCase):
+    def test_responses_are_deterministic(self):
+        llm = mock_llm()
+        self.assertEqual(llm.respond(QUESTION, 100), mock_llm().respond(QUESTION, 100))
+        self.assertNotEqual(
+            llm.respond(QUESTION, 100), mock_llm(SEED=1).respond(QUESTION, 100)
+        )
+        other = [{"role": "user", "content": "What is karma?"}]
+        self.assertNotEqual(llm.respond(QUESTION, 100), llm.respond(other, 100))
+
+    def test_plain_answers_fit_the_token_limits(self):
+        llm = mock_llm(RESPONSE_TOKENS=20)
+        self.assertLessEqual(len(llm.respond(QUESTION, 100).split()), 20)
+        self.assertLessEqual(len(llm.respond(QUESTION, 8).split()), 8)
+
+    def test_collaboration_decisions(self):
+        messages = DialogueGenerator(None).build_collaboration_messages(
+            ROLE, "What is grace?", [COLLABORATOR]
+        )
+        decisions = [
+            json.loads(mock_llm(SEED=seed).respond(messages, 100)) for seed in range(10)
+        ]
+        for decision in decisions:
+            self.assertEqual(
+                set(decision),
+                {"should_collaborate", "chosen_collaborator", "reasoning"},
+            )
+            self.assertEqual(
+                decision["chosen_collaborator"],
+                "Mystic" if decision["should_collaborate"] else None,
+            )
+        self.assertEqual(
+            {decision["should_collaborate"] for decision in decisions}, {True, False}
+        )
+
+    def test_single_role_answers_are_speaker_arrays(self):
+        system_prompt = DialogueGenerator(None).create_system_prompt(
+            ROLE, SOLO_DECISION
+        )
+        messages = [{"role": "system", "content": system_prompt}] + QUESTION
+        speakers = json.loads(mock_llm().respond(messages, 100))
+        self.assertEqual([speaker["role"] for speaker in speakers], ["Sage"])
+        self.assertTrue(speakers[0]["response"])
+
+    def test_streams_and_usage(self):
+        llm = mock_llm()
+        messages = [{"role": "system", "content": "You are a sage."}] + QUESTION
+        recorder = mock.Mock()
+        content = "".join(llm.stream(messages, 100, recorder))
+        self.assertEqual(content, llm.respond(messages, 100))
+        recorder.first_token.assert_called()
+        prompt_tokens, completion_tokens, cached_tokens = recorder.set_usage.call_args[
+            0
+        ]
+        self.assertEqual((prompt_tokens, cached_tokens), (6, 0))
+        self.assertGreater(completion_tokens, 0)
+
+    async def test_async_streams(self):
+        llm = mock_llm()
+        content = "".join(
+            [chunk async for chunk in llm.astream(QUESTION, 100, mock.Mock())]
+        )
+        self.assertEqual(content, llm.respond(QUESTION, 100))
+        self.assertEqual(await llm.acomplete(QUESTION, 100, mock.Mock()), content)
+
+    def test_repeated_system_prompts_report_cached_tokens(self):
+        llm = mock_llm()
+        system = {"role": "system", "content": "You are a sage. " * 10}
+        self.assertEqual(llm.cached_tokens([system] + QUESTION), 0)
+        other_question = [{"role": "user", "content": "What is karma?"}]
+        self.assertEqual(llm.cached_tokens([system] + other_question), 40)
+        self.assertEqual(llm.cached_tokens(QUESTION), 0)
+
+
+class MockFaultTests(SimpleTestCase):
+    def test_rate_limits_carry_retry_after(self):
+        llm = mock_llm(RATE_LIMIT_RATE=1.0, RETRY_AFTER=3)
+        with self.assertRaises(openai.RateLimitError) as caught:
+            llm.complete(QUESTION, 100, mock.Mock())
+        self.assertEqual(caught.exception.response.headers["retry-after"], "3")
+
+    def test_server_errors(self):
+        llm = mock_llm(ERROR_RATE=1.0)
+        recorder = mock.Mock()
+        with self.assertRaises(openai.InternalServerError):
+            list(llm.stream(QUESTION, 100, recorder))
+        recorder.first_token.assert_not_called()
+
+    def test_faults_replay_with_the_seed(self):
+        def faults(seed):
+            llm = mock_llm(ERROR_RATE=0.3, RATE_LIMIT_RATE=0.3, SEED=seed)
+            return [llm.next_fault() for _ in range(50)]
+
+        self.assertEqual(faults(7), faults(7))
+        self.assertNotEqual(faults(7), faults(8))
+        self.assertEqual(set(faults(7)), {None, "error", "rate_limit"})
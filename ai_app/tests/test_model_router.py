@@ -0,0 +1,279 @@
+import asyncio
+import time
+
+import httpx
+import openai
+from django.test import SimpleTestCase, override_settings
+
+from ai_app.services.metrics import llm_requests
+from ai_app.services.model_router import (
+    CLOSED,
+    HALF_OPEN,
+    OPEN,
+    Backend,
+    ModelRouter,
+    get_router_settings,
+)
+
+MESSAGES = [{"role": "user", "content": "What is grace?"}]
+COOLDOWN = 0.05
+TIMEOUT = 5
+
+
+def api_error(status, headers=None):
+    request = httpx.Request("POST", "https://llm.test/chat/completions")
+    response = httpx.Response(status, headers=headers, request=request)
+    return openai.APIStatusError(f"HTTP {status}", response=response, body=None)
+
+
+def requests_with_outcome(role, outcome):
+    label = f'role="{role}",outcome="{outcome}"'
+    return sum(
+        int(line.rsplit(" ", 1)[1]) for line in llm_requests.collect() if label in line
+    )
+
+
+class ScriptedBackend(Backend):
+    """A backend that answers with reply, one word per chunk, after delay
+    seconds per chunk, or raises error after fail_after chunks"""
+
+    def __init__(self, name, reply="ok", error=None, fail_after=0, delay=0.0, **kw):
+        super().__init__(name, "github", "gpt-4o-mini", **kw)
+        self.reply = reply
+        self.error = error
+        self.fail_after = fail_after
+        self.delay = delay
+        self.calls = 0
+        self.chunks_sent = 0
+
+    def chunks(self):
+        for i, word in enumerate(self.reply.split(" ")):
+            if self.error is not None and i == self.fail_after:
+                raise self.error
+            time.sleep(self.delay)
+            self.chunks_sent += 1
+            yield word if i == 0 else " " + word
+        if self.error is not None:
+            raise self.error
+
+    def complete(self, messages, temperature, max_tokens, top_p, recorder):
+        self.calls += 1
+        return "".join(self.chunks())
+
+    def stream(self, messages, temperature, max_tokens, recorder, top_p=None):
+        self.calls += 1
+        yield from self.chunks()
+
+    async def acomplete(self, messages, temperature, max_tokens, top_p, recorder):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        if self.error is not None:
+            raise self.error
+        return self.reply
+
+    async def astream(self, messages, temperature, max_tokens, recorder, top_p=None):
+        self.calls += 1
+        for chunk in self.chunks():
+            yield chunk
+
+
+@override_settings(
+    LLM_ROUTER={"FAILURE_THRESHOLD": 2, "COOLDOWN": COOLDOWN},
+    LLM_RATE_LIMITS={"MAX_RETRIES": 0},
+)
+class ModelRouterTests(SimpleTestCase):
+    def router(self, *backends, **conf):
+        return ModelRouter(backends, {**get_router_settings(), **conf})
+
+    def complete(self, router, role="test", max_tokens=50):
+        return router.complete(
+            "default", None, MESSAGES, 0.7, max_tokens, None, role_name=role
+        )
+
+    def test_fails_over_to_the_next_backend(self):
+        broken = ScriptedBackend("broken", error=api_error(500))
+        healthy = ScriptedBackend("healthy", reply="fine")
+        router = self.router(broken, healthy)
+        self.assertEqual(self.complete(router), "fine")
+        self.assertEqual(router.failovers, 1)
+        self.assertEqual(list(broken.outcomes), [False])
+        self.assertEqual(list(healthy.outcomes), [True])
+
+    def test_does_not_fail_over_on_a_bad_request(self):
+        broken = ScriptedBackend("broken", error=api_error(400))
+        healthy = ScriptedBackend("healthy")
+        router = self.router(broken, healthy)
+        with self.assertRaises(openai.APIStatusError):
+            self.complete(router)
+        self.assertEqual(healthy.calls, 0)
+        self.assertEqual(broken.circuit(), CLOSED)
+
+    def test_circuit_opens_after_consecutive_failures(self):
+        broken = ScriptedBackend("broken", error=api_error(503))
+        healthy = ScriptedBackend("healthy")
+        router = self.router(broken, healthy)
+        self.complete(router)
+        self.assertEqual(broken.circuit(), CLOSED)
+        self.complete(router)
+        self.assertEqual(broken.circuit(), OPEN)
+        self.assertEqual(router.candidates("default"), [healthy])
+        self.complete(router)
+        self.assertEqual(broken.calls, 2)
+
+    def test_rate_limit_opens_the_circuit_for_its_retry_after(self):
+        limited = ScriptedBackend("limited", error=api_error(429, {"retry-after": "2"}))
+        router = self.router(limited, ScriptedBackend("healthy"))
+        self.complete(router)
+        self.assertEqual(limited.circuit(), OPEN)
+        self.assertAlmostEqual(limited.open_until - time.monotonic(), 2, delta=0.5)
+        self.assertGreater(limited.limiter.paused_until, time.monotonic() + 1)
+
+    def open_circuit(self, backend):
+        for _ in range(2):
+            backend.record_failure(api_error(500))
+        self.assertEqual(backend.circuit(), OPEN)
+        time.sleep(COOLDOWN * 2)
+        self.assertEqual(backend.circuit(), HALF_OPEN)
+
+    def test_half_open_circuit_admits_one_trial_call(self):
+        backend = ScriptedBackend("flaky")
+        self.open_circuit(backend)
+        self.assertTrue(backend.available())
+        self.assertTrue(backend.admit())
+        self.assertFalse(backend.admit())
+        self.assertFalse(backend.available())
+        backend.record_success(0.1)
+        self.assertEqual(backend.circuit(), CLOSED)
+        self.assertTrue(backend.admit())
+        self.assertTrue(backend.admit())
+
+    def test_calls_during_the_trial_call_go_elsewhere(self):
+        flaky = ScriptedBackend("flaky")
+        healthy = ScriptedBackend("healthy", reply="fine")
+        router = self.router(flaky, healthy)
+        self.open_circuit(flaky)
+        self.assertTrue(flaky.admit())
+        self.assertEqual(self.complete(router), "fine")
+        self.assertEqual(flaky.calls, 0)
+        flaky.release()
+        self.assertEqual(router.candidates("default")[0], flaky)
+
+    def test_failed_trial_call_reopens_the_circuit(self):
+        flaky = ScriptedBackend("flaky", error=api_error(500))
+        router = self.router(flaky, ScriptedBackend("healthy"))
+        self.open_circuit(flaky)
+        self.complete(router)
+        self.assertEqual(flaky.circuit(), OPEN)
+        self.assertFalse(flaky.probing)
+
+    def test_hedge_wins_and_the_loser_stops(self):
+        slow = ScriptedBackend("slow", reply="a b c d e f", delay=0.2, tpm=60000)
+        fast = ScriptedBackend("fast", reply="fast")
+        # Slow ranks first and hedges after its 0.01s latency
+        slow.record_success(0.01)
+        fast.record_success(0.05)
+        router = self.router(slow, fast, HEDGE=True, HEDGE_MIN_SAMPLES=1)
+        cancelled = requests_with_outcome("hedge", "cancelled")
+        self.assertEqual(self.complete(router, role="hedge"), "fast")
+        self.assertEqual(router.hedges, {"won": 1, "lost": 0})
+        deadline = time.monotonic() + TIMEOUT
+        while requests_with_outcome("hedge", "cancelled") == cancelled:
+            self.assertLess(time.monotonic(), deadline)
+            time.sleep(0.01)
+        self.assertLess(slow.chunks_sent, 6)
+
+    def test_stream_fails_over_before_its_first_chunk(self):
+        broken = ScriptedBackend("broken", error=api_error(500))
+        healthy = ScriptedBackend("healthy", reply="one two")
+        router = self.router(broken, healthy)
+        chunks = list(router.stream("default", None, MESSAGES, 0.7, 50, "test"))
+        self.assertEqual(chunks, ["one", " two"])
+
+    def test_stream_does_not_fail_over_after_its_first_chunk(self):
+        broken = ScriptedBackend("broken", reply="one two", error=api_error(500))
+        broken.fail_after = 1
+        healthy = ScriptedBackend("healthy")
+        router = self.router(broken, healthy)
+        stream = router.stream("default", None, MESSAGES, 0.7, 50, "test")
+        self.assertEqual(next(stream), "one")
+        with self.assertRaises(openai.APIStatusError):
+            next(stream)
+        self.assertEqual(healthy.calls, 0)
+
+    def test_closed_stream_refunds_its_tokens_and_trial_call(self):
+        backend = ScriptedBackend("stream", reply="a b c d", tpm=60000)
+        router = self.router(backend)
+        self.open_circuit(backend)
+        cancelled = requests_with_outcome("closed", "cancelled")
+        stream = router.stream("default", None, MESSAGES, 0.7, 1000, "closed")
+        next(stream)
+        self.assertTrue(backend.probing)
+        # About 1000 tokens reserved at 1000 a second
+        self.assertGreater(backend.limiter.tokens.tat - time.monotonic(), 0.9)
+        stream.close()
+        self.assertLess(backend.limiter.tokens.tat - time.monotonic(), 0.1)
+        self.assertFalse(backend.probing)
+        self.assertEqual(requests_with_outcome("closed", "cancelled"), cancelled + 1)
+
+
+@override_settings(
+    LLM_ROUTER={"FAILURE_THRESHOLD": 2, "COOLDOWN": COOLDOWN},
+    LLM_RATE_LIMITS={"MAX_RETRIES": 0},
+)
+class AsyncModelRouterTests(SimpleTestCase):
+    def router(self, *backends, **conf):
+        return ModelRouter(backends, {**get_router_settings(), **conf})
+
+    async def test_fails_over_to_the_next_backend(self):
+        broken = ScriptedBackend("broken", error=api_error(500))
+        router = self.router(broken, ScriptedBackend("healthy", reply="fine"))
+        content = await router.acomplete(
+            "default", None, MESSAGES, 0.7, 50, None, "test"
+        )
+        self.assertEqual(content, "fine")
+        self.assertEqual(router.failovers, 1)
+
+    async def test_hedge_wins_and_the_loser_is_cancelled(self):
+        slow = ScriptedBackend("slow", reply="slow", delay=TIMEOUT)
+        fast = ScriptedBackend("fast", reply="fast")
+        # Slow ranks first and hedges after its 0.01s latency
+        slow.record_success(0.01)
+        fast.record_success(0.05)
+        router = self.router(slow, fast, HEDGE=True, HEDGE_MIN_SAMPLES=1)
+        cancelled = requests_with_outcome("ahedge", "cancelled")
+        content = await asyncio.wait_for(
+            router.acomplete("default", None, MESSAGES, 0.7, 50, None, "ahedge"),
+            TIMEOUT,
+        )
+        self.assertEqual(content, "fast")
+        await asyncio.sleep(0)
+        self.assertEqual(router.hedges, {"won": 1, "lost": 0})
+        self.assertEqual(requests_with_outcome("ahedge", "cancelled"), cancelled + 1)
+
+    async def test_cancelling_the_caller_cancels_the_hedged_call(self):
+        slow = ScriptedBackend("slow", delay=TIMEOUT)
+        fast = ScriptedBackend("fast")
+        # Slow ranks first and would hedge after its 1s latency
+        slow.record_success(1.0)
+        fast.record_success(2.0)
+        router = self.router(slow, fast, HEDGE=True, HEDGE_MIN_SAMPLES=1)
+        cancelled = requests_with_outcome("acancel", "cancelled")
+        with self.assertRaises(asyncio.TimeoutError):
+            await asyncio.wait_for(
+                router.acomplete("default", None, MESSAGES, 0.7, 50, None, "acancel"),
+                0.05,
+            )
+        await asyncio.sleep(0)
+        self.assertEqual(requests_with_outcome("acancel", "cancelled"), cancelled + 1)
+        self.assertEqual(fast.calls, 0)
+
+    async def test_stream_fails_over_before_its_first_chunk(self):
+        broken = ScriptedBackend("broken", error=api_error(500))
+        router = self.router(broken, ScriptedBackend("healthy", reply="one two"))
+        chunks = [
+            chunk
+            async for chunk in router.astream(
+                "default", None, MESSAGES, 0.7, 50, "test"
+            )
+        ]
+        self.assertEqual(chunks, ["one", " two"])
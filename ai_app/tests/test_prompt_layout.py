@@ -0,0 +1,100 @@
+from django.test import SimpleTestCase, override_settings
+
+from ai_app.services.dialogue_generator import SOLO_DECISION, DialogueGenerator
+from ai_app.services.prompt_layout import PromptLayout
+from ai_app.services.role_registry import Role
+from ai_app.services.token_budget import format_dialogue_context
+
+SAGE = Role(1, "Sage", "A sage", "  Speak wisely.\n", "", 300, 0.7, "", "", ())
+MYSTIC = Role(2, "Mystic", "A mystic", "Speak of union.", "", 300, 0.7, "", "", ())
+
+TURNS = [
+    {"turn": 1, "role": "Sage", "response": "Grace is a gift."},
+    {"turn": 2, "role": "Mystic", "response": "Grace is union."},
+    {"turn": 3, "role": "Monk", "response": "Grace is silence."},
+]
+
+
+class PromptLayoutTests(SimpleTestCase):
+    def test_static_sections_form_the_system_message(self):
+        messages = (
+            PromptLayout("You are a sage.\n", "", "Be brief.")
+            .add("Question: What is grace?", "  ", None)
+            .add("Previous perspectives:\nMonk: Silence.")
+            .messages()
+        )
+        self.assertEqual(
+            messages,
+            [
+                {"role": "system", "content": "You are a sage.\n\nBe brief."},
+                {
+                    "role": "user",
+                    "content": "Question: What is grace?\n\n"
+                    "Previous perspectives:\nMonk: Silence.",
+                },
+            ],
+        )
+
+
+@override_settings(PASSAGE_RETRIEVAL={"ENABLED": False})
+class RolePromptPrefixTests(SimpleTestCase):
+    def setUp(self):
+        self.generator = DialogueGenerator(None)
+
+    def messages(self, role, question, turns, should_debate=False):
+        return self.generator.build_role_messages(
+            role, question, format_dialogue_context(turns), should_debate
+        )
+
+    def test_the_system_prompt_is_fixed_for_a_role_and_mode(self):
+        for should_debate in (False, True):
+            prompts = {
+                self.messages(SAGE, question, turns, should_debate)[0]["content"]
+                for question in ("What is grace?", "What is karma?")
+                for turns in ([], TURNS[:1], TURNS)
+            }
+            self.assertEqual(len(prompts), 1)
+        dialogue = self.messages(SAGE, "What is grace?", [])[0]["content"]
+        debate = self.messages(SAGE, "What is grace?", [], True)[0]["content"]
+        self.assertNotEqual(dialogue, debate)
+        self.assertNotEqual(
+            dialogue, self.messages(MYSTIC, "What is grace?", [])[0]["content"]
+        )
+        self.assertNotIn("What is grace?", dialogue)
+
+    def test_each_turn_extends_the_previous_prompt(self):
+        for should_debate in (False, True):
+            prompts = [
+                self.messages(MYSTIC, "What is grace?", turns, should_debate)
+                for turns in (TURNS[:1], TURNS[:2], TURNS)
+            ]
+            prompts = [user["content"] for _, user in prompts]
+            for shorter, longer in zip(prompts, prompts[1:]):
+                self.assertTrue(longer.startswith(shorter))
+
+    def test_the_debate_position_comes_before_the_dialogue(self):
+        prompt = self.messages(MYSTIC, "What is grace?", TURNS[:1], True)[1]["content"]
+        self.assertTrue(prompt.startswith("Question: What is grace?"))
+        self.assertLess(
+            prompt.index("responding to previous perspectives"),
+            prompt.index("Previous perspectives:"),
+        )
+        first = self.messages(SAGE, "What is grace?", [], True)[1]["content"]
+        self.assertIn("the first speaker", first)
+        self.assertNotIn("Previous perspectives:", first)
+
+    def test_questions_stay_out_of_single_role_and_synthesis_prefixes(self):
+        single = [
+            self.generator.build_single_role_messages(SAGE, question, SOLO_DECISION)
+            for question in ("What is grace?", "What is karma?")
+        ]
+        self.assertEqual(single[0][0], single[1][0])
+        self.assertEqual(single[0][1]["content"], "What is grace?")
+        synthesis = [
+            self.generator.build_synthesis_messages(question, context)
+            for question, context in (
+                ("What is grace?", format_dialogue_context(TURNS[:1])),
+                ("What is karma?", format_dialogue_context(TURNS)),
+            )
+        ]
+        self.assertEqual(synthesis[0][0], synthesis[1][0])
@@ -0,0 +1,157 @@
+import time
+from email.utils import formatdate
+from types import SimpleNamespace
+
+from django.test import SimpleTestCase, override_settings
+
+from ai_app.services.model_router import ModelRouter, get_router_settings
+from ai_app.services.rate_limiter import (
+    QueueFull,
+    Rate,
+    RateLimiter,
+    backoff_delay,
+    parse_duration,
+    retry_after,
+)
+
+
+def error_with_headers(**headers):
+    headers = {name.replace("_", "-"): value for name, value in headers.items()}
+    return SimpleNamespace(response=SimpleNamespace(headers=headers))
+
+
+class RateTests(SimpleTestCase):
+    def test_admits_a_full_bucket_at_once(self):
+        rate = Rate(60)
+        for _ in range(60):
+            wait, rate.tat = rate.reserve(100.0, 1)
+            self.assertEqual(wait, 0.0)
+
+    def test_then_spaces_calls_at_the_refill_rate(self):
+        rate = Rate(60)
+        rate.tat = 160.0  # bucket used up at t=100
+        wait, rate.tat = rate.reserve(100.0, 1)
+        self.assertAlmostEqual(wait, 1.0)
+        wait, rate.tat = rate.reserve(100.0, 1)
+        self.assertAlmostEqual(wait, 2.0)
+
+    def test_bucket_refills_over_time(self):
+        rate = Rate(60)
+        rate.tat = 160.0
+        # Half the bucket is back after 30s
+        wait, _ = rate.reserve(130.0, 30)
+        self.assertEqual(wait, 0.0)
+        wait, _ = rate.reserve(130.0, 31)
+        self.assertAlmostEqual(wait, 1.0)
+        wait, _ = rate.reserve(160.0, 60)
+        self.assertEqual(wait, 0.0)
+
+    def test_refund_moves_the_next_arrival_back(self):
+        rate = Rate(600)
+        rate.tat = 160.0
+        rate.refund(300)
+        wait, _ = rate.reserve(100.0, 300)
+        self.assertEqual(wait, 0.0)
+
+
+class RateLimiterTests(SimpleTestCase):
+    def test_queues_requests_in_arrival_order(self):
+        limiter = RateLimiter("backend", rpm=60)
+        delays = [limiter.acquire() for _ in range(62)]
+        self.assertEqual(delays[:60], [0.0] * 60)
+        self.assertAlmostEqual(delays[60], 1.0, delta=0.05)
+        self.assertAlmostEqual(delays[61], 2.0, delta=0.05)
+
+    def test_queue_full_past_max_queue_delay(self):
+        limiter = RateLimiter("backend", rpm=60, max_queue_delay=1.5)
+        for _ in range(61):
+            limiter.acquire()
+        with self.assertRaises(QueueFull) as raised:
+            limiter.acquire()
+        self.assertAlmostEqual(raised.exception.delay, 2.0, delta=0.05)
+
+    def test_rejected_calls_reserve_nothing(self):
+        limiter = RateLimiter("backend", tpm=600, max_queue_delay=1.0)
+        limiter.acquire(600)
+        tat = limiter.tokens.tat
+        with self.assertRaises(QueueFull):
+            limiter.acquire(600)
+        self.assertEqual(limiter.tokens.tat, tat)
+
+    def test_settle_returns_unused_tokens(self):
+        limiter = RateLimiter("backend", tpm=600, max_queue_delay=1.0)
+        limiter.acquire(600)
+        with self.assertRaises(QueueFull):
+            limiter.acquire(300)
+        limiter.settle(600, 200)
+        self.assertEqual(limiter.acquire(300), 0.0)
+
+    def test_settle_never_takes_more_tokens(self):
+        limiter = RateLimiter("backend", tpm=600)
+        limiter.acquire(100)
+        tat = limiter.tokens.tat
+        limiter.settle(100, 500)
+        limiter.settle(100, None)
+        self.assertEqual(limiter.tokens.tat, tat)
+
+    def test_pause_delays_every_call(self):
+        limiter = RateLimiter("backend", rpm=600)
+        limiter.pause(0.5)
+        self.assertAlmostEqual(limiter.acquire(), 0.5, delta=0.05)
+        unlimited = RateLimiter("backend")
+        unlimited.pause(0.5)
+        self.assertAlmostEqual(unlimited.acquire(), 0.5, delta=0.05)
+
+
+class RetryAfterTests(SimpleTestCase):
+    def test_parses_durations(self):
+        self.assertEqual(parse_duration("1.5"), 1.5)
+        self.assertEqual(parse_duration("20ms"), 0.02)
+        self.assertEqual(parse_duration("6m0s"), 360)
+        self.assertIsNone(parse_duration("soon"))
+
+    def test_reads_retry_after_headers(self):
+        self.assertEqual(retry_after(error_with_headers(retry_after="3")), 3)
+        self.assertEqual(retry_after(error_with_headers(retry_after_ms="250")), 0.25)
+        date = formatdate(time.time() + 60, usegmt=True)
+        self.assertAlmostEqual(
+            retry_after(error_with_headers(retry_after=date)), 60, delta=2
+        )
+
+    def test_reads_the_reset_of_a_used_up_limit(self):
+        error = error_with_headers(
+            x_ratelimit_remaining_requests="0",
+            x_ratelimit_reset_requests="2s",
+            x_ratelimit_remaining_tokens="100",
+            x_ratelimit_reset_tokens="1m",
+        )
+        self.assertEqual(retry_after(error), 2)
+
+    def test_none_without_headers(self):
+        self.assertIsNone(retry_after(ValueError("no response")))
+
+    def test_backoff_waits_at_least_retry_after(self):
+        for attempt in range(5):
+            self.assertLessEqual(backoff_delay(attempt, 0.5, 4.0), 4.0)
+            self.assertGreaterEqual(backoff_delay(attempt, 0.5, 4.0, 10.0), 10.0)
+
+
+@override_settings(LLM_RATE_LIMITS={"MAX_RETRIES": 2, "MAX_QUEUE_DELAY": 30.0})
+class RetryDelayTests(SimpleTestCase):
+    def setUp(self):
+        self.router = ModelRouter([], get_router_settings())
+
+    def test_retries_with_backoff(self):
+        self.assertIsNotNone(self.router._retry_delay(0, ValueError("flaky")))
+        self.assertIsNone(self.router._retry_delay(2, ValueError("flaky")))
+
+    def test_waits_for_retry_after(self):
+        delay = self.router._retry_delay(0, error_with_headers(retry_after="5"))
+        self.assertGreaterEqual(delay, 5)
+
+    def test_does_not_wait_past_max_queue_delay(self):
+        error = error_with_headers(retry_after="3600")
+        self.assertIsNone(self.router._retry_delay(0, error))
+
+    def test_does_not_retry_a_full_queue(self):
+        self.assertIsNone(self.router._retry_delay(0, QueueFull("backend", 60)))
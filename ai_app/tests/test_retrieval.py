@@ -0,0 +1,242 @@
+import os
+import shutil
+import tempfile
+import threading
+from unittest import mock
+
+import numpy as np
+from django.test import SimpleTestCase, override_settings
+
+from ai_app.services.corpus_store import CorpusStore, CorpusStoreBuilder
+from ai_app.services.dialogue_generator import DialogueGenerator
+from ai_app.services.retrieval import (
+    Passage,
+    PassageRetriever,
+    parse_source_texts,
+    reciprocal_rank_fusion,
+    top_ranked,
+)
+from ai_app.services.role_registry import Role
+
+TOPICS = ["karma", "grace", "breath", "silence"]
+
+TEXTS = {
+    "gita": [
+        "Karma is action done without attachment to its fruits.",
+        "The wise act from duty, offering every deed.",
+    ],
+    "psalms": [
+        "Grace is given freely and cannot be earned.",
+        "Be still, and rest in silence before the Lord.",
+    ],
+    "sutras": [
+        "Watch the breath as it enters and leaves the body.",
+        "Silence of the mind is the fruit of patient practice.",
+    ],
+}
+
+
+def fake_embed_texts(texts):
+    """One axis per topic the text mentions, and one shared by every text"""
+    vectors = np.array(
+        [[float(topic in text.lower()) for topic in TOPICS] + [0.1] for text in texts],
+        dtype=np.float32,
+    )
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def write_texts(corpus_dir, texts):
+    for name, passages in texts.items():
+        with open(os.path.join(corpus_dir, f"{name}.txt"), "w") as f:
+            f.write("\n\n".join(passages))
+
+
+@override_settings(EMBEDDING_MODEL="fake-model")
+class StoreTestCase(SimpleTestCase):
+    def setUp(self):
+        for target, value in (
+            ("ai_app.services.corpus_store.embed_texts", fake_embed_texts),
+            ("ai_app.services.corpus_store.embeddings_available", lambda: True),
+        ):
+            patcher = mock.patch(target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        self.corpus_dir = os.path.join(root, "texts")
+        self.store_path = os.path.join(root, "store")
+        os.mkdir(self.corpus_dir)
+        write_texts(self.corpus_dir, TEXTS)
+
+    def build(self, **kw):
+        # One passage per paragraph
+        return CorpusStoreBuilder(self.corpus_dir, self.store_path, 5).build(**kw)
+
+    def open_store(self):
+        store = CorpusStore.open(self.store_path)
+        self.addCleanup(store.close)
+        return store
+
+
+class RankingTests(SimpleTestCase):
+    def test_top_ranked_keeps_the_best_positive_scores(self):
+        scores = np.array([0.2, 0.0, 0.9, 0.5, -1.0])
+        self.assertEqual(list(top_ranked(scores, 2)), [2, 3])
+        self.assertEqual(list(top_ranked(scores, 10)), [2, 3, 0])
+        self.assertEqual(list(top_ranked(scores, 0)), [])
+
+    def test_reciprocal_rank_fusion(self):
+        ids, scores = reciprocal_rank_fusion(
+            [np.array([0, 1, 2]), np.array([2, 0]), np.array([], dtype=np.int64)], 60
+        )
+        # 0 is first and second, 2 third and first, 1 only second
+        self.assertEqual(list(ids), [0, 2, 1])
+        np.testing.assert_allclose(scores, [1 / 61 + 1 / 62, 1 / 63 + 1 / 61, 1 / 62])
+
+    def test_fusing_nothing(self):
+        ids, scores = reciprocal_rank_fusion([np.array([], dtype=np.int64)], 60)
+        self.assertEqual((len(ids), len(scores)), (0, 0))
+
+
+class CorpusStoreTests(StoreTestCase):
+    def test_round_trips_chunks_sources_and_embeddings(self):
+        stats = self.build()
+        self.assertEqual((stats["processed"], stats["chunks"]), (3, 6))
+        store = self.open_store()
+        texts = [text for passages in TEXTS.values() for text in passages]
+        self.assertEqual(list(store.texts()), texts)
+        self.assertEqual(
+            [store.source(i) for i in range(len(store))],
+            ["gita", "gita", "psalms", "psalms", "sutras", "sutras"],
+        )
+        np.testing.assert_allclose(store.embeddings, fake_embed_texts(texts), atol=1e-6)
+        self.assertEqual(len(store.quantized), 6)
+
+    def test_rebuilds_only_changed_files(self):
+        self.build()
+        write_texts(self.corpus_dir, {"gita": ["Karma yoga is selfless action."]})
+        os.remove(os.path.join(self.corpus_dir, "sutras.txt"))
+        stats = self.build()
+        self.assertEqual(
+            {k: stats[k] for k in ("reused", "processed", "embedded", "removed")},
+            {"reused": 1, "processed": 1, "embedded": 1, "removed": 1},
+        )
+        self.assertTrue(stats["indexed"])
+        self.assertEqual(
+            list(self.open_store().texts()),
+            ["Karma yoga is selfless action."] + TEXTS["psalms"],
+        )
+        stats = self.build()
+        self.assertEqual((stats["reused"], stats["indexed"]), (2, False))
+
+    def test_open_stores_keep_reading_their_build(self):
+        self.build()
+        before = self.open_store()
+        write_texts(self.corpus_dir, {"gita": ["Karma yoga is selfless action."]})
+        self.build()
+        self.build()
+        self.assertEqual(before.text(0), TEXTS["gita"][0])
+        self.assertEqual(self.open_store().text(0), "Karma yoga is selfless action.")
+        # Only the current and the previous generation are kept
+        self.assertEqual(
+            sorted(n for n in os.listdir(self.store_path) if n.startswith("gen-")),
+            ["gen-000001", "gen-000002"],
+        )
+
+    def test_a_text_only_store_is_re_embedded(self):
+        self.build(embed=False)
+        self.assertIsNone(self.open_store().embeddings)
+        stats = self.build()
+        self.assertEqual((stats["reused"], stats["embedded"]), (0, 3))
+        self.assertIsNotNone(self.open_store().embeddings)
+
+    def test_a_new_embedding_model_re_embeds(self):
+        self.build()
+        with override_settings(EMBEDDING_MODEL="other-model"):
+            stats = self.build()
+        self.assertEqual(stats["embedded"], 3)
+
+
+class PassageRetrieverTests(StoreTestCase):
+    def retriever(self, budget_ms=1000):
+        self.build()
+        store = self.open_store()
+        retriever = PassageRetriever(2, 0.3, 10, 60, budget_ms)
+        with mock.patch("ai_app.services.retrieval.get_corpus", lambda: store):
+            with mock.patch(
+                "ai_app.services.retrieval.embeddings_available", lambda: True
+            ):
+                with mock.patch(
+                    "ai_app.services.retrieval.get_ann_index", lambda name: None
+                ):
+                    retriever._build()
+        self.assertTrue(retriever.ready)
+        return retriever
+
+    @mock.patch("ai_app.services.retrieval.embed_texts", fake_embed_texts)
+    def test_ranks_lexical_and_semantic_matches(self):
+        passages = self.retriever().search("What is grace?")
+        self.assertEqual(passages[0].source, "psalms")
+        self.assertIn("Grace", passages[0].text)
+
+    def test_ranks_lexically_when_the_embedding_misses_the_budget(self):
+        release = threading.Event()
+
+        def slow_embed_texts(texts):
+            release.wait(5)
+            return fake_embed_texts(texts)
+
+        retriever = self.retriever(budget_ms=10)
+        with mock.patch("ai_app.services.retrieval.embed_texts", slow_embed_texts):
+            lexical = retriever.search("karma")
+            release.set()
+            retriever._query_vector("karma").result(5)
+        self.assertEqual([p.source for p in lexical], ["gita"])
+        # Once the embedding is ready, the next search ranks with it too
+        hybrid = retriever.search("karma")
+        self.assertEqual(len(hybrid), 2)
+        self.assertEqual(hybrid[0].source, "gita")
+
+    @mock.patch("ai_app.services.retrieval.embed_texts", fake_embed_texts)
+    def test_searches_only_the_given_texts(self):
+        retriever = self.retriever()
+        passages = retriever.search("silence", source_texts=["Sutras", "unknown"])
+        self.assertEqual([p.source for p in passages], ["sutras", "sutras"])
+        self.assertIn("Silence", passages[0].text)
+        self.assertEqual(retriever.search("silence", source_texts=["unknown"]), [])
+
+
+class RolePassagesTests(SimpleTestCase):
+    def setUp(self):
+        self.role = Role(
+            1, "Sage", "A sage", "Speak wisely.", "", 300, 0.7, "duty", "gita, ", ()
+        )
+        self.retriever = mock.Mock()
+        patcher = mock.patch(
+            "ai_app.services.dialogue_generator.get_passage_retriever",
+            lambda: self.retriever,
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def user_message(self):
+        messages = DialogueGenerator(None).build_role_messages(
+            self.role, "What is karma?"
+        )
+        return messages[-1]["content"]
+
+    def test_parse_source_texts(self):
+        self.assertEqual(parse_source_texts(" gita, psalms ,,"), ["gita", "psalms"])
+        self.assertEqual(parse_source_texts(None), [])
+
+    def test_role_prompts_include_passages_from_the_roles_texts(self):
+        self.retriever.search.return_value = [Passage("gita", TEXTS["gita"][0], 0.5)]
+        self.assertIn(f"[gita] {TEXTS['gita'][0]}", self.user_message())
+        self.retriever.search.assert_called_once_with(
+            "What is karma?", role_query="duty", source_texts=["gita"]
+        )
+
+    def test_prompts_go_without_passages_when_retrieval_fails(self):
+        self.retriever.search.side_effect = RuntimeError("index is gone")
+        with self.assertLogs("ai_app", "ERROR"):
+            self.assertEqual(self.user_message(), "Question: What is karma?")
@@ -0,0 +1,100 @@
+from unittest import mock
+
+from django.test import TestCase, override_settings
+
+from ai_app.models.llm_role import LLMRole
+from ai_app.services import role_registry
+from ai_app.services.role_registry import RoleRegistryCache
+
+
+@override_settings(
+    CACHES={
+        "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+        "role_registry": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+            "LOCATION": "role-registry-tests",
+            "TIMEOUT": None,
+        },
+    }
+)
+class RoleRegistryTests(TestCase):
+    def setUp(self):
+        self.registry_cache = RoleRegistryCache("role_registry", 60)
+        self.registry_cache.cache.clear()
+        # The signals invalidate this process's cache
+        patcher = mock.patch.object(
+            role_registry, "_role_registry_cache", self.registry_cache
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.sage = LLMRole.objects.create(
+            name="Sage", description="A sage", prompt_template=""
+        )
+
+    def names(self, registry):
+        return {role.name for role in registry.roles}
+
+    def test_the_snapshot_is_served_without_queries(self):
+        registry = role_registry.get_role_registry()
+        self.assertIn("Sage", self.names(registry))
+        with self.assertNumQueries(0):
+            self.assertIs(role_registry.get_role_registry(), registry)
+            self.assertEqual(registry.get("Sage").description, "A sage")
+        with self.assertRaises(LLMRole.DoesNotExist):
+            registry.get("Nobody")
+
+    def test_saving_a_role_reloads_after_commit(self):
+        registry = role_registry.get_role_registry()
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            self.sage.description = "A wise sage"
+            self.sage.save()
+            # Not before the transaction commits
+            self.assertIs(role_registry.get_role_registry(), registry)
+        self.assertEqual(len(callbacks), 1)
+        reloaded = role_registry.get_role_registry()
+        self.assertNotEqual(reloaded.version, registry.version)
+        self.assertEqual(reloaded.get("Sage").description, "A wise sage")
+
+    def test_deleting_a_role_reloads(self):
+        role_registry.get_role_registry()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.sage.delete()
+        self.assertNotIn("Sage", self.names(role_registry.get_role_registry()))
+
+    def test_changing_collaborators_reloads(self):
+        mystic = LLMRole.objects.create(
+            name="Mystic", description="A mystic", prompt_template=""
+        )
+        registry = role_registry.get_role_registry()
+        self.assertEqual(registry.collaborators(registry.get("Sage")), ())
+        with self.captureOnCommitCallbacks(execute=True):
+            self.sage.collaborators.add(mystic)
+        registry = role_registry.get_role_registry()
+        self.assertEqual(
+            [role.name for role in registry.collaborators(registry.get("Sage"))],
+            ["Mystic"],
+        )
+
+    def test_other_processes_reload_on_their_next_version_check(self):
+        other = RoleRegistryCache("role_registry", 60)
+        registry = other.get()
+        with self.captureOnCommitCallbacks(execute=True):
+            LLMRole.objects.create(
+                name="Monk", description="A monk", prompt_template=""
+            )
+        # Until the check interval has passed the snapshot is served as is
+        self.assertIs(other.get(), registry)
+        other._checked_at = 0.0
+        reloaded = other.get()
+        self.assertIn("Monk", self.names(reloaded))
+        self.assertEqual(reloaded.version, self.registry_cache.get().version)
+
+    def test_unchanged_versions_keep_the_snapshot(self):
+        other = RoleRegistryCache("role_registry", 0)
+        registry = other.get()
+        with self.assertNumQueries(0):
+            self.assertIs(other.get(), registry)
+
+    async def test_async_access(self):
+        registry = await role_registry.aget_role_registry()
+        self.assertIs(await role_registry.aget_role_registry(), registry)
@@ -0,0 +1,236 @@
+import asyncio
+import threading
+import time
+
+from django.test import SimpleTestCase
+
+from ai_app.services.singleflight import COMPLETION, STREAM, SingleFlight
+
+TIMEOUT = 5
+
+
+def wait_until(condition):
+    deadline = time.monotonic() + TIMEOUT
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("Timed out")
+        time.sleep(0.001)
+
+
+class SingleFlightTests(SimpleTestCase):
+    def setUp(self):
+        self.flights = SingleFlight()
+
+    def run_callers(self, count, call):
+        """Results (or exceptions) of count threads running call()"""
+        results = [None] * count
+
+        def run(i):
+            try:
+                results[i] = call()
+            except Exception as e:
+                results[i] = e
+
+        threads = [threading.Thread(target=run, args=(i,)) for i in range(count)]
+        for thread in threads:
+            thread.start()
+        return threads, results
+
+    def test_concurrent_calls_share_one_call(self):
+        release = threading.Event()
+        calls = []
+
+        def fn():
+            calls.append(1)
+            release.wait(TIMEOUT)
+            return "completion"
+
+        threads, results = self.run_callers(5, lambda: self.flights.do("key", fn))
+        wait_until(lambda: self.flights.stats()["coalesced"][COMPLETION] == 4)
+        release.set()
+        for thread in threads:
+            thread.join(TIMEOUT)
+        self.assertEqual(results, ["completion"] * 5)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(self.flights.stats()["calls"][COMPLETION], 1)
+
+    def test_followers_get_the_leaders_error(self):
+        release = threading.Event()
+
+        def fn():
+            release.wait(TIMEOUT)
+            raise ValueError("backend down")
+
+        threads, results = self.run_callers(3, lambda: self.flights.do("key", fn))
+        wait_until(lambda: self.flights.stats()["coalesced"][COMPLETION] == 2)
+        release.set()
+        for thread in threads:
+            thread.join(TIMEOUT)
+        self.assertEqual([type(r) for r in results], [ValueError] * 3)
+        self.assertEqual(len({id(r) for r in results}), 1)
+
+    def test_calls_after_the_flight_run_again(self):
+        self.assertEqual(self.flights.do("key", lambda: 1), 1)
+        self.assertEqual(self.flights.do("key", lambda: 2), 2)
+        self.assertEqual(self.flights.do("other", lambda: 3), 3)
+
+    def test_late_followers_replay_the_whole_stream(self):
+        calls = []
+
+        def source():
+            calls.append(1)
+            yield from ["a", "b", "c"]
+
+        first = self.flights.stream("key", source)
+        self.assertEqual(next(first), "a")
+        second = self.flights.stream("key", source)
+        self.assertEqual(list(first), ["b", "c"])
+        self.assertEqual(list(second), ["a", "b", "c"])
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(self.flights.stats()["coalesced"][STREAM], 1)
+
+    def test_streams_run_on_their_callers_threads(self):
+        threads = set()
+
+        def source():
+            for chunk in ["a", "b"]:
+                threads.add(threading.current_thread())
+                yield chunk
+
+        self.assertEqual(list(self.flights.stream("key", source)), ["a", "b"])
+        self.assertEqual(threads, {threading.current_thread()})
+
+    def test_a_follower_pulls_while_the_leader_is_busy(self):
+        release = threading.Event()
+
+        def source():
+            yield "a"
+            release.wait(TIMEOUT)
+            yield "b"
+
+        first = self.flights.stream("key", source)
+        self.assertEqual(next(first), "a")
+        second = self.flights.stream("key", source)
+        # The leader has stopped reading; the follower pulls "b" itself
+        threads, results = self.run_callers(1, lambda: list(second))
+        release.set()
+        threads[0].join(TIMEOUT)
+        self.assertEqual(results, [["a", "b"]])
+        self.assertEqual(list(first), ["b"])
+
+    def test_stream_errors_reach_every_follower(self):
+        def source():
+            yield "a"
+            raise ValueError("cut off")
+
+        for _ in range(2):
+            stream = self.flights.stream("key", source)
+            with self.assertRaises(ValueError):
+                list(stream)
+
+    def test_stream_is_closed_when_every_follower_leaves(self):
+        closed = threading.Event()
+
+        def source():
+            try:
+                while True:
+                    yield "chunk"
+                    time.sleep(0.001)
+            finally:
+                closed.set()
+
+        streams = [self.flights.stream("key", source) for _ in range(2)]
+        for stream in streams:
+            next(stream)
+            stream.close()
+        self.assertTrue(closed.wait(TIMEOUT))
+        # The next caller starts a new call
+        stream = self.flights.stream("key", source)
+        self.assertEqual(next(stream), "chunk")
+        stream.close()
+        self.assertEqual(self.flights.stats()["calls"][STREAM], 2)
+
+
+class AsyncSingleFlightTests(SimpleTestCase):
+    def setUp(self):
+        self.flights = SingleFlight()
+
+    async def test_concurrent_calls_share_one_call(self):
+        release = asyncio.Event()
+        calls = []
+
+        async def call():
+            calls.append(1)
+            await release.wait()
+            return "completion"
+
+        waiters = [asyncio.create_task(self.flights.ado("key", call)) for _ in range(4)]
+        await asyncio.sleep(0)
+        release.set()
+        self.assertEqual(await asyncio.gather(*waiters), ["completion"] * 4)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(self.flights.stats()["coalesced"][COMPLETION], 3)
+
+    async def test_call_survives_until_its_last_waiter_is_cancelled(self):
+        release = asyncio.Event()
+        cancelled = asyncio.Event()
+
+        async def call():
+            try:
+                await release.wait()
+                return "completion"
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+
+        first = asyncio.create_task(self.flights.ado("key", call))
+        second = asyncio.create_task(self.flights.ado("key", call))
+        await asyncio.sleep(0)
+        first.cancel()
+        await asyncio.sleep(0)
+        self.assertFalse(cancelled.is_set())
+        release.set()
+        self.assertEqual(await second, "completion")
+
+        release.clear()
+        third = asyncio.create_task(self.flights.ado("key", call))
+        await asyncio.sleep(0)
+        third.cancel()
+        await asyncio.wait_for(cancelled.wait(), TIMEOUT)
+
+    async def test_streams_fan_out(self):
+        release = asyncio.Event()
+        calls = []
+
+        async def source():
+            calls.append(1)
+            yield "a"
+            await release.wait()
+            yield "b"
+
+        async def collect():
+            return [chunk async for chunk in self.flights.astream("key", source)]
+
+        followers = [asyncio.create_task(collect()) for _ in range(3)]
+        await asyncio.sleep(0.01)
+        release.set()
+        self.assertEqual(await asyncio.gather(*followers), [["a", "b"]] * 3)
+        self.assertEqual(len(calls), 1)
+
+    async def test_stream_is_cancelled_when_every_follower_leaves(self):
+        closed = asyncio.Event()
+
+        async def source():
+            try:
+                while True:
+                    yield "chunk"
+                    await asyncio.sleep(0.001)
+            finally:
+                closed.set()
+
+        streams = [self.flights.astream("key", source) for _ in range(2)]
+        for stream in streams:
+            self.assertEqual(await stream.__anext__(), "chunk")
+        for stream in streams:
+            await stream.aclose()
+        await asyncio.wait_for(closed.wait(), TIMEOUT)
@@ -0,0 +1,125 @@
+import json
+
+from django.test import SimpleTestCase
+
+from ai_app.services.speaker_stream import SpeakerStreamParser, trim_truncated
+
+SPEAKERS = [
+    {"role": "Alchemist", "response": "Lead becomes gold. Slowly."},
+    {"role": "Void Explorer", "response": "Silence answers first!"},
+]
+
+
+def parse(chunks, default_role="Default"):
+    """(parser, events) after feeding chunks and closing"""
+    parser = SpeakerStreamParser(default_role)
+    events = []
+    for chunk in chunks:
+        events.extend(parser.feed(chunk))
+    events.extend(parser.close())
+    return parser, events
+
+
+def deltas(events, index):
+    return "".join(e.text for e in events if e.kind == "delta" and e.index == index)
+
+
+class SpeakerStreamParserTests(SimpleTestCase):
+    def test_parses_a_json_array_in_one_chunk(self):
+        parser, events = parse([json.dumps(SPEAKERS)])
+        self.assertTrue(parser.parsed)
+        self.assertFalse(parser.truncated)
+        self.assertEqual(parser.speakers, SPEAKERS)
+        self.assertEqual(
+            [(e.index, e.role, e.text) for e in events if e.kind == "speaker"],
+            [(i, s["role"], s["response"]) for i, s in enumerate(SPEAKERS)],
+        )
+
+    def test_chunk_boundaries_do_not_change_the_result(self):
+        text = json.dumps(SPEAKERS, indent=2)
+        whole, _ = parse([text])
+        for size in (1, 2, 3, 7):
+            chunks = [text[i : i + size] for i in range(0, len(text), size)]
+            parser, events = parse(chunks)
+            self.assertEqual(parser.speakers, whole.speakers)
+            for i, speaker in enumerate(SPEAKERS):
+                self.assertEqual(deltas(events, i), speaker["response"])
+
+    def test_deltas_arrive_before_the_speaker_closes(self):
+        parser = SpeakerStreamParser("Default")
+        events = parser.feed('[{"role": "Alchemist", "response": "Lead bec')
+        self.assertEqual(
+            [(e.kind, e.role, e.text) for e in events],
+            [("delta", "Alchemist", "Lead bec")],
+        )
+        self.assertEqual(parser.feed('omes"}')[-1].kind, "speaker")
+
+    def test_skips_code_fences_and_prose(self):
+        text = f"Here you go:\n```json\n{json.dumps(SPEAKERS)}\n```\nHope it helps [1]."
+        parser, _ = parse([text])
+        self.assertTrue(parser.parsed)
+        self.assertEqual(parser.speakers, SPEAKERS)
+
+    def test_skips_brackets_in_prose_before_the_json(self):
+        parser, _ = parse(["Two [voices] answer: ", json.dumps(SPEAKERS)])
+        self.assertEqual(parser.speakers, SPEAKERS)
+
+    def test_decodes_escapes(self):
+        speakers = [{"role": "Sage", "response": 'Say "om"\n\tthen \\ rest'}]
+        text = json.dumps(speakers)
+        parser, events = parse(list(text))
+        self.assertEqual(parser.speakers, speakers)
+        self.assertEqual(deltas(events, 0), speakers[0]["response"])
+
+    def test_surrogate_pairs_split_across_chunks(self):
+        speakers = [{"role": "Sage", "response": "Joy \U0001f600 and peace"}]
+        text = json.dumps(speakers)  # ASCII, the emoji escaped as a surrogate pair
+        self.assertIn("\\ud83d\\ude00", text)
+        parser, events = parse(list(text))
+        self.assertEqual(parser.speakers, speakers)
+        for event in events:
+            self.assertFalse(
+                any("\ud800" <= c <= "\udfff" for c in event.text), event.text
+            )
+        self.assertEqual(deltas(events, 0), speakers[0]["response"])
+
+    def test_salvages_a_truncated_speaker(self):
+        text = json.dumps(SPEAKERS)
+        cut = text.index("answers first")
+        parser, events = parse([text[:cut]])
+        self.assertTrue(parser.truncated)
+        self.assertEqual(
+            parser.speakers,
+            [SPEAKERS[0], {"role": "Void Explorer", "response": "Silence..."}],
+        )
+        self.assertEqual(events[-1].kind, "speaker")
+
+    def test_truncated_response_is_cut_back_to_a_sentence(self):
+        parser, _ = parse(['[{"role": "Sage", "response": "One. Two and thr'])
+        self.assertTrue(parser.truncated)
+        self.assertEqual(parser.speakers[0]["response"], "One.")
+
+    def test_falls_back_to_the_whole_text(self):
+        parser, events = parse(["```\nJust prose, ", "no JSON.\n```"])
+        self.assertFalse(parser.parsed)
+        self.assertEqual(
+            parser.speakers, [{"role": "Default", "response": "Just prose, no JSON."}]
+        )
+        self.assertEqual(events[-1].role, "Default")
+
+    def test_missing_role_takes_the_default(self):
+        parser, _ = parse(['[{"response": "Hello."}]'])
+        self.assertEqual(parser.speakers, [{"role": "Default", "response": "Hello."}])
+
+    def test_ignores_text_after_the_array(self):
+        parser, _ = parse([json.dumps(SPEAKERS) + ' [{"role": "x", "response": "y"}]'])
+        self.assertEqual(parser.speakers, SPEAKERS)
+
+
+class TrimTruncatedTests(SimpleTestCase):
+    def test_cuts_back_to_the_last_sentence(self):
+        self.assertEqual(trim_truncated('He said "go." Then we wa'), 'He said "go."')
+
+    def test_marks_text_without_a_sentence_end(self):
+        self.assertEqual(trim_truncated("no sentence end "), "no sentence end...")
+        self.assertEqual(trim_truncated(""), "")
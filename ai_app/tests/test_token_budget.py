@@ -0,0 +1,107 @@
+from collections import Counter
+
+from django.test import SimpleTestCase, override_settings
+
+from ai_app.services.dialogue_generator import DialogueGenerator
+from ai_app.services.role_registry import Role
+from ai_app.services.token_budget import (
+    TokenBudget,
+    TokenCounter,
+    approximate_tokens,
+    format_dialogue_context,
+    key_sentences,
+)
+
+LONG_TURN = (
+    "Karma binds the one who acts for reward. "
+    "The weather was pleasant that day. "
+    "Selfless karma frees the heart from desire. "
+    "Many people enjoy long walks. "
+    "Action offered without attachment is karma yoga."
+)
+
+
+def turn(role, response):
+    return {"role": role, "response": response}
+
+
+class TokenCounterTests(SimpleTestCase):
+    def test_estimates_without_a_tokenizer(self):
+        counter = TokenCounter(None)
+        self.assertEqual(counter.count("a" * 40), 10)
+        self.assertEqual(counter.count(""), 0)
+        self.assertEqual(counter.keep_last("abcdefgh", 1), "efgh")
+        self.assertFalse(counter._started)
+
+    def test_counts_messages_with_their_framing(self):
+        counter = TokenCounter(None)
+        messages = [{"role": "user", "content": "a" * 40}] * 2
+        self.assertEqual(counter.count_messages(messages), 2 * (10 + 4))
+
+
+class KeySentencesTests(SimpleTestCase):
+    def test_keeps_the_most_relevant_sentences_in_order(self):
+        weights = Counter({"reward": 3, "desire": 3})
+        self.assertEqual(
+            key_sentences(LONG_TURN, weights, 2),
+            "Karma binds the one who acts for reward. "
+            "Selfless karma frees the heart from desire.",
+        )
+
+    def test_short_texts_are_kept(self):
+        self.assertEqual(key_sentences("One. Two.", Counter(), 2), "One. Two.")
+
+
+class TokenBudgetTests(SimpleTestCase):
+    def setUp(self):
+        self.budget = TokenBudget(TokenCounter(None), 1, 1)
+        self.conversation = [
+            turn("Sage", LONG_TURN),
+            turn("Mystic", LONG_TURN),
+            turn("Monk", "Silence is the answer."),
+        ]
+
+    def test_a_dialogue_that_fits_is_unchanged(self):
+        context = format_dialogue_context(self.conversation)
+        self.assertEqual(self.budget.fit(self.conversation, 1000), context)
+
+    def test_older_turns_shrink_to_key_sentences(self):
+        context = self.budget.fit(self.conversation, 40, "What is karma?")
+        self.assertLessEqual(approximate_tokens(context), 40)
+        self.assertEqual(
+            context,
+            "\n\nSage: Action offered without attachment is karma yoga."
+            "\n\nMystic: Action offered without attachment is karma yoga."
+            "\n\nMonk: Silence is the answer.",
+        )
+
+    def test_then_the_oldest_turns_are_dropped(self):
+        context = self.budget.fit(self.conversation, 35, "What is karma?")
+        self.assertLessEqual(approximate_tokens(context), 35)
+        self.assertTrue(
+            context.startswith("\n\n(Earlier perspectives from Sage omitted")
+        )
+        self.assertIn("Mystic: Action offered", context)
+        context = self.budget.fit(self.conversation, 25, "What is karma?")
+        self.assertIn("from Sage, Mystic omitted", context)
+        self.assertTrue(context.endswith("Monk: Silence is the answer."))
+
+    def test_last_resort_keeps_the_most_recent_tokens(self):
+        context = self.budget.fit(self.conversation, 3)
+        self.assertLessEqual(approximate_tokens(context), 3)
+        self.assertTrue("Monk: Silence is the answer.".endswith(context))
+
+
+@override_settings(
+    DIALOGUE_TOKEN_BUDGET={"ROLE_PROMPT_TOKENS": 10, "MIN_CONTEXT_TOKENS": 50},
+    PASSAGE_RETRIEVAL={"ENABLED": False},
+)
+class FitRoleContextTests(SimpleTestCase):
+    def test_a_full_prompt_still_gets_the_minimum_context(self):
+        role = Role(1, "Sage", "A sage", "Speak wisely.", "", 300, 0.7, "", "", ())
+        conversation = [turn("Mystic", LONG_TURN * 3)]
+        context = DialogueGenerator(None).fit_role_context(
+            role, "What is karma?", conversation
+        )
+        self.assertGreater(approximate_tokens(context), 10)
+        self.assertLessEqual(approximate_tokens(context), 50)
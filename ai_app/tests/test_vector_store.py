@@ -0,0 +1,75 @@
+import os
+import shutil
+import tempfile
+
+import numpy as np
+from django.test import SimpleTestCase
+
+from ai_app.services.vector_store import QuantizedVectors, top_k
+
+K = 10
+
+
+def unit_vectors(rng, count, dim=64):
+    vectors = rng.standard_normal((count, dim)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+class QuantizedVectorsTests(SimpleTestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.vectors = unit_vectors(rng, 3000)
+        self.queries = unit_vectors(rng, 20)
+        self.quantized = QuantizedVectors.quantize(self.vectors)
+
+    def recall(self, quantized, start=0, end=None):
+        end = len(self.vectors) if end is None else end
+        found = 0
+        for query in self.queries:
+            exact = set(top_k(self.vectors[start:end] @ query, K) + start)
+            rows, _ = quantized.search(query, K, start, end)
+            found += len(exact & set(rows))
+        return found / (K * len(self.queries))
+
+    def test_codes_are_a_quarter_of_the_floats(self):
+        self.assertEqual(self.quantized.codes.dtype, np.uint8)
+        self.assertEqual(self.quantized.nbytes * 4, self.vectors.nbytes)
+
+    def test_approximate_scores_are_close(self):
+        query = self.queries[0]
+        error = np.abs(self.quantized.scores(query) - self.vectors @ query)
+        self.assertLess(error.max(), 0.02)
+
+    def test_recall_against_exact_search(self):
+        self.assertGreaterEqual(self.recall(self.quantized), 0.98)
+
+    def test_recall_without_the_float_vectors(self):
+        codes_only = QuantizedVectors(
+            self.quantized.codes, self.quantized.offset, self.quantized.scale
+        )
+        self.assertGreaterEqual(self.recall(codes_only), 0.9)
+
+    def test_results_are_exact_scores_best_first(self):
+        rows, scores = self.quantized.search(self.queries[0], K)
+        np.testing.assert_allclose(scores, self.vectors[rows] @ self.queries[0])
+        self.assertTrue(np.all(np.diff(scores) <= 0))
+
+    def test_searching_a_range_of_rows(self):
+        rows, _ = self.quantized.search(self.queries[0], K, 1000, 1600)
+        self.assertTrue(np.all((rows >= 1000) & (rows < 1600)))
+        self.assertGreaterEqual(self.recall(self.quantized, 1000, 1600), 0.98)
+
+    def test_saved_codes_open_memory_mapped(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        path = os.path.join(root, "embeddings.npy")
+        self.assertIsNone(QuantizedVectors.open(path))
+        np.save(path, self.vectors)
+        self.quantized.save(path)
+        opened = QuantizedVectors.open(path)
+        self.assertIsInstance(opened.codes, np.memmap)
+        self.assertIsInstance(opened.vectors, np.memmap)
+        np.testing.assert_array_equal(opened.codes, self.quantized.codes)
+        self.assertEqual(self.recall(opened), self.recall(self.quantized))
+        QuantizedVectors.remove(path)
+        self.assertIsNone(QuantizedVectors.open(path))
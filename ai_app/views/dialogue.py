@@ -1,20 +1,38 @@
 from django.http import JsonResponse, StreamingHttpResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_POST
-from ai_app.models.history import History
 from ai_app.models.llm_role import LLMRole
-from ai_app.models.user import User
-from ai_app.services.dialogue_generator import DialogueGenerator
-from ai_app.services.model_rotation import OpenAIService
+from ai_app.services.dialogue_generator import (
+    DIALOGUE_MODES,
+    SEQUENTIAL_MODE,
+    SYNTHESIS_ROLE,
+    AsyncDialogueGenerator,
+)
+from ai_app.services.history_writer import get_history_writer
+from ai_app.services.mock_backend import get_mock_settings
+from ai_app.services.model_rotation import AsyncOpenAIService
+from ai_app.services.role_registry import aget_role_registry
 import json
+import uuid
 import logging
 
 logger = logging.getLogger("ai_app")
 
 
+def record_dialogue_turn(dialogue_id, user_prompt, turn):
+    """Queue one {"turn", "role", "response"} turn of a dialogue for saving"""
+    get_history_writer().record(
+        user_prompt,
+        turn["response"],
+        role_name=None if turn["role"] == SYNTHESIS_ROLE else turn["role"],
+        dialogue_id=dialogue_id,
+        turn=turn["turn"],
+    )
+
+
 @csrf_exempt
 @require_POST
-def ask_role(request):
+async def ask_role(request):
     try:
 
         if not request.body:
@@ -25,6 +43,9 @@ def ask_role(request):
         user_prompt = data.get("prompt")
         role_name = data.get("role")
         use_ollama = data.get("use_ollama", False)
+        use_cache = not data.get("no_cache", False)
+        use_mock = data.get("use_mock", get_mock_settings()["ENABLED"])
+        speculative = data.get("speculative")
 
         if not user_prompt or not role_name:
             logger.error(
@@ -32,29 +53,21 @@ def ask_role(request):
             )
             return JsonResponse({"error": "Missing prompt or role"}, status=400)
 
-        openai_service = OpenAIService(use_ollama=use_ollama)
-        dialogue_generator = DialogueGenerator(openai_service)
-
-        result = dialogue_generator.process_single_role(role_name, user_prompt)
+        openai_service = AsyncOpenAIService(
+            use_ollama=use_ollama, use_cache=use_cache, use_mock=use_mock
+        )
+        dialogue_generator = AsyncDialogueGenerator(openai_service)
 
-        History.objects.create(
-            user=User.objects.get(username="testuser"),
-            prompt=user_prompt,
-            response=result["raw_content"],
-            role=LLMRole.objects.get(name=role_name),
+        result = await dialogue_generator.process_single_role(
+            role_name, user_prompt, speculative=speculative
         )
 
-        return JsonResponse(
-            {
-                "response": result["response_data"],
-                "collaboration": (
-                    result["collab_decision"]
-                    if result["collab_decision"].get("should_collaborate")
-                    else None
-                ),
-            }
+        get_history_writer().record(
+            user_prompt, result["raw_content"], role_name=role_name
         )
 
+        return JsonResponse(ask_role_payload(result))
+
     except json.JSONDecodeError as e:
         logger.error(f"JSON decode error: {str(e)}, Request body: {request.body}")
         return JsonResponse({"error": "Invalid JSON format"}, status=400)
@@ -65,25 +78,108 @@ def ask_role(request):
         return JsonResponse({"error": "Internal server error"}, status=500)
 
 
+def ask_role_payload(result):
+    return {
+        "response": result["response_data"],
+        "collaboration": (
+            result["collab_decision"]
+            if result["collab_decision"].get("should_collaborate")
+            else None
+        ),
+    }
+
+
+@csrf_exempt
+@require_POST
+async def stream_ask_role(request):
+    try:
+        data = json.loads(request.body)
+        user_prompt = data.get("prompt")
+        role_name = data.get("role")
+        use_ollama = data.get("use_ollama", False)
+        use_cache = not data.get("no_cache", False)
+        use_mock = data.get("use_mock", get_mock_settings()["ENABLED"])
+        speculative = data.get("speculative")
+        if not user_prompt or not role_name:
+            return JsonResponse({"error": "Missing prompt or role"}, status=400)
+        # Checked before streaming so an unknown role is still a 404
+        (await aget_role_registry()).get(role_name)
+
+        async def response_stream():
+            openai_service = AsyncOpenAIService(
+                use_ollama=use_ollama, use_cache=use_cache, use_mock=use_mock
+            )
+            dialogue_generator = AsyncDialogueGenerator(openai_service)
+
+            yield json.dumps(
+                {"type": "start", "data": {"prompt": user_prompt, "role": role_name}}
+            ) + "\n"
+
+            try:
+                async for event in dialogue_generator.stream_single_role(
+                    role_name, user_prompt, speculative=speculative
+                ):
+                    if event["type"] == "result":
+                        result = event["data"]
+                        get_history_writer().record(
+                            user_prompt, result["raw_content"], role_name=role_name
+                        )
+                        event = {"type": "result", "data": ask_role_payload(result)}
+                    yield json.dumps(event) + "\n"
+            except Exception as e:
+                logger.error(f"Error in stream_ask_role: {str(e)}", exc_info=True)
+                yield json.dumps(
+                    {"type": "error", "data": {"role": role_name, "error": str(e)}}
+                ) + "\n"
+
+            yield json.dumps({"type": "complete", "data": None}) + "\n"
+
+        return StreamingHttpResponse(
+            response_stream(), content_type="application/x-ndjson"
+        )
+
+    except json.JSONDecodeError:
+        logger.error("JSON decode error", exc_info=True)
+        return JsonResponse({"error": "Invalid JSON"}, status=400)
+    except LLMRole.DoesNotExist:
+        return JsonResponse({"error": f"Role '{role_name}' not found"}, status=404)
+    except Exception as e:
+        logger.error(f"Error in stream_ask_role: {str(e)}", exc_info=True)
+        return JsonResponse({"error": str(e)}, status=500)
+
+
 @csrf_exempt
 @require_POST
-def full_dialogue(request):
+async def full_dialogue(request):
     try:
         data = json.loads(request.body)
         user_prompt = data.get("prompt")
         should_debate = data.get("debate")
         use_ollama = data.get("use_ollama", False)
-        logger.info(f"Received debate: {should_debate}")
+        use_cache = not data.get("no_cache", False)
+        use_mock = data.get("use_mock", get_mock_settings()["ENABLED"])
+        mode = data.get("mode", SEQUENTIAL_MODE)
+        logger.info(f"Received debate: {should_debate}, mode: {mode}")
         if not user_prompt:
             return JsonResponse({"error": "No prompt provided"}, status=400)
+        if mode not in DIALOGUE_MODES:
+            return JsonResponse({"error": f"Unknown mode '{mode}'"}, status=400)
 
-        openai_service = OpenAIService(use_ollama=use_ollama)
-        dialogue_generator = DialogueGenerator(openai_service)
-        result = dialogue_generator.process_full_dialogue(user_prompt, should_debate)
+        openai_service = AsyncOpenAIService(
+            use_ollama=use_ollama, use_cache=use_cache, use_mock=use_mock
+        )
+        dialogue_generator = AsyncDialogueGenerator(openai_service)
+        result = await dialogue_generator.process_full_dialogue(
+            user_prompt, should_debate, mode
+        )
+        dialogue_id = uuid.uuid4()
+        for turn in result["conversation"]:
+            record_dialogue_turn(dialogue_id, user_prompt, turn)
 
         return JsonResponse(
             {
                 "original_prompt": user_prompt,
+                "mode": mode,
                 "conversation": result["conversation"],
                 "final_analysis": result["final_analysis"],
             }
@@ -99,26 +195,36 @@ def full_dialogue(request):
 
 @csrf_exempt
 @require_POST
-def stream_dialogue(request):
+async def stream_dialogue(request):
     try:
         data = json.loads(request.body)
         user_prompt = data.get("prompt")
         should_debate = data.get("debate")
         use_ollama = data.get("use_ollama", False)
+        use_cache = not data.get("no_cache", False)
+        use_mock = data.get("use_mock", get_mock_settings()["ENABLED"])
+        mode = data.get("mode", SEQUENTIAL_MODE)
         if not user_prompt:
             return JsonResponse({"error": "No prompt provided"}, status=400)
+        if mode not in DIALOGUE_MODES:
+            return JsonResponse({"error": f"Unknown mode '{mode}'"}, status=400)
 
-        def response_stream():
-            openai_service = OpenAIService(use_ollama=use_ollama)
-            dialogue_generator = DialogueGenerator(openai_service)
+        async def response_stream():
+            openai_service = AsyncOpenAIService(
+                use_ollama=use_ollama, use_cache=use_cache, use_mock=use_mock
+            )
+            dialogue_generator = AsyncDialogueGenerator(openai_service)
+            dialogue_id = uuid.uuid4()
 
             # Send initial message
             yield json.dumps({"type": "start", "data": {"prompt": user_prompt}}) + "\n"
 
             # Stream each response
-            for response in dialogue_generator.stream_full_dialogue(
-                user_prompt, should_debate
+            async for response in dialogue_generator.stream_full_dialogue(
+                user_prompt, should_debate, mode
             ):
+                if response["type"] in ("response", "synthesis"):
+                    record_dialogue_turn(dialogue_id, user_prompt, response["data"])
                 yield json.dumps(response) + "\n"
 
             # Send completion message
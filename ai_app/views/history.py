@@ -1,6 +1,10 @@
 from django.http import JsonResponse
 from django.views.decorators.csrf import csrf_exempt
-from ai_app.models.history import History
+from ..services.history_query import (
+    HistoryQuery,
+    HistorySearchUnavailable,
+    InvalidHistoryQuery,
+)
 from ..services.response_formatter import ResponseFormatter
 import logging
 
@@ -9,6 +13,15 @@ logger = logging.getLogger("ai_app")
 
 @csrf_exempt
 def get_conversation_history(request):
-    history = History.objects.all().order_by("-created_at")
+    """Newest-first history, `limit` rows at a time; pass the returned
+    next_cursor as `cursor` for the next page. Filters: role (name), user
+    (id or username), since and until (ISO 8601). With `similar`, the
+    rows with the closest prompts instead, best first."""
+    try:
+        history, next_cursor = HistoryQuery(request.GET).page()
+    except InvalidHistoryQuery as e:
+        return JsonResponse({"error": str(e)}, status=400)
+    except HistorySearchUnavailable as e:
+        return JsonResponse({"error": str(e)}, status=503)
     history_data = ResponseFormatter.format_history(history)
-    return JsonResponse({"history": history_data})
+    return JsonResponse({"history": history_data, "next_cursor": next_cursor})
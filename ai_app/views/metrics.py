@@ -0,0 +1,8 @@
+from django.http import HttpResponse
+from ai_app.services.metrics import registry
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def metrics(request):
+    return HttpResponse(registry.render(), content_type=PROMETHEUS_CONTENT_TYPE)
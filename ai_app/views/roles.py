@@ -1,11 +1,11 @@
 from django.http import JsonResponse
 from django.views.decorators.csrf import csrf_exempt
-from ai_app.models.llm_role import LLMRole
 from ai_app.services.response_formatter import ResponseFormatter
+from ai_app.services.role_registry import get_role_registry
 
 
 @csrf_exempt
 def list_roles(request):
-    roles = LLMRole.objects.all()
+    roles = get_role_registry().roles
     roles_data = ResponseFormatter.format_roles(roles)
     return JsonResponse({"roles": roles_data}, safe=False)
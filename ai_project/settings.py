@@ -42,6 +42,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "ai_app.middleware.metrics_middleware",
     "corsheaders.middleware.CorsMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
@@ -72,6 +73,10 @@ TEMPLATES = [
 
 WSGI_APPLICATION = "ai_project.wsgi.application"
 
+# The dialogue views are async; serve them through ASGI (e.g. uvicorn) so a
+# single worker can hold many in-flight LLM calls.
+ASGI_APPLICATION = "ai_project.asgi.application"
+
 
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
@@ -154,3 +159,230 @@ LOGGING = {
         },
     },
 }
+
+# Pooled HTTP clients shared by every request in a worker process
+# (see ai_app.services.client_pool). Timeouts are in seconds.
+LLM_CLIENT_POOL = {
+    "MAX_CONNECTIONS": 100,
+    "MAX_KEEPALIVE_CONNECTIONS": 20,
+    "KEEPALIVE_EXPIRY": 30.0,
+    "CONNECT_TIMEOUT": 5.0,
+    "READ_TIMEOUT": 120.0,
+}
+
+# Maximum number of roles answering at once in "panel" dialogue mode
+DIALOGUE_PANEL_CONCURRENCY = 8
+
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    },
+    # Shared by every worker process on the host
+    "llm_completions": {
+        "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+        "LOCATION": BASE_DIR / ".cache" / "llm_completions",
+        "TIMEOUT": 3600,
+        "OPTIONS": {"MAX_ENTRIES": 5000},
+    },
+    # Role registry version (see ROLE_REGISTRY); never expires, and kept apart
+    # from the completions so that their culling can't evict it
+    "role_registry": {
+        "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+        "LOCATION": BASE_DIR / ".cache" / "role_registry",
+        "TIMEOUT": None,
+    },
+}
+
+# Cache of identical LLM completions (see ai_app.services.completion_cache).
+# BACKEND "memory" is an in-process LRU with a TTL; "django" stores entries in
+# CACHES[CACHE_ALIAS] so hits are shared across worker processes. Requests can
+# skip the cache with "no_cache": true.
+LLM_COMPLETION_CACHE = {
+    "BACKEND": "memory",
+    "MAX_ENTRIES": 512,
+    "TTL": 3600,
+    "CACHE_ALIAS": "llm_completions",
+}
+
+# sentence-transformers model used for local routing and retrieval
+EMBEDDING_MODEL = "all-MiniLM-L6-v2"
+
+# Local collaboration decisions for /ask-role/. A prompt whose best cosine
+# similarity to a collaborator's description or triggers is at least
+# COLLABORATE_THRESHOLD collaborates, below SOLO_THRESHOLD answers alone, and
+# anything in between falls back to asking the LLM.
+COLLABORATION_ROUTER = {
+    "ENABLED": True,
+    "COLLABORATE_THRESHOLD": 0.5,
+    "SOLO_THRESHOLD": 0.25,
+}
+
+# Start the solo /ask-role/ completion while the LLM is still deciding on
+# collaboration, and keep it if the answer is "no collaboration". Requests can
+# opt in or out with "speculative": true/false.
+SPECULATIVE_EXECUTION = {
+    "ENABLED": False,
+    "MAX_WORKERS": 8,
+}
+
+# LLM backends the model router (see ai_app.services.model_router) chooses
+# from. Requests with "use_ollama" or "use_mock" go to backends of that
+# BACKEND kind, the rest to the OpenAI-compatible ones (BASE_URL, with the key
+# in the API_KEY_ENV variable; GitHub Models and GITHUB_TOKEN by default).
+# FALLBACK backends also take over when every backend of a request's own
+# kind has failed. RPM and TPM are the backend's requests and tokens per
+# minute; calls over them wait their turn client-side (see LLM_RATE_LIMITS).
+# GitHub Models' low tier allows 15 requests a minute.
+LLM_BACKENDS = [
+    {
+        "NAME": "github/gpt-4o-mini",
+        "BACKEND": "github",
+        "MODEL": "gpt-4o-mini",
+        "RPM": 15,
+    },
+    {"NAME": "ollama/llama3.2", "BACKEND": "ollama", "MODEL": "llama3.2"},
+    {"NAME": "mock", "BACKEND": "mock", "MODEL": "mock"},
+]
+
+# Each call goes to the healthy backend with the lowest smoothed latency over
+# its recent success rate (outcomes of the last WINDOW calls). A backend's
+# circuit opens for COOLDOWN seconds after FAILURE_THRESHOLD consecutive
+# failures, or for Retry-After on a 429, and its calls fail over to the next
+# backend. With HEDGE on, a completion slower than the HEDGE_QUANTILE latency
+# of its backend (once HEDGE_MIN_SAMPLES are known) is also sent to the next
+# backend, and the first answer wins. Roles' model_name (or its MODEL_ALIASES
+# entry) picks the backends serving that model; roles asking for a model no
+# backend of the request's kind serves use that kind's default backends.
+LLM_ROUTER = {
+    "WINDOW": 50,
+    "LATENCY_SMOOTHING": 0.2,
+    "FAILURE_THRESHOLD": 3,
+    "COOLDOWN": 30.0,
+    "HEDGE": False,
+    "HEDGE_QUANTILE": 0.95,
+    "HEDGE_MIN_SAMPLES": 20,
+    "HEDGE_WORKERS": 16,
+    "MODEL_ALIASES": {"gpt-3.5-turbo": "gpt-4o-mini"},
+}
+
+# With the cascade on, single-role answers are first generated by the cheap
+# model in MODELS for the request's kind of backend ("default", "ollama",
+# "mock"), and only re-generated by the role's own model when the answer
+# isn't valid JSON. Roles already on the cheap model aren't cascaded.
+LLM_CASCADE = {
+    "ENABLED": False,
+    "MODELS": {"default": "gpt-4o-mini", "ollama": "llama3.2"},
+}
+
+# Calls over a backend's RPM/TPM queue in arrival order, up to MAX_QUEUE_DELAY
+# seconds before failing over. A call that fails on every backend with a
+# retryable error is retried up to MAX_RETRIES times after a full-jitter
+# exponential backoff (BACKOFF_BASE doubling up to BACKOFF_MAX seconds), and
+# never sooner than a 429's Retry-After or x-ratelimit-reset-* headers; calls
+# asked to wait longer than MAX_QUEUE_DELAY fail instead of retrying. Queue
+# delays and retries are exported as llm_queue_delay_seconds and
+# llm_retries_total.
+LLM_RATE_LIMITS = {
+    "MAX_RETRIES": 3,
+    "BACKOFF_BASE": 0.5,
+    "BACKOFF_MAX": 20.0,
+    "MAX_QUEUE_DELAY": 30.0,
+}
+
+# Concurrent LLM calls with identical messages and parameters share one
+# backend call (see ai_app.services.singleflight); streamed calls replay the
+# shared stream to every caller. Counted in llm_singleflight_* metrics.
+LLM_SINGLEFLIGHT = {
+    "ENABLED": True,
+}
+
+# Prompt token budgets for full dialogues. Tokens are counted locally with the
+# TOKENIZER (hub id or tokenizer.json path, or None to estimate ~4 characters
+# per token). When the dialogue so far doesn't fit, the RECENT_TURNS latest
+# turns stay verbatim, older turns shrink to their KEY_SENTENCES most salient
+# sentences and are then dropped oldest-first. The dialogue always gets at
+# least MIN_CONTEXT_TOKENS, however long the prompt.
+DIALOGUE_TOKEN_BUDGET = {
+    "TOKENIZER": "gpt2",
+    "ROLE_PROMPT_TOKENS": 1500,
+    "SYNTHESIS_PROMPT_TOKENS": 3000,
+    "RECENT_TURNS": 2,
+    "KEY_SENTENCES": 2,
+    "MIN_CONTEXT_TOKENS": 200,
+}
+
+# Offline mock LLM backend (see ai_app.services.mock_backend) for load tests and
+# benchmarks. Requests opt in with "use_mock": true, or ENABLED makes it the
+# default. Responses are deterministic per prompt and SEED; TTFT and
+# TOKEN_LATENCY are in seconds, ERROR_RATE and RATE_LIMIT_RATE are the chance
+# of a 500 or a 429 (with a RETRY_AFTER header) per call.
+LLM_MOCK_BACKEND = {
+    "ENABLED": False,
+    "TTFT": 0.05,
+    "TOKEN_LATENCY": 0.01,
+    "RESPONSE_TOKENS": 60,
+    "ERROR_RATE": 0.0,
+    "RATE_LIMIT_RATE": 0.0,
+    "RETRY_AFTER": 1,
+    "SEED": 0,
+}
+
+# Chunked source texts, written to PATH by `python manage.py build_corpus_store`
+# (see ai_app.services.corpus_store). Rebuilds only re-chunk and re-embed files
+# whose content changed; workers memory-map the result.
+CORPUS_STORE = {
+    "CORPUS_DIR": BASE_DIR / "datasets" / "spiritual_texts",
+    "PATH": BASE_DIR / ".cache" / "corpus",
+    "PASSAGE_WORDS": 120,
+}
+
+# Passages from the corpus added to role prompts (see
+# ai_app.services.retrieval). LLMRole.source_texts limits a role to its own
+# texts. BM25 and embedding rankings (CANDIDATES each) are merged with
+# reciprocal rank fusion; ROLE_WEIGHT weights the role's collaboration
+# triggers in the BM25 query. A query embedding that isn't ready within
+# LATENCY_BUDGET_MS is skipped and the search ranks with BM25 alone; searches
+# that still take longer log a warning.
+PASSAGE_RETRIEVAL = {
+    "ENABLED": True,
+    "TOP_K": 3,
+    "ROLE_WEIGHT": 0.3,
+    "CANDIDATES": 50,
+    "RRF_K": 60,
+    "LATENCY_BUDGET_MS": 5,
+}
+
+# IVF nearest-neighbour indexes over passage embeddings and history prompts
+# (see ai_app.services.ann_index), built with `python manage.py
+# build_ann_index`. New History rows are embedded and appended as they are
+# saved; re-run the command now and then to fold them into the lists. Each
+# search scans the NPROBE closest of LISTS_PER_SQRT * sqrt(n) lists;
+# `python manage.py benchmark_ann_index` reports recall against exact search.
+ANN_INDEX = {
+    "ENABLED": True,
+    "PATH": BASE_DIR / ".cache" / "ann",
+    "NPROBE": 8,
+    "LISTS_PER_SQRT": 4,
+}
+
+# Write-behind History persistence (see ai_app.services.history_writer).
+# Records are saved with bulk_create every BATCH_SIZE records or
+# FLUSH_INTERVAL seconds; what can't be saved (or exceeds MAX_PENDING) goes
+# to SPOOL_PATH and is replayed with the next batch. Rows are attributed to
+# USERNAME until the API has authentication.
+HISTORY_WRITER = {
+    "BATCH_SIZE": 100,
+    "FLUSH_INTERVAL": 1.0,
+    "MAX_PENDING": 10000,
+    "SPOOL_PATH": BASE_DIR / ".cache" / "history_spool.jsonl",
+    "USERNAME": "testuser",
+}
+
+# Roles and collaborators are read from an in-process snapshot (see
+# ai_app.services.role_registry) rebuilt when a role changes. Changes store a
+# new version in CACHES[CACHE_ALIAS], which other worker processes check at most
+# every VERSION_CHECK_INTERVAL seconds.
+ROLE_REGISTRY = {
+    "CACHE_ALIAS": "role_registry",
+    "VERSION_CHECK_INTERVAL": 1.0,
+}
@@ -14,3 +14,9 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'ai_project.settings')
 
 application = get_wsgi_application()
+
+from ai_app.services.token_budget import get_token_counter  # noqa: E402
+
+# The tokenizer may come from the hub; fetch it before the first request, but
+# only in serving processes rather than in every management command
+get_token_counter().warm_up()